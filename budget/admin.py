@@ -1,11 +1,74 @@
 from django.contrib import admin
+from django.db import transaction
 
-from budget.models import Income, Expense, Category, IncomeCategory, Debts, Subcategory
+from budget import amortization, bulk, rollups
+from budget.cache import bump_ledger_version
+from budget.models import Income, Expense, Category, IncomeCategory, Debts, DebtPayment, Subcategory
 
-admin.site.register(Income)
-admin.site.register(Expense)
 admin.site.register(Category)
 admin.site.register(IncomeCategory)
-admin.site.register(Debts)
 admin.site.register(Subcategory)
 
+
+class LedgerAdmin(admin.ModelAdmin):
+    """
+        Операции в админке: месячные итоги меняются так же, как в представлениях, - прежняя запись
+        вычитается из итогов, новая добавляется, массовое удаление идет через bulk.bulk_delete.
+    """
+    apply_rollup = None
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if change:
+                self.apply_rollup(self.model.objects.get(pk=obj.pk), sign=-1)
+            super().save_model(request, obj, form, change)
+            self.apply_rollup(obj)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self.apply_rollup(obj, sign=-1)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        bulk.bulk_delete(queryset)
+
+
+@admin.register(Expense)
+class ExpenseAdmin(LedgerAdmin):
+    apply_rollup = staticmethod(rollups.apply_expense)
+
+
+@admin.register(Income)
+class IncomeAdmin(LedgerAdmin):
+    apply_rollup = staticmethod(rollups.apply_income)
+
+
+@admin.register(Debts)
+class DebtsAdmin(admin.ModelAdmin):
+    """
+        Долги в админке: дата окончания и график платежей пересчитываются при каждом сохранении.
+    """
+    readonly_fields = ('end_date',)
+
+    def save_model(self, request, obj, form, change):
+        obj.end_date = amortization.add_months(obj.start_date, obj.repayment_period_months)
+        super().save_model(request, obj, form, change)
+        amortization.materialize_schedules([obj])
+        transaction.on_commit(lambda: bump_ledger_version(obj.user_id))
+
+
+@admin.register(DebtPayment)
+class DebtPaymentAdmin(admin.ModelAdmin):
+    """
+        График платежей только для просмотра: он строится из долга.
+    """
+    list_display = ('debt', 'number', 'due_date', 'payment', 'principal', 'interest', 'balance')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,128 @@
+"""
+    Графики погашения долгов.
+
+    Графики считаются сразу для набора долгов на массивах numpy (долги x месяцы, короткие
+    графики дополняются маской): аннуитетные и дифференцированные платежи с ежемесячным
+    начислением процентов. Даты платежей - те же числа следующих месяцев (31 января -> 28/29 февраля).
+    Суммы округляются до копеек, последний платеж погашает остаток так, что сумма долга
+    по графику совпадает с суммой долга. График сохраняется в DebtPayment при создании долга.
+    numpy импортируется при первом расчете, а не при импорте модуля.
+"""
+import calendar
+from datetime import date
+from decimal import Decimal
+
+ANNUITY = 'annuity'
+DIFFERENTIATED = 'differentiated'
+METHOD_CHOICES = [
+    (ANNUITY, 'Аннуитетный'),
+    (DIFFERENTIATED, 'Дифференцированный'),
+]
+
+CENT = Decimal('0.01')
+
+
+def add_months(day, months):
+    """
+        Та же дата через months месяцев; если такого числа нет, последний день месяца.
+    """
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    month += 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _due_dates(np, start_dates, numbers):
+    # Даты платежей для всех долгов сразу: месяц начала + номер платежа, число не больше длины месяца.
+    starts = np.array(start_dates, dtype='datetime64[D]')
+    first_days = starts.astype('datetime64[M]')[:, None] + numbers
+    month_lengths = ((first_days + 1).astype('datetime64[D]') - first_days.astype('datetime64[D]')).astype(int)
+    days = (starts - starts.astype('datetime64[M]').astype('datetime64[D]')).astype(int)[:, None]
+    return first_days.astype('datetime64[D]') + np.minimum(days, month_lengths - 1)
+
+
+def compute_schedules(principals, annual_rates, months, methods, start_dates):
+    """
+        Рассчитывает графики для набора долгов. Аргументы - последовательности одинаковой длины:
+        сумма долга, годовая ставка в процентах, срок в месяцах, способ погашения и дата начала.
+        Возвращает словарь массивов размера (долги x max(months)): 'due_date', 'payment', 'principal',
+        'interest', 'balance' и 'mask' (True для существующих платежей).
+    """
+    import numpy as np
+
+    principal = np.asarray([float(value) for value in principals])[:, None]
+    rate = np.asarray([float(value or 0) / 1200 for value in annual_rates])[:, None]
+    terms = np.maximum(np.asarray(months, dtype=int), 1)[:, None]
+    annuity = np.asarray([method != DIFFERENTIATED for method in methods])[:, None]
+    numbers = np.arange(1, int(terms.max(initial=1)) + 1)[None, :]
+    mask = numbers <= terms
+
+    has_rate = rate > 0
+    safe_rate = np.where(has_rate, rate, 1.0)
+    growth = (1 + safe_rate) ** (numbers - 1)
+    level_payment = np.where(has_rate, principal * safe_rate / (1 - (1 + safe_rate) ** -terms), principal / terms)
+    # Остаток перед платежом k: для аннуитета - по формуле наращения, для дифференцированного - линейно.
+    annuity_balance = np.where(has_rate, principal * growth - level_payment * (growth - 1) / safe_rate,
+                               principal - level_payment * (numbers - 1))
+    linear_balance = principal - principal / terms * (numbers - 1)
+    opening = np.where(annuity, annuity_balance, linear_balance)
+
+    interest = np.round(np.where(mask, opening * rate, 0), 2)
+    repaid = np.where(annuity, level_payment - opening * rate, principal / terms)
+    principal_part = np.round(np.where(mask, repaid, 0), 2)
+    # Последний платеж закрывает остаток после округления.
+    last = (np.arange(len(terms)), terms[:, 0] - 1)
+    principal_part[last] += np.round(principal[:, 0] - principal_part.sum(axis=1), 2)
+    balance = np.where(mask, np.round(principal - np.cumsum(principal_part, axis=1), 2), 0)
+
+    return {
+        'due_date': _due_dates(np, start_dates, numbers),
+        'payment': np.round(principal_part + interest, 2),
+        'principal': principal_part,
+        'interest': interest,
+        'balance': balance,
+        'mask': mask,
+    }
+
+
+def _money(value):
+    return Decimal(repr(float(value))).quantize(CENT)
+
+
+def build_payments(debts, payment_model=None):
+    """
+        Строит несохраненные записи DebtPayment графиков долгов debts.
+        payment_model позволяет передать историческую модель из миграции.
+    """
+    if payment_model is None:
+        from .models import DebtPayment
+        payment_model = DebtPayment
+    debts = list(debts)
+    if not debts:
+        return []
+    schedule = compute_schedules([debt.amount for debt in debts], [debt.interest_rate for debt in debts],
+                                 [debt.repayment_period_months for debt in debts],
+                                 [debt.payment_method for debt in debts], [debt.start_date for debt in debts])
+    payments = []
+    for row, debt in enumerate(debts):
+        for column in range(int(schedule['mask'][row].sum())):
+            payments.append(payment_model(
+                debt_id=debt.pk, number=column + 1, due_date=schedule['due_date'][row, column].item(),
+                payment=_money(schedule['payment'][row, column]),
+                principal=_money(schedule['principal'][row, column]),
+                interest=_money(schedule['interest'][row, column]),
+                balance=_money(schedule['balance'][row, column]),
+            ))
+    return payments
+
+
+def materialize_schedules(debts, payment_model=None, batch_size=1000):
+    """
+        Пересоздает графики платежей долгов debts. Возвращает число созданных платежей.
+    """
+    if payment_model is None:
+        from .models import DebtPayment
+        payment_model = DebtPayment
+    debts = list(debts)
+    payment_model.objects.filter(debt_id__in=[debt.pk for debt in debts]).delete()
+    return len(payment_model.objects.bulk_create(build_payments(debts, payment_model), batch_size=batch_size))
@@ -0,0 +1,150 @@
+"""
+    Массовые операции над расходами и доходами: удаление, перенос на другую дату,
+    смена категории и изменение суммы в заданное число раз.
+
+    Строки выборки (список id или период и категория, ограниченные пользователями области)
+    сначала блокируются (SELECT ... FOR UPDATE), после чего операция выполняется одним
+    UPDATE/DELETE на пачку заблокированных id. Месячные итоги поддерживаются так же, как при
+    изменении одной записи: суммы пачки по ключу итогов вычитаются до операции и добавляются
+    после, только вместо одной записи - одним агрегирующим запросом на пачку. Так как строки
+    заблокированы, параллельное изменение не может попасть между агрегатом и UPDATE.
+"""
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import Abs, Round
+from django.utils.dateparse import parse_date
+
+from . import rollups
+from .models import Expense, Income
+
+DELETE = 'delete'
+SET_DATE = 'set_date'
+RECATEGORIZE = 'recategorize'
+SCALE = 'scale'
+ACTIONS = (DELETE, SET_DATE, RECATEGORIZE, SCALE)
+LOCK_BATCH_SIZE = 500
+
+# Поле категории, по которому можно отобрать и которое можно изменить у каждой модели.
+CATEGORY_FIELDS = {
+    Expense: ('category_id', 'subcategory_id'),
+    Income: ('income_category_id',),
+}
+
+
+def _parse_date(value, name):
+    try:
+        parsed = parse_date(value or '')
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f'неверная дата "{value}" в параметре {name}')
+    return parsed
+
+
+def select_rows(model, user_ids, ids=None, start_date=None, end_date=None, **categories):
+    """
+        Выборка операций пользователей user_ids по списку id и/или периоду (включительно) и категории.
+        Пустая выборка без условий запрещена, чтобы случайно не затронуть все операции.
+    """
+    queryset = model.objects.alive().filter(user_id__in=user_ids)
+    conditions = {}
+    if ids:
+        try:
+            conditions['id__in'] = [int(pk) for pk in ids]
+        except (TypeError, ValueError):
+            raise ValueError('неверный список id')
+    if start_date:
+        conditions['date__gte'] = _parse_date(start_date, 'start_date')
+    if end_date:
+        conditions['date__lte'] = _parse_date(end_date, 'end_date')
+    for field, value in categories.items():
+        if field not in CATEGORY_FIELDS[model]:
+            raise ValueError(f'неизвестный фильтр {field}')
+        if value:
+            conditions[field] = value
+    if not conditions:
+        raise ValueError('не задано ни одного условия отбора')
+    return queryset.filter(**conditions)
+
+
+def _replaced(groups, **values):
+    return [{**group, **values} for group in groups]
+
+
+def _lock(queryset):
+    # id строк выборки, заблокированных до конца транзакции (в порядке id, чтобы не было взаимоблокировок).
+    return list(queryset.select_for_update(of=('self',)).order_by('id').values_list('id', flat=True))
+
+
+def _change_locked(model, ids, change, regroup=None):
+    # Выполняет change(пачка) по заблокированным id и переносит суммы пачки в месячных итогах:
+    # вычитает прежние, затем добавляет regroup(пачка, прежние суммы), если он задан.
+    changed = 0
+    for start in range(0, len(ids), LOCK_BATCH_SIZE):
+        rows = model.objects.filter(id__in=ids[start:start + LOCK_BATCH_SIZE])
+        groups = rollups.rollup_groups(rows)
+        changed += change(rows)
+        rollups.apply_groups(model, groups, sign=-1)
+        if regroup:
+            rollups.apply_groups(model, regroup(rows, groups))
+    return changed
+
+
+@transaction.atomic
+def bulk_delete(queryset):
+    """
+        Удаляет выборку. Возвращает число удаленных записей.
+    """
+    return _change_locked(queryset.model, _lock(queryset), lambda rows: rows.delete()[0])
+
+
+@transaction.atomic
+def bulk_set_date(queryset, new_date):
+    """
+        Переносит выборку на дату new_date (date или строка ГГГГ-ММ-ДД).
+        Возвращает число измененных записей.
+    """
+    if not isinstance(new_date, date):
+        new_date = _parse_date(new_date, 'new_date')
+    return _change_locked(queryset.model, _lock(queryset), lambda rows: rows.update(date=new_date),
+                          lambda rows, groups: _replaced(groups, year=new_date.year, month=new_date.month))
+
+
+@transaction.atomic
+def bulk_recategorize(queryset, **categories):
+    """
+        Переносит выборку в другую категорию (для расходов - и подкатегорию).
+        Возвращает число измененных записей.
+    """
+    if set(categories) != set(CATEGORY_FIELDS[queryset.model]):
+        raise ValueError('не указана новая категория')
+    return _change_locked(queryset.model, _lock(queryset), lambda rows: rows.update(**categories),
+                          lambda rows, groups: _replaced(groups, **categories))
+
+
+@transaction.atomic
+def bulk_scale(queryset, factor):
+    """
+        Умножает суммы выборки на factor (с округлением до копеек).
+        Возвращает число измененных записей. Если новая сумма не помещается в поле amount, ничего не меняется.
+    """
+    try:
+        factor = Decimal(str(factor))
+    except InvalidOperation:
+        raise ValueError(f'неверный множитель "{factor}"')
+    if not factor.is_finite() or factor <= 0:
+        raise ValueError(f'неверный множитель "{factor}"')
+    model = queryset.model
+    ids = _lock(queryset)
+    amount = model._meta.get_field('amount')
+    # Суммы, которые после округления до копеек достигнут 10^(max_digits - decimal_places), не помещаются в поле.
+    limit = Decimal(10) ** (amount.max_digits - amount.decimal_places) - Decimal('0.005')
+    largest = queryset.aggregate(largest=Max(Abs('amount')))['largest']
+    if largest is not None and largest * factor >= limit:
+        raise ValueError(f'множитель "{factor}" слишком велик для суммы {largest}')
+    # Суммы по отдельности округлены в базе, поэтому новые итоги считаются по измененным строкам.
+    return _change_locked(model, ids, lambda rows: rows.update(amount=Round(F('amount') * factor, 2)),
+                          lambda rows, groups: rollups.rollup_groups(rows))
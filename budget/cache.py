@@ -0,0 +1,116 @@
+"""
+    Кэш отрисованных графиков отчетов.
+
+    Ключ графика состоит из области (пользователь или семья), периода, типа графика
+    и отметки версии данных. Версия данных хранится для каждого пользователя и
+    увеличивается при любой записи в Expense/Income/Debts, поэтому после изменения данных
+    старые графики просто перестают запрашиваться и вытесняются кэшем.
+    Та же версия служит для ETag страниц списков и отчетов (ответ 304 без запросов к данным).
+"""
+import hashlib
+import time
+from datetime import date
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .routers import read_alias, reads_from_primary
+from .scope import get_scope
+
+LEDGER_VERSION_KEY = 'ledger-version:user:{}'
+LEDGER_EPOCH_KEY = 'ledger-version:epoch'
+CHART_KEY = 'chart:{scope}:{period}:{chart_type}:{stamp}'
+CHART_HITS_KEY = 'chart-cache:hits'
+CHART_MISSES_KEY = 'chart-cache:misses'
+CHART_TIMEOUT = 60 * 60 * 24
+
+
+def _initial_version():
+    # Версия начинается с текущего времени, чтобы версия, вытесненная из кэша,
+    # не начиналась заново с уже использованного значения.
+    return int(time.time() * 1000)
+
+
+def _incr(key, initial):
+    if cache.add(key, initial, timeout=None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, timeout=None)
+
+
+def bump_ledger_version(user_id=None):
+    """
+        Увеличивает версию данных пользователя. Без user_id сбрасывает версии всех пользователей.
+    """
+    if user_id is None:
+        _incr(LEDGER_EPOCH_KEY, _initial_version())
+    else:
+        _incr(LEDGER_VERSION_KEY.format(user_id), _initial_version())
+
+
+def ledger_stamp(user_ids):
+    """
+        Возвращает отметку версии данных для набора пользователей одним запросом к кэшу.
+    """
+    keys = [LEDGER_EPOCH_KEY] + [LEDGER_VERSION_KEY.format(user_id) for user_id in sorted(set(user_ids))]
+    versions = cache.get_many(keys)
+    missing = {key: _initial_version() for key in keys if key not in versions}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        versions = cache.get_many(keys)
+    raw = ','.join(f'{key}={versions.get(key)}' for key in keys)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def ledger_etag(request, *args, **kwargs):
+    """
+        ETag страницы списка или отчета: версия данных области пользователя, адрес с параметрами
+        и текущая дата (списки и отчеты по умолчанию показывают текущий месяц), а также ключ сессии
+        и CSRF-секрет: страницы содержат формы с CSRF-токеном, который меняется при входе в систему.
+        Если страница читается с реплики, которая может отставать от версии данных,
+        или у пользователя есть непоказанные сообщения, ETag не выдается.
+    """
+    if read_alias(request.user) != DEFAULT_DB_ALIAS or len(messages.get_messages(request)):
+        return None
+    scope = get_scope(request)
+    user = request.user
+    raw = '|'.join([ledger_stamp(scope.user_ids), scope.key, str(user.pk), user.first_name, user.last_name,
+                    request.get_full_path(), date.today().isoformat(), request.session.session_key or '',
+                    request.META.get('CSRF_COOKIE', '')])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def get_or_render_chart(scope, period, chart_type, user_ids, render):
+    """
+        Возвращает график из кэша или вызывает render() и сохраняет результат.
+        График, построенный по данным реплики, в кэш не сохраняется.
+    """
+    key = CHART_KEY.format(scope=scope, period=period, chart_type=chart_type, stamp=ledger_stamp(user_ids))
+    graphic = cache.get(key)
+    if graphic is not None:
+        _incr(CHART_HITS_KEY, 1)
+        return graphic
+    _incr(CHART_MISSES_KEY, 1)
+    graphic = render()
+    if reads_from_primary():
+        cache.set(key, graphic, timeout=CHART_TIMEOUT)
+    return graphic
+
+
+def chart_cache_stats():
+    """
+        Возвращает счетчики попаданий и промахов кэша графиков.
+    """
+    counters = cache.get_many([CHART_HITS_KEY, CHART_MISSES_KEY])
+    hits = counters.get(CHART_HITS_KEY, 0)
+    misses = counters.get(CHART_MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def reset_chart_cache_stats():
+    cache.delete_many([CHART_HITS_KEY, CHART_MISSES_KEY])
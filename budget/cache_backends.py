@@ -0,0 +1,191 @@
+"""
+    Двухуровневый кэш: ограниченный LRU в памяти процесса (L1) перед общим кэшем (L2).
+
+    Чтение сначала идет в L1 и только при промахе - в общий кэш (Redis или его замена).
+    Любая запись (set, add, delete, incr) уходит в L2 и публикует сообщение об инвалидации:
+    в L2 увеличивается счетчик версий, а под номером версии сохраняется измененный ключ.
+    Каждый процесс не чаще раза в SYNC_INTERVAL секунд сверяет счетчик и удаляет из своего L1
+    ключи из новых сообщений; если сообщения потеряны (вытеснены или кэш очищен), L1 очищается целиком.
+    Записи в L1 живут не дольше L1_TIMEOUT секунд, что ограничивает устаревание в худшем случае.
+
+    Настройка в CACHES: BACKEND 'budget.cache_backends.TwoTierCache', LOCATION - алиас общего кэша.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+VERSION_KEY = 'tiered-cache:version'
+MESSAGE_KEY = 'tiered-cache:message:{}'
+MESSAGE_TIMEOUT = 60 * 60
+MAX_REPLAYED_MESSAGES = 1000
+
+_MISSING = object()
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = location or 'default'
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 1))
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 60))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_version = None
+        self._next_sync = 0.0
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    # --- L1 ---
+
+    def _local_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _remember(self, key, value, timeout, version):
+        timeout = self.get_backend_timeout(timeout)
+        lifetime = self._l1_timeout if timeout is None else min(timeout - time.time(), self._l1_timeout)
+        if lifetime <= 0:
+            return
+        local_key = self._local_key(key, version)
+        with self._lock:
+            self._entries[local_key] = (value, time.monotonic() + lifetime)
+            self._entries.move_to_end(local_key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _recall(self, key, version):
+        local_key = self._local_key(key, version)
+        with self._lock:
+            entry = self._entries.get(local_key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[local_key]
+                return _MISSING
+            self._entries.move_to_end(local_key)
+            return value
+
+    def _forget(self, local_keys):
+        with self._lock:
+            for local_key in local_keys:
+                self._entries.pop(local_key, None)
+
+    def _forget_all(self):
+        with self._lock:
+            self._entries.clear()
+
+    # --- инвалидация между процессами ---
+
+    def _publish(self, *keys, version=None):
+        local_keys = [self._local_key(key, version) for key in keys]
+        self._forget(local_keys)
+        self.l2.add(VERSION_KEY, 0, timeout=None)
+        try:
+            message_version = self.l2.incr(VERSION_KEY)
+        except ValueError:
+            return
+        self.l2.set(MESSAGE_KEY.format(message_version), local_keys, timeout=MESSAGE_TIMEOUT)
+
+    def sync(self, force=False):
+        """
+            Применяет сообщения об инвалидации, опубликованные другими процессами.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self._sync_interval
+        current = self.l2.get(VERSION_KEY)
+        seen = self._seen_version
+        self._seen_version = current or 0
+        if seen is None or current == seen:
+            return
+        if current is None or current < seen or current - seen > MAX_REPLAYED_MESSAGES:
+            self._forget_all()
+            return
+        message_keys = [MESSAGE_KEY.format(number) for number in range(seen + 1, current + 1)]
+        messages = self.l2.get_many(message_keys)
+        if len(messages) < len(message_keys):
+            self._forget_all()
+            return
+        self._forget(local_key for local_keys in messages.values() for local_key in local_keys)
+
+    # --- API кэша ---
+
+    def get(self, key, default=None, version=None):
+        self.sync()
+        value = self._recall(key, version)
+        if value is not _MISSING:
+            return value
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        self._remember(key, value, self.l2.default_timeout, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.sync()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._recall(key, version)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            fetched = self.l2.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self._remember(key, value, self.l2.default_timeout, version)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout=timeout, version=version)
+        self._publish(key, version=version)
+        self._remember(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout=timeout, version=version)
+        self._publish(*data, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._publish(key, version=version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version=version)
+        self._publish(key, version=version)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version=version)
+        self._publish(*keys, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self._publish(key, version=version)
+        return value
+
+    def clear(self):
+        self.l2.clear()
+        self._forget_all()
+        self._seen_version = None
@@ -0,0 +1,95 @@
+"""
+    Дерево категорий и подкатегорий расходов пользователя для форм ввода расходов.
+
+    Дерево загружается одним запросом (категории с LEFT JOIN подкатегорий) и хранится
+    в двухуровневом кэше 'tiered' под версией категорий пользователя. Версия увеличивается
+    при добавлении и удалении категорий и подкатегорий, поэтому старое дерево перестает
+    запрашиваться. Формы фильтруют подкатегории на клиенте, а POST проверяет выбранные id
+    по дереву из кэша без запросов к базе.
+"""
+import time
+
+from django.core.cache import caches
+
+from .models import Category
+
+CATEGORY_VERSION_KEY = 'category-version:user:{}'
+CATEGORY_TREE_KEY = 'category-tree:user:{}:{}'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+cache = caches['tiered']
+
+
+def category_version(user_id):
+    """
+        Текущая версия категорий пользователя.
+    """
+    key = CATEGORY_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_category_version(user_id):
+    """
+        Увеличивает версию категорий пользователя после изменения категорий или подкатегорий.
+    """
+    key = CATEGORY_VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def category_tree_etag(request, *args, **kwargs):
+    """
+        ETag дерева категорий текущего пользователя - версия его категорий.
+    """
+    return str(category_version(request.user.id))
+
+
+def _load_tree(user_id):
+    rows = Category.objects.filter(user_id=user_id).order_by('name', 'id', 'subcategories__name') \
+        .values_list('id', 'name', 'subcategories__id', 'subcategories__name', 'subcategories__deleted_at')
+    tree = {}
+    for category_id, name, subcategory_id, subcategory_name, deleted_at in rows:
+        category = tree.setdefault(category_id, {'id': category_id, 'name': name, 'subcategories': []})
+        if subcategory_id is not None and deleted_at is None:
+            category['subcategories'].append({'id': subcategory_id, 'name': subcategory_name})
+    return list(tree.values())
+
+
+def category_tree(user_id, refresh=False):
+    """
+        Список категорий пользователя [{'id', 'name', 'subcategories': [{'id', 'name'}]}] из кэша или из базы.
+    """
+    key = CATEGORY_TREE_KEY.format(user_id, category_version(user_id))
+    tree = None if refresh else cache.get(key)
+    if tree is None:
+        tree = _load_tree(user_id)
+        cache.set(key, tree, timeout=CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def subcategories_of(tree, category_id):
+    """
+        Подкатегории категории category_id из дерева (пустой список, если категории нет).
+    """
+    for category in tree:
+        if str(category['id']) == str(category_id):
+            return category['subcategories']
+    return []
+
+
+def is_valid_choice(user_id, category_id, subcategory_id):
+    """
+        Проверяет, что подкатегория принадлежит категории пользователя. Если пары нет в дереве из кэша,
+        дерево перечитывается из базы (категория могла быть создана в обход представлений).
+    """
+    for refresh in (False, True):
+        subcategories = subcategories_of(category_tree(user_id, refresh=refresh), category_id)
+        if any(str(subcategory['id']) == str(subcategory_id) for subcategory in subcategories):
+            return True
+    return False
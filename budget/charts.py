@@ -0,0 +1,172 @@
+"""
+    Потокобезопасная отрисовка графиков отчетов.
+
+    Графики рисуются через объектный API matplotlib (Figure + холст Agg) без глобального
+    состояния pyplot, в ограниченном пуле потоков. Представления передают только описание
+    графика (spec) - словарь с ключом 'type' и данными, - и получают PNG или SVG.
+    matplotlib импортируется при первой отрисовке, а не при импорте модуля.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+INCOME_EXPENSE = 'income_expense'
+CATEGORY_EXPENSE = 'category_expense'
+TREND = 'trend'
+
+PNG = 'png'
+SVG = 'svg'
+CONTENT_TYPES = {PNG: 'image/png', SVG: 'image/svg+xml'}
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+_local = threading.local()
+
+
+class ChartQueueFull(Exception):
+    """
+        Очередь отрисовки заполнена и место не освободилось за время ожидания.
+    """
+
+
+def income_expense_spec(total_income, total_expense, income_balance, top_expenses):
+    return {
+        'type': INCOME_EXPENSE,
+        'total_income': total_income,
+        'total_expense': total_expense,
+        'income_balance': income_balance,
+        'categories': [expense['category__name'] for expense in top_expenses],
+        'amounts': [expense['total_amount'] for expense in top_expenses],
+    }
+
+
+def category_expense_spec(category_name, subcategories_data):
+    return {
+        'type': CATEGORY_EXPENSE,
+        'category_name': category_name,
+        'subcategories': [expense['name'] for expense in subcategories_data],
+        'amounts': [expense['total_expense'] for expense in subcategories_data],
+    }
+
+
+def trend_spec(trend):
+    return {
+        'type': TREND,
+        'months': trend['months'],
+        'income': trend['income'],
+        'expense': trend['expense'],
+        'balance': trend['balance'],
+    }
+
+
+def _draw_income_expense(fig, spec):
+    axes = fig.subplots(1, 2)
+    amounts = [float(spec['total_expense']), float(spec['total_income'])]
+    axes[0].pie(amounts, labels=['Расходы', 'Доходы'], autopct='%1.1f%%', colors=['lightblue', 'lightcoral'],
+                explode=(0.1, 0), shadow=True, startangle=140)
+    axes[0].set_title('Доходы и расходы')
+
+    axes[0].text(-1.5, 1.5, f"Общий доход: {spec['total_income']}", horizontalalignment='center',
+                 verticalalignment='center', fontsize=12)
+    axes[0].text(-1.5, 1.3, f"Расходы: {spec['total_expense']}", horizontalalignment='center',
+                 verticalalignment='center', fontsize=12)
+    axes[0].text(-1.5, 1.1, f"Остаток: {spec['income_balance']}", horizontalalignment='center',
+                 verticalalignment='center', fontsize=12)
+
+    axes[1].pie([float(amount) for amount in spec['amounts']], labels=spec['categories'], autopct='%1.1f%%',
+                shadow=True, startangle=140)
+    axes[1].set_title('Общий расход по категориям')
+
+
+def _draw_category_expense(fig, spec):
+    ax = fig.subplots()
+    ax.pie([float(amount) for amount in spec['amounts']], labels=spec['subcategories'], autopct='%1.1f%%')
+    ax.set_title(f"Расходы по категории: {spec['category_name']}")
+
+
+def _draw_trend(fig, spec):
+    ax = fig.subplots()
+    positions = range(len(spec['months']))
+    ax.bar(positions, [float(amount) for amount in spec['balance']], color='lightgray', label='Остаток')
+    ax.plot(positions, [float(amount) for amount in spec['income']], marker='o', color='seagreen', label='Доходы')
+    ax.plot(positions, [float(amount) for amount in spec['expense']], marker='o', color='indianred', label='Расходы')
+    step = max(1, len(spec['months']) // 12)
+    ax.set_xticks(list(positions)[::step], spec['months'][::step], rotation=45)
+    ax.set_title('Доходы и расходы по месяцам')
+    ax.legend()
+    fig.tight_layout()
+
+
+_DRAWERS = {
+    INCOME_EXPENSE: (_draw_income_expense, (15, 8)),
+    CATEGORY_EXPENSE: (_draw_category_expense, (6.4, 4.8)),
+    TREND: (_draw_trend, (12, 6)),
+}
+
+
+def _buffer():
+    # У каждого потока пула свой буфер, который переиспользуется между графиками.
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+
+def draw(spec, fmt=PNG):
+    """
+        Рисует график по описанию и возвращает содержимое файла PNG или SVG. Не использует pyplot.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    draw_figure, figsize = _DRAWERS[spec['type']]
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw_figure(fig, spec)
+    buffer = _buffer()
+    if fmt == SVG:
+        fig.savefig(buffer, format='svg', metadata={'Date': None})
+    else:
+        fig.canvas.print_png(buffer)
+    return buffer.getvalue()
+
+
+def _get_executor():
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'CHART_RENDER_WORKERS', 2)
+                _slots = threading.BoundedSemaphore(workers * getattr(settings, 'CHART_RENDER_QUEUE_FACTOR', 4))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chart-render')
+    return _executor
+
+
+def submit_chart(spec, fmt):
+    """
+        Ставит отрисовку графика в пул. Если очередь заполнена, ждет освобождения места
+        не дольше CHART_RENDER_QUEUE_TIMEOUT секунд, затем выбрасывает ChartQueueFull.
+        Результат - содержимое файла в формате fmt ('png' или 'svg').
+    """
+    executor = _get_executor()
+    if not _slots.acquire(timeout=getattr(settings, 'CHART_RENDER_QUEUE_TIMEOUT', 2)):
+        raise ChartQueueFull('Очередь отрисовки графиков заполнена')
+    try:
+        future = executor.submit(draw, spec, fmt)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def render_chart(spec, fmt, timeout=None):
+    """
+        Отрисовывает график в пуле и возвращает содержимое файла в формате fmt.
+    """
+    return submit_chart(spec, fmt).result(timeout=timeout or getattr(settings, 'CHART_RENDER_TIMEOUT', 30))
@@ -0,0 +1,140 @@
+"""
+    Хранилище курсов валют НБ РБ.
+
+    Последние полученные курсы хранятся в таблице CurrencyRate, а перед ней стоит кэш
+    с временем жизни CURRENCY_RATES_TTL. Когда курсы устарели, запрос получает старые
+    значения сразу, а обновление выполняет один поток, захвативший блокировку в кэше.
+    Источник курсов задается настройкой CURRENCY_RATES_FETCHER (путь к функции).
+    Полученные курсы также записываются в историю ExchangeRate на текущую дату.
+"""
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .fx import store_rates
+from .models import CurrencyRate
+
+logger = logging.getLogger(__name__)
+
+NBRB_RATES_URL = 'https://www.nbrb.by/api/exrates/rates?periodicity=0'
+RATES_CACHE_KEY = 'currency-rates'
+REFRESH_LOCK_KEY = 'currency-rates:refresh-lock'
+DEFAULT_TTL = 60 * 60
+DEFAULT_TIMEOUT = 5
+
+# Курсы читаются на каждой странице конвертера: держим их в двухуровневом кэше,
+# блокировка обновления остается в общем кэше.
+rates_cache = caches['tiered']
+
+
+def nbrb_fetcher(on_date=None):
+    """
+        Загружает курсы с API НБ РБ на текущую дату или на дату on_date.
+        Возвращает список словарей с ключами code, name, scale, rate.
+    """
+    import requests
+
+    params = {'ondate': on_date.isoformat()} if on_date else None
+    response = requests.get(NBRB_RATES_URL, params=params,
+                            timeout=getattr(settings, 'CURRENCY_RATES_TIMEOUT', DEFAULT_TIMEOUT))
+    response.raise_for_status()
+    return [{'code': rate['Cur_Abbreviation'], 'name': rate['Cur_Name'], 'scale': rate['Cur_Scale'],
+             'rate': Decimal(str(rate['Cur_OfficialRate']))} for rate in response.json()]
+
+
+def fetcher():
+    path = getattr(settings, 'CURRENCY_RATES_FETCHER', 'budget.currency.nbrb_fetcher')
+    return import_string(path)
+
+
+def _load_store():
+    stored = list(CurrencyRate.objects.order_by('name'))
+    rates = {rate.name: rate.unit_rate for rate in stored}
+    fetched_at = max((rate.fetched_at for rate in stored), default=None)
+    return rates, fetched_at
+
+
+def _put_in_cache(rates, fetched_at):
+    rates_cache.set(RATES_CACHE_KEY, {'rates': rates, 'fetched_at': fetched_at.timestamp()}, timeout=None)
+
+
+def refresh_rates():
+    """
+        Загружает курсы из источника, сохраняет их в таблицу и кэш.
+        При ошибке источника оставляет прежние курсы и возвращает None.
+    """
+    try:
+        fetched = fetcher()()
+    except Exception:
+        logger.exception('Не удалось получить курсы валют')
+        return None
+    if not fetched:
+        logger.warning('Источник курсов валют вернул пустой список')
+        return None
+
+    now = timezone.now()
+    CurrencyRate.objects.bulk_create(
+        [CurrencyRate(fetched_at=now, **rate) for rate in fetched],
+        update_conflicts=True, unique_fields=['code'], update_fields=['name', 'scale', 'rate', 'fetched_at'],
+    )
+    store_rates({rate['code']: rate['rate'] / rate['scale'] for rate in fetched}, timezone.localdate())
+    rates, fetched_at = _load_store()
+    _put_in_cache(rates, fetched_at)
+    cache.delete(REFRESH_LOCK_KEY)
+    return rates
+
+
+def _acquire_refresh_lock():
+    # Блокировка снимается только после успешного обновления: при ошибке источника
+    # следующая попытка будет не раньше, чем истечет блокировка.
+    timeout = getattr(settings, 'CURRENCY_RATES_TIMEOUT', DEFAULT_TIMEOUT) * 3
+    return cache.add(REFRESH_LOCK_KEY, 1, timeout=timeout)
+
+
+def _refresh_in_background():
+    try:
+        refresh_rates()
+    finally:
+        close_old_connections()
+
+
+def _start_refresh():
+    if not _acquire_refresh_lock():
+        return
+    if getattr(settings, 'CURRENCY_RATES_ASYNC_REFRESH', True):
+        threading.Thread(target=_refresh_in_background, name='currency-refresh', daemon=True).start()
+    else:
+        refresh_rates()
+
+
+def get_rates():
+    """
+        Возвращает словарь {название валюты: курс к BYN за 1 единицу}.
+        Устаревшие курсы возвращаются сразу, обновление идет в фоне.
+    """
+    cached = rates_cache.get(RATES_CACHE_KEY)
+    ttl = getattr(settings, 'CURRENCY_RATES_TTL', DEFAULT_TTL)
+    if cached is not None:
+        if time.time() - cached['fetched_at'] > ttl:
+            _start_refresh()
+        return cached['rates']
+
+    rates, fetched_at = _load_store()
+    if rates:
+        # Кэш пуст (перезапуск или вытеснение): отдаем курсы из таблицы, а устаревшие обновляем в фоне.
+        _put_in_cache(rates, fetched_at)
+        if time.time() - fetched_at.timestamp() > ttl:
+            _start_refresh()
+        return rates
+
+    # Курсов еще нет совсем - придется дождаться источника.
+    if _acquire_refresh_lock():
+        return refresh_rates() or {}
+    return {}
@@ -0,0 +1,71 @@
+"""
+    Потоковый экспорт расходов, доходов и долгов в CSV.
+
+    Строки читаются одним запросом через values_list с join-ами и .iterator(chunk_size=...),
+    а CSV отдается частями через StreamingHttpResponse, поэтому память не зависит от размера истории.
+"""
+import csv
+from io import StringIO
+
+from django.http import StreamingHttpResponse
+
+from .models import Debts, Expense, Income
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPENSE_HEADER = ['Date', 'First name', 'Category', 'Subcategory', 'Amount', 'Currency']
+INCOME_HEADER = ['Date', 'First name', 'Income category', 'Description', 'Amount', 'Currency']
+DEBTS_HEADER = ['Start date', 'End date', 'First name', 'Description', 'Amount', 'Currency', 'Interest rate',
+                'Months']
+
+
+def _by_period(queryset, field, start_date=None, end_date=None):
+    if start_date:
+        queryset = queryset.filter(**{f'{field}__gte': start_date})
+    if end_date:
+        queryset = queryset.filter(**{f'{field}__lte': end_date})
+    return queryset
+
+
+def expense_rows(user_ids, start_date=None, end_date=None):
+    expenses = _by_period(Expense.objects.alive().filter(user_id__in=user_ids), 'date', start_date, end_date)
+    return expenses.order_by('date', 'id').values_list(
+        'date', 'user__first_name', 'category__name', 'subcategory__name', 'amount', 'currency'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def income_rows(user_ids, start_date=None, end_date=None):
+    incomes = _by_period(Income.objects.alive().filter(user_id__in=user_ids), 'date', start_date, end_date)
+    return incomes.order_by('date', 'id').values_list(
+        'date', 'user__first_name', 'income_category__name', 'description', 'amount', 'currency'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def debts_rows(user_ids, start_date=None, end_date=None):
+    debts = _by_period(Debts.objects.filter(user_id__in=user_ids), 'start_date', start_date, end_date)
+    return debts.order_by('start_date', 'id').values_list(
+        'start_date', 'end_date', 'user__first_name', 'description', 'amount', 'currency', 'interest_rate',
+        'repayment_period_months'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def stream_csv(header, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+        Генерирует CSV частями по chunk_size строк.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if number % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows):
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,168 @@
+"""
+    Прогноз движения денег на несколько месяцев вперед по месяцам или по дням.
+
+    Прогноз строится из трех источников:
+    - средних по категориям доходов и расходов за последние месяцы (один GROUP BY по месячным итогам,
+      как в отчете о динамике, плюс пересчет операций не в базовой валюте);
+    - регулярных операций: категория, по которой операции были в большинстве месяцев истории
+      (зарплата, аренда), считается регулярной и прогнозируется медианной суммой в свой обычный день месяца,
+      остальные - средней суммой, равномерно распределенной по дням месяца;
+    - платежей по графикам долгов (DebtPayment) в базовой валюте по последнему известному курсу.
+    Ряды считаются матрицами numpy (категории x периоды) без циклов по дням, результат хранится в кэше
+    под областью и версией данных пользователей, поэтому после изменения данных прогноз пересчитывается.
+"""
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.functions import ExtractDay
+
+from . import reports
+from .amortization import add_months
+from .cache import ledger_stamp
+from .fx import base_amount
+from .models import DebtPayment, Expense, Income, MonthlyLedgerRollup
+from .routers import reads_from_primary
+
+MONTHLY = 'month'
+DAILY = 'day'
+GRANULARITIES = (MONTHLY, DAILY)
+FORECAST_MONTHS = (3, 12, 24, 60)
+HISTORY_MONTHS = 12
+RECURRING_SHARE = 0.75
+
+FORECAST_KEY = 'forecast:{scope}:{granularity}:{months}:{today}:{stamp}'
+FORECAST_TIMEOUT = 60 * 60 * 24
+
+
+def forecast_period(months, today=None):
+    """
+        Первый и последний день прогноза: months полных месяцев, начиная со следующего.
+    """
+    today = today or date.today()
+    start = add_months(today.replace(day=1), 1)
+    return start, add_months(start, months) - timedelta(days=1)
+
+
+def _category_streams(user_ids, today, history_months):
+    # Месячные суммы по (вид, категория) за историю - матрица категории x месяцы.
+    import pandas as pd
+
+    periods = reports.trend_periods(history_months, add_months(today.replace(day=1), -1))
+    records, unconverted = reports.trend_records(user_ids, periods)
+    frame = pd.DataFrame.from_records(records, columns=['year', 'month', 'kind', 'category', 'total'])
+    frame['total'] = frame['total'].astype(float)
+    frame['category'] = frame['category'].fillna('')
+    frame['period'] = frame['year'] * 12 + frame['month']
+    columns = [year * 12 + month for year, month in periods]
+    matrix = frame.pivot_table(index=['kind', 'category'], columns='period', values='total', aggfunc='sum') \
+        .reindex(columns=columns).fillna(0.0)
+    return matrix, unconverted
+
+
+def _typical_days(user_ids, today, history_months):
+    # Обычный день месяца операций каждой категории - по одному агрегирующему запросу на доходы и расходы.
+    start = add_months(today.replace(day=1), -history_months)
+    end = today.replace(day=1)
+    days = {}
+    for kind, model, field in [(MonthlyLedgerRollup.EXPENSE, Expense, 'category__name'),
+                               (MonthlyLedgerRollup.INCOME, Income, 'income_category__name')]:
+        rows = model.objects.alive().filter(user_id__in=user_ids, date__gte=start, date__lt=end) \
+            .values_list(field).annotate(day=Avg(ExtractDay('date'))).order_by()
+        days.update({(kind, name or ''): round(day) for name, day in rows})
+    return days
+
+
+def _debt_payments(user_ids, start, end):
+    # Платежи по долгам в базовой валюте, сгруппированные по дате. Возвращает ([(дата, сумма)], без курса).
+    rows = DebtPayment.objects.filter(debt__user_id__in=user_ids, due_date__gte=start, due_date__lte=end) \
+        .annotate(base_payment=base_amount('payment', 'debt__currency', 'due_date')) \
+        .values_list('due_date') \
+        .annotate(total=Sum('base_payment'), unconverted=Count('id', filter=Q(base_payment=None))).order_by()
+    payments = []
+    unconverted = 0
+    for due_date, total, missing in rows:
+        if total is not None:
+            payments.append((due_date, float(total)))
+        unconverted += missing
+    return payments, unconverted
+
+
+def cash_flow_forecast(user_ids, months=FORECAST_MONTHS[1], granularity=MONTHLY, today=None,
+                       history_months=HISTORY_MONTHS):
+    """
+        Прогноз в базовой валюте на months месяцев после текущего. Возвращает словарь рядов по периодам
+        ('periods' - месяцы ГГГГ-ММ или дни ГГГГ-ММ-ДД): 'income', 'expense', 'debt' (платежи по долгам),
+        'net' и нарастающий 'balance', а также 'categories' - месячный уровень каждой категории
+        с признаком регулярности и итоги за весь прогноз.
+    """
+    import numpy as np
+    import pandas as pd
+
+    today = today or date.today()
+    start, end = forecast_period(months, today)
+    matrix, unconverted = _category_streams(user_ids, today, history_months)
+    # Регулярная категория - с операциями не меньше чем в RECURRING_SHARE месяцев истории.
+    recurring = ((matrix > 0).mean(axis=1) >= RECURRING_SHARE).to_numpy()
+    levels = np.where(recurring, matrix.where(matrix > 0).median(axis=1).fillna(0.0), matrix.mean(axis=1))
+    kinds = matrix.index.get_level_values('kind').to_numpy()
+    payments, debt_unconverted = _debt_payments(user_ids, start, end)
+
+    if granularity == DAILY:
+        days = pd.date_range(start, end, freq='D')
+        labels = [day.isoformat() for day in days.date]
+        day_of_month = days.day.to_numpy()
+        month_length = days.days_in_month.to_numpy()
+        typical = _typical_days(user_ids, today, history_months)
+        typical_days = np.array([typical.get(stream, 1) for stream in matrix.index], dtype=int).reshape(-1, 1)
+        on_typical_day = day_of_month == np.minimum(typical_days, month_length)
+        streams = np.where(recurring[:, None], on_typical_day * levels[:, None], levels[:, None] / month_length)
+        positions = [(day - start).days for day, _ in payments]
+    else:
+        first = start.year * 12 + start.month - 1
+        labels = [f'{index // 12}-{index % 12 + 1:02d}' for index in range(first, first + months)]
+        streams = np.repeat(levels[:, None], months, axis=1)
+        positions = [day.year * 12 + day.month - 1 - first for day, _ in payments]
+
+    debt = np.bincount(np.array(positions, dtype=int), weights=[total for _, total in payments],
+                       minlength=len(labels))
+    streams = streams.reshape(len(kinds), len(labels))
+    income = streams[kinds == MonthlyLedgerRollup.INCOME].sum(axis=0)
+    expense = streams[kinds == MonthlyLedgerRollup.EXPENSE].sum(axis=0)
+    net = income - expense - debt
+
+    categories = [{'kind': kind, 'name': name, 'monthly': round(float(level), 2), 'recurring': bool(regular)}
+                  for (kind, name), level, regular in zip(matrix.index, levels, recurring)]
+    categories.sort(key=lambda category: (category['kind'], -category['monthly']))
+    return {
+        'granularity': granularity,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'periods': labels,
+        'income': income.round(2).tolist(),
+        'expense': expense.round(2).tolist(),
+        'debt': debt.round(2).tolist(),
+        'net': net.round(2).tolist(),
+        'balance': net.cumsum().round(2).tolist(),
+        'categories': categories,
+        'total_income': round(float(income.sum()), 2),
+        'total_expense': round(float(expense.sum()), 2),
+        'total_debt': round(float(debt.sum()), 2),
+        'unconverted': unconverted + debt_unconverted,
+    }
+
+
+def cached_forecast(scope, months=FORECAST_MONTHS[1], granularity=MONTHLY, today=None):
+    """
+        Прогноз для области scope из кэша. Ключ включает дату и отметку версии данных пользователей области.
+        Прогноз, посчитанный по данным реплики, в кэш не сохраняется.
+    """
+    today = today or date.today()
+    key = FORECAST_KEY.format(scope=scope.key, granularity=granularity, months=months, today=today.isoformat(),
+                              stamp=ledger_stamp(scope.user_ids))
+    result = cache.get(key)
+    if result is None:
+        result = cash_flow_forecast(scope.user_ids, months, granularity, today)
+        if reads_from_primary():
+            cache.set(key, result, timeout=FORECAST_TIMEOUT)
+    return result
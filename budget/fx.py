@@ -0,0 +1,58 @@
+"""
+    Пересчет сумм в базовую валюту по историческим курсам.
+
+    Курс подставляется в SQL коррелированным подзапросом к ExchangeRate по индексу
+    (currency, date): берется курс на дату операции или ближайший предыдущий. Так целый
+    набор операций пересчитывается одним запросом без поиска курса для каждой строки в Python.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Value, When
+
+from .cache import bump_ledger_version
+from .models import ExchangeRate
+
+NBRB_CURRENCY = 'BYN'
+AMOUNT_FIELD = DecimalField(max_digits=20, decimal_places=2)
+RATE_FIELD = DecimalField(max_digits=16, decimal_places=8)
+
+
+def rate_on(currency, date_field='date'):
+    """
+        Подзапрос курса валюты (к BYN за 1 единицу) на дату из поля date_field внешнего запроса.
+        currency - код валюты или выражение (например, OuterRef('currency')).
+    """
+    rates = ExchangeRate.objects.filter(currency=currency, date__lte=OuterRef(date_field)).order_by('-date')
+    return Subquery(rates.values('rate')[:1], output_field=RATE_FIELD)
+
+
+def base_amount(amount_field='amount', currency_field='currency', date_field='date', base_currency=None):
+    """
+        Выражение суммы операции в базовой валюте. Если курса на дату нет, результат NULL.
+    """
+    base_currency = base_currency or settings.BASE_CURRENCY
+    to_byn = Case(When(**{currency_field: NBRB_CURRENCY}, then=Value(Decimal(1))),
+                  default=rate_on(OuterRef(currency_field), date_field), output_field=RATE_FIELD)
+    converted = F(amount_field) * to_byn
+    if base_currency != NBRB_CURRENCY:
+        converted = converted / rate_on(base_currency, date_field)
+    return Case(When(**{currency_field: base_currency}, then=F(amount_field)), default=converted,
+                output_field=AMOUNT_FIELD)
+
+
+def store_rates(rates, on_date):
+    """
+        Сохраняет курсы на дату в историю. rates - словарь {код валюты: курс к BYN за 1 единицу}.
+        Если курсы изменились, сбрасывает версии данных, чтобы отчеты пересчитались.
+    """
+    quantum = Decimal(1).scaleb(-RATE_FIELD.decimal_places)
+    rates = {code: Decimal(rate).quantize(quantum) for code, rate in rates.items()}
+    stored = dict(ExchangeRate.objects.filter(date=on_date, currency__in=rates).values_list('currency', 'rate'))
+    if stored == rates:
+        return
+    ExchangeRate.objects.bulk_create(
+        [ExchangeRate(currency=code, date=on_date, rate=rate) for code, rate in rates.items()],
+        update_conflicts=True, unique_fields=['currency', 'date'], update_fields=['rate'],
+    )
+    bump_ledger_version()
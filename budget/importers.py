@@ -0,0 +1,180 @@
+"""
+    Пакетный импорт расходов из CSV.
+
+    Файл читается потоком построчно. Названия категорий и подкатегорий сопоставляются
+    через словари в памяти, недостающие создаются пачкой через bulk_create. Расходы
+    записываются пачками фиксированного размера в одной транзакции, ошибочные строки
+    пропускаются и попадают в отчет об ошибках.
+"""
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from . import rollups
+from .categories import bump_category_version
+from .models import Category, Expense, Subcategory
+
+IMPORT_BATCH_SIZE = 1000
+MAX_AMOUNT = Decimal('100000000')
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y']
+
+COLUMN_ALIASES = {
+    'date': ['Date', 'Дата'],
+    'category': ['Category', 'Категория'],
+    'subcategory': ['Subcategory', 'Подкатегория'],
+    'amount': ['Amount', 'Сумма'],
+}
+OPTIONAL_COLUMN_ALIASES = {
+    'currency': ['Currency', 'Валюта'],
+}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'неверная дата "{value}"')
+
+
+def _parse_amount(value):
+    try:
+        amount = Decimal(value.strip().replace(' ', '').replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'неверная сумма "{value}"')
+    if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f'неверная сумма "{value}"')
+    return amount
+
+
+def _parse_currency(value):
+    currency = (value or '').strip().upper() or settings.BASE_CURRENCY
+    if currency not in settings.LEDGER_CURRENCIES:
+        raise ValueError(f'неизвестная валюта "{value}"')
+    return currency
+
+
+def _resolve_columns(fieldnames):
+    columns = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        column = next((name for name in fieldnames or [] if name.strip() in aliases), None)
+        if column is None:
+            raise ValueError(f'в файле нет столбца "{aliases[0]}"')
+        columns[key] = column
+    for key, aliases in OPTIONAL_COLUMN_ALIASES.items():
+        columns[key] = next((name for name in fieldnames or [] if name.strip() in aliases), None)
+    return columns
+
+
+class ExpenseImporter:
+    """
+        Импорт расходов пользователя. Категории и подкатегории загружаются в память
+        двумя запросами, а затем дополняются по мере появления новых названий.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.categories = dict(Category.objects.filter(user=user).values_list('name', 'id'))
+        self.subcategories = {
+            (category_id, name): subcategory_id for subcategory_id, category_id, name in
+            Subcategory.objects.filter(category__user=user).values_list('id', 'category_id', 'name')
+        }
+
+    def _create_missing(self, batch):
+        new_categories = {category for _, _, category, _, _, _ in batch if category not in self.categories}
+        if new_categories:
+            created = Category.objects.bulk_create([Category(name=name, user=self.user) for name in new_categories])
+            self.categories.update({category.name: category.id for category in created})
+
+        new_subcategories = {(self.categories[category], subcategory) for _, _, category, subcategory, _, _ in batch
+                             if (self.categories[category], subcategory) not in self.subcategories}
+        if new_subcategories:
+            created = Subcategory.objects.bulk_create([Subcategory(category_id=category_id, name=name)
+                                                       for category_id, name in new_subcategories])
+            self.subcategories.update({(sub.category_id, sub.name): sub.id for sub in created})
+        if new_categories or new_subcategories:
+            transaction.on_commit(partial(bump_category_version, self.user.id))
+
+    def _flush(self, batch, result):
+        if not batch:
+            return
+        self._create_missing(batch)
+        expenses = Expense.objects.bulk_create([
+            Expense(user=self.user, date=expense_date, amount=amount, currency=currency,
+                    category_id=self.categories[category],
+                    subcategory_id=self.subcategories[(self.categories[category], subcategory)])
+            for _, expense_date, category, subcategory, amount, currency in batch
+        ])
+        rollups.apply_expenses(expenses)
+        result.created += len(expenses)
+        batch.clear()
+
+    def parse(self, rows, columns, result):
+        """
+            Проверяет строки файла и выдает (номер строки, дата, категория, подкатегория, сумма, валюта).
+        """
+        for line, row in enumerate(rows, start=2):
+            try:
+                category = (row[columns['category']] or '').strip()
+                subcategory = (row[columns['subcategory']] or '').strip()
+                if not category or not subcategory:
+                    raise ValueError('не указана категория или подкатегория')
+                expense_date = _parse_date(row[columns['date']] or '')
+                amount = _parse_amount(row[columns['amount']] or '')
+                currency = _parse_currency(row[columns['currency']] if columns['currency'] else '')
+            except ValueError as error:
+                result.add_error(line, str(error))
+                continue
+            yield line, expense_date, category[:255], subcategory[:255], amount, currency
+
+    def run(self, stream):
+        """
+            Импортирует расходы из текстового потока CSV и возвращает ImportResult.
+        """
+        result = ImportResult()
+        reader = csv.DictReader(stream)
+        try:
+            columns = _resolve_columns(reader.fieldnames)
+        except ValueError as error:
+            result.add_error(1, str(error))
+            return result
+
+        batch = []
+        with transaction.atomic():
+            for parsed in self.parse(reader, columns, result):
+                batch.append(parsed)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, result)
+            self._flush(batch, result)
+        return result
+
+
+def import_expenses(user, uploaded_file, batch_size=IMPORT_BATCH_SIZE):
+    """
+        Импортирует расходы из загруженного CSV файла (UTF-8, разделитель - запятая).
+    """
+    stream = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', newline='')
+    try:
+        return ExpenseImporter(user, batch_size).run(stream)
+    except UnicodeDecodeError:
+        result = ImportResult()
+        result.add_error(0, 'файл должен быть в кодировке UTF-8')
+        return result
+    finally:
+        stream.detach()
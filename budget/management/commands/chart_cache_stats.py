@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from budget.cache import chart_cache_stats, reset_chart_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает счетчики попаданий и промахов кэша графиков отчетов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Сбросить счетчики после вывода.')
+
+    def handle(self, *args, **options):
+        stats = chart_cache_stats()
+        self.stdout.write(f"Попадания: {stats['hits']}")
+        self.stdout.write(f"Промахи: {stats['misses']}")
+        self.stdout.write(f"Доля попаданий: {stats['hit_ratio']:.1%}")
+        if options['reset']:
+            reset_chart_cache_stats()
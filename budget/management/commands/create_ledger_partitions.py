@@ -0,0 +1,38 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from budget import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Создает секции таблиц расходов и доходов на будущие периоды (PostgreSQL, LEDGER_PARTITIONING).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help='На сколько периодов вперед создать секции (по умолчанию 3).')
+        parser.add_argument('--detach-before', type=date.fromisoformat,
+                            help='Отсоединить секции, целиком лежащие до этой даты (ГГГГ-ММ-ДД).')
+
+    def handle(self, *args, **options):
+        if not partitioning.is_supported(connection):
+            self.stdout.write(f'Секционирование доступно только на PostgreSQL, '
+                              f'для {connection.vendor} таблицы остаются обычными.')
+            return
+        interval = partitioning.partitioning_interval()
+        if not interval:
+            raise CommandError("Задайте LEDGER_PARTITIONING = 'month' или 'year'.")
+
+        last_day = partitioning.last_day_ahead(date.today(), interval, options['ahead'])
+        for model in partitioning.partitioned_models():
+            table = model._meta.db_table
+            if not partitioning.is_partitioned(connection, table):
+                partitioning.partition_table(connection, table, interval, options['ahead'])
+                self.stdout.write(f'{table}: таблица преобразована в секционированную.')
+            created = [start for start in partitioning.partition_starts(date.today(), last_day, interval)
+                       if partitioning.create_partition(connection, table, start, interval)]
+            self.stdout.write(self.style.SUCCESS(f'{table}: создано секций: {len(created)}'))
+            if options['detach_before']:
+                detached = partitioning.detach_partitions(connection, table, options['detach_before'])
+                self.stdout.write(f'{table}: отсоединены секции: {", ".join(detached) or "нет"}')
@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from budget.currency import fetcher
+from budget.fx import store_rates
+
+
+class Command(BaseCommand):
+    help = 'Загружает историю курсов валют НБ РБ за период в таблицу ExchangeRate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, required=True, help='Первая дата (ГГГГ-ММ-ДД).')
+        parser.add_argument('--end', type=date.fromisoformat, default=date.today(),
+                            help='Последняя дата (ГГГГ-ММ-ДД), по умолчанию сегодня.')
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start > end:
+            raise CommandError('Начальная дата позже конечной.')
+
+        fetch = fetcher()
+        on_date = start
+        loaded = 0
+        while on_date <= end:
+            try:
+                rates = fetch(on_date)
+            except Exception as error:
+                self.stderr.write(f'{on_date}: не удалось получить курсы ({error})')
+            else:
+                store_rates({rate['code']: rate['rate'] / rate['scale'] for rate in rates}, on_date)
+                loaded += 1
+            on_date += timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f'Загружены курсы за {loaded} дн.'))
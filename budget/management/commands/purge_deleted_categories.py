@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from budget.tombstones import PURGE_BATCH_SIZE, purge_deleted
+
+
+class Command(BaseCommand):
+    help = 'Удаляет операции категорий, помеченных удаленными, пачками, а затем сами категории.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help=f'Строк в одной пачке (по умолчанию {PURGE_BATCH_SIZE}).')
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Пауза между пачками в секундах (по умолчанию 0.1).')
+        parser.add_argument('--max-batches', type=int,
+                            help='Остановиться после этого числа пачек (остаток удалит следующий запуск).')
+
+    def handle(self, *args, **options):
+        purged = purge_deleted(options['batch_size'], options['pause'], options['max_batches'])
+        for table, deleted in purged.items():
+            self.stdout.write(f'{table}: удалено строк: {deleted}')
+        self.stdout.write(self.style.SUCCESS('Очистка завершена.'))
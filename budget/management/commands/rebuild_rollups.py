@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from budget.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу месячных итогов по расходам и доходам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='ID пользователя, для которого пересчитать итоги (можно указать несколько раз).')
+
+    def handle(self, *args, **options):
+        created = rebuild_rollups(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано строк итогов: {created}'))
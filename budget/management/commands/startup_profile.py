@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MODULES = ['mysite.urls']
+
+
+def profile_imports(modules):
+    """
+        Импортирует модули в отдельном процессе с -X importtime и возвращает список
+        (модуль, глубина вложенности, собственное время мкс, суммарное время мкс) в порядке импорта.
+    """
+    code = 'import django; django.setup(); ' + '; '.join(f'import {module}' for module in modules)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mysite.settings'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr else 'Ошибка импорта')
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Показывает время импорта модулей при запуске приложения (python -X importtime).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES,
+                            help='Модули, импорт которых профилируется (по умолчанию mysite.urls).')
+        parser.add_argument('--top', type=int, default=20, help='Сколько самых медленных модулей показать.')
+        parser.add_argument('--max-ms', type=float,
+                            help='Завершиться с ошибкой, если общее время импорта превышает порог (мс).')
+
+    def handle(self, *args, **options):
+        rows = profile_imports(options['modules'])
+        # Верхнеуровневые импорты записаны без отступа, их суммарное время и есть время запуска.
+        total_us = sum(cumulative_us for _, depth, _, cumulative_us in rows if depth == 0)
+
+        self.stdout.write(f"{'cumulative, мс':>15} {'self, мс':>10}  модуль")
+        for name, _, self_us, cumulative_us in sorted(rows, key=lambda row: row[3], reverse=True)[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:>15.1f} {self_us / 1000:>10.1f}  {name}')
+        self.stdout.write(f'Всего: {total_us / 1000:.1f} мс, модулей: {len(rows)}')
+
+        if options['max_ms'] is not None and total_us / 1000 > options['max_ms']:
+            raise CommandError(f"Время импорта {total_us / 1000:.1f} мс превышает порог {options['max_ms']} мс")
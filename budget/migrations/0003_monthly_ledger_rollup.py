@@ -0,0 +1,44 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0002_ledger_date_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyLedgerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('kind', models.CharField(choices=[('expense', 'Расход'), ('income', 'Доход')], max_length=7)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='budget.category')),
+                ('income_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='budget.incomecategory')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='budget.subcategory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Месячные итоги',
+                'verbose_name_plural': 'Месячные итоги',
+                'indexes': [models.Index(fields=['user', 'year', 'month', 'kind'], name='rollup_user_period_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'expense')), fields=('user', 'year', 'month', 'category', 'subcategory'), name='rollup_unique_expense_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'income')), fields=('user', 'year', 'month', 'income_category'), name='rollup_unique_income_key'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.3 on 2026-10-18 10:53
+
+import budget.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0004_currency_rate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=16)),
+            ],
+            options={
+                'verbose_name': 'Исторический курс',
+                'verbose_name_plural': 'Исторические курсы',
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='monthlyledgerrollup',
+            name='rollup_unique_expense_key',
+        ),
+        migrations.RemoveConstraint(
+            model_name='monthlyledgerrollup',
+            name='rollup_unique_income_key',
+        ),
+        migrations.AddField(
+            model_name='debts',
+            name='currency',
+            field=models.CharField(default=budget.models.default_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(default=budget.models.default_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='income',
+            name='currency',
+            field=models.CharField(default=budget.models.default_currency, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='monthlyledgerrollup',
+            name='currency',
+            field=models.CharField(default=budget.models.default_currency, max_length=3),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'expense')), fields=('user', 'year', 'month', 'category', 'subcategory', 'currency'), name='rollup_unique_expense_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'income')), fields=('user', 'year', 'month', 'income_category', 'currency'), name='rollup_unique_income_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='exchange_rate_currency_date'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from budget import partitioning
+
+
+def partition_ledger_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    interval = partitioning.partitioning_interval()
+    if not interval or not partitioning.is_supported(connection):
+        return
+    for model_name in ('Expense', 'Income'):
+        table = apps.get_model('budget', model_name)._meta.db_table
+        if not partitioning.is_partitioned(connection, table):
+            partitioning.partition_table(connection, table, interval)
+
+
+def unpartition_ledger_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if not partitioning.is_supported(connection):
+        return
+    for model_name in ('Expense', 'Income'):
+        table = apps.get_model('budget', model_name)._meta.db_table
+        if partitioning.is_partitioned(connection, table):
+            partitioning.unpartition_table(connection, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0006_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_ledger_tables, unpartition_ledger_tables),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+TS_CONFIG = 'simple'
+SEARCH_FIELDS = [
+    ('budget_income', 'description'),
+    ('budget_debts', 'description'),
+    ('budget_category', 'name'),
+    ('budget_incomecategory', 'name'),
+    ('budget_subcategory', 'name'),
+]
+
+
+def _sqlite_statements(table, field):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({field}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+        f'INSERT INTO {fts}(rowid, {field}) VALUES (new.id, new.{field}); END',
+        f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {field}) VALUES ('delete', old.id, old.{field}); END",
+        f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {field} ON {table} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {field}) VALUES ('delete', old.id, old.{field}); "
+        f'INSERT INTO {fts}(rowid, {field}) VALUES (new.id, new.{field}); END',
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def _postgres_statements(table, field):
+    return [
+        f"CREATE INDEX IF NOT EXISTS {table}_{field}_tsv_idx ON {table} "
+        f"USING gin (to_tsvector('{TS_CONFIG}', {field}))",
+        f'CREATE INDEX IF NOT EXISTS {table}_{field}_trgm_idx ON {table} USING gin ({field} gin_trgm_ops)',
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        statements = _postgres_statements
+    elif vendor == 'sqlite':
+        statements = _sqlite_statements
+    else:
+        return
+    for table, field in SEARCH_FIELDS:
+        for statement in statements(table, field):
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, field in SEARCH_FIELDS:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{field}_tsv_idx')
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{field}_trgm_idx')
+        elif vendor == 'sqlite':
+            fts = f'{table}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0007_ledger_partitioning'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
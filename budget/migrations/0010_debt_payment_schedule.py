@@ -0,0 +1,148 @@
+# Generated by Django 5.0.3 on 2026-10-18 11:34
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Код ниже - копия budget.amortization и budget.migrations.0008_search_index на момент миграции:
+# историческая миграция не должна меняться вместе с ними.
+DIFFERENTIATED = 'differentiated'
+CENT = Decimal('0.01')
+
+
+def _due_dates(np, start_dates, numbers):
+    starts = np.array(start_dates, dtype='datetime64[D]')
+    first_days = starts.astype('datetime64[M]')[:, None] + numbers
+    month_lengths = ((first_days + 1).astype('datetime64[D]') - first_days.astype('datetime64[D]')).astype(int)
+    days = (starts - starts.astype('datetime64[M]').astype('datetime64[D]')).astype(int)[:, None]
+    return first_days.astype('datetime64[D]') + np.minimum(days, month_lengths - 1)
+
+
+def _compute_schedules(principals, annual_rates, months, methods, start_dates):
+    import numpy as np
+
+    principal = np.asarray([float(value) for value in principals])[:, None]
+    rate = np.asarray([float(value or 0) / 1200 for value in annual_rates])[:, None]
+    terms = np.maximum(np.asarray(months, dtype=int), 1)[:, None]
+    annuity = np.asarray([method != DIFFERENTIATED for method in methods])[:, None]
+    numbers = np.arange(1, int(terms.max(initial=1)) + 1)[None, :]
+    mask = numbers <= terms
+
+    has_rate = rate > 0
+    safe_rate = np.where(has_rate, rate, 1.0)
+    growth = (1 + safe_rate) ** (numbers - 1)
+    level_payment = np.where(has_rate, principal * safe_rate / (1 - (1 + safe_rate) ** -terms), principal / terms)
+    annuity_balance = np.where(has_rate, principal * growth - level_payment * (growth - 1) / safe_rate,
+                               principal - level_payment * (numbers - 1))
+    linear_balance = principal - principal / terms * (numbers - 1)
+    opening = np.where(annuity, annuity_balance, linear_balance)
+
+    interest = np.round(np.where(mask, opening * rate, 0), 2)
+    repaid = np.where(annuity, level_payment - opening * rate, principal / terms)
+    principal_part = np.round(np.where(mask, repaid, 0), 2)
+    last = (np.arange(len(terms)), terms[:, 0] - 1)
+    principal_part[last] += np.round(principal[:, 0] - principal_part.sum(axis=1), 2)
+    balance = np.where(mask, np.round(principal - np.cumsum(principal_part, axis=1), 2), 0)
+
+    return {
+        'due_date': _due_dates(np, start_dates, numbers),
+        'payment': np.round(principal_part + interest, 2),
+        'principal': principal_part,
+        'interest': interest,
+        'balance': balance,
+        'mask': mask,
+    }
+
+
+def _money(value):
+    return Decimal(repr(float(value))).quantize(CENT)
+
+
+def materialize_existing_schedules(apps, schema_editor):
+    Debts = apps.get_model('budget', 'Debts')
+    DebtPayment = apps.get_model('budget', 'DebtPayment')
+    debts = list(Debts.objects.using(schema_editor.connection.alias).order_by('id'))
+    if not debts:
+        return
+    schedule = _compute_schedules([debt.amount for debt in debts], [debt.interest_rate for debt in debts],
+                                  [debt.repayment_period_months for debt in debts],
+                                  [debt.payment_method for debt in debts], [debt.start_date for debt in debts])
+    payments = []
+    for row, debt in enumerate(debts):
+        for column in range(int(schedule['mask'][row].sum())):
+            payments.append(DebtPayment(
+                debt_id=debt.pk, number=column + 1, due_date=schedule['due_date'][row, column].item(),
+                payment=_money(schedule['payment'][row, column]),
+                principal=_money(schedule['principal'][row, column]),
+                interest=_money(schedule['interest'][row, column]),
+                balance=_money(schedule['balance'][row, column]),
+            ))
+    DebtPayment.objects.using(schema_editor.connection.alias).bulk_create(payments, batch_size=1000)
+
+
+def _sqlite_search_statements(table, field):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({field}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+        f'INSERT INTO {fts}(rowid, {field}) VALUES (new.id, new.{field}); END',
+        f'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {field}) VALUES ('delete', old.id, old.{field}); END",
+        f'CREATE TRIGGER {fts}_au AFTER UPDATE OF {field} ON {table} BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {field}) VALUES ('delete', old.id, old.{field}); "
+        f'INSERT INTO {fts}(rowid, {field}) VALUES (new.id, new.{field}); END',
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def restore_debt_search_index(apps, schema_editor):
+    # SQLite пересоздает таблицу долгов при добавлении NOT NULL столбца, и триггеры полнотекстового индекса теряются.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    fts = 'budget_debts_fts'
+    for suffix in ('ai', 'ad', 'au'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+    for statement in _sqlite_search_statements('budget_debts', 'description'):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0009_category_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debts',
+            name='payment_method',
+            field=models.CharField(choices=[('annuity', 'Аннуитетный'), ('differentiated', 'Дифференцированный')], default='annuity', max_length=14),
+        ),
+        migrations.RunPython(restore_debt_search_index, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='DebtPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('due_date', models.DateField()),
+                ('payment', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('principal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('interest', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('debt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='budget.debts')),
+            ],
+            options={
+                'verbose_name': 'Платеж по долгу',
+                'verbose_name_plural': 'График платежей',
+                'indexes': [models.Index(fields=['debt', 'due_date'], name='debtpayment_debt_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='debtpayment',
+            constraint=models.UniqueConstraint(fields=('debt', 'number'), name='debtpayment_unique_number'),
+        ),
+        migrations.RunPython(materialize_existing_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 11:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0010_debt_payment_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='debts',
+            index=models.Index(fields=['user', 'end_date'], name='debts_user_end_date_idx'),
+        ),
+    ]
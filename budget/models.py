@@ -1,13 +1,169 @@
 import uuid
+from datetime import timedelta
+from decimal import Decimal
 
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from .amortization import ANNUITY, METHOD_CHOICES
+
+
+def default_currency():
+    return settings.BASE_CURRENCY
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    def alive(self):
+        return self.filter(deleted_at=None)
+
+    def deleted(self):
+        return self.filter(deleted_at__isnull=False)
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+        Менеджер по умолчанию для категорий: записи, помеченные удаленными, не видны.
+        Все записи, включая удаленные, доступны через all_objects.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().alive()
+
+
+class LedgerQuerySet(models.QuerySet):
+    """
+        Операции в области данных пользователя (его собственные или всей семьи).
+        for_scope подгружает связанные объекты одним JOIN и читает только поля, нужные спискам.
+        Операции категорий, помеченных удаленными, исключаются сразу (alive), до их физической очистки.
+    """
+    list_related = ()
+    list_fields = ()
+    tombstones = ()
+
+    def alive(self):
+        """
+            Операции без удаленных категорий (условие по тем же JOIN, что и select_related списков).
+        """
+        return self.filter(**{f'{relation}__deleted_at': None for relation in self.tombstones})
+
+    def for_scope(self, scope):
+        """
+            scope - LedgerScope или пользователь, для которого область вычисляется.
+        """
+        if not hasattr(scope, 'user_ids'):
+            from .scope import resolve_scope
+            scope = resolve_scope(scope)
+        return self.filter(user_id__in=scope.user_ids).alive().select_related(*self.list_related) \
+            .only(*self.list_fields)
+
+
+class IncomeQuerySet(LedgerQuerySet):
+    list_related = ('user', 'income_category')
+    list_fields = ('user__first_name', 'user__last_name', 'amount', 'currency', 'description', 'date',
+                   'income_category__name')
+    tombstones = ('income_category',)
+
+
+class ExpenseQuerySet(LedgerQuerySet):
+    list_related = ('user', 'category', 'subcategory')
+    list_fields = ('user__first_name', 'user__last_name', 'amount', 'currency', 'date', 'category__name',
+                   'subcategory__name')
+    tombstones = ('category', 'subcategory')
+
+
+class DebtsQuerySet(LedgerQuerySet):
+    list_related = ('user',)
+    list_fields = ('user__username', 'user__first_name', 'user__last_name', 'amount', 'currency', 'description',
+                   'start_date',
+                   'repayment_period_months', 'end_date', 'interest_rate', 'payment_method')
+
+    # Статус долга определяется датой окончания: долг погашен, если end_date не позже on_date
+    # (как в Debts.is_paid). Условия используют индекс (user, end_date) и задаются только здесь.
+    @staticmethod
+    def _outstanding(on_date):
+        return models.Q(end_date__gt=on_date)
+
+    @staticmethod
+    def _paid(on_date):
+        return models.Q(end_date__lte=on_date)
+
+    @classmethod
+    def _due_within(cls, days, on_date):
+        return cls._outstanding(on_date) & models.Q(end_date__lte=on_date + timedelta(days=days))
+
+    def outstanding(self, on_date=None):
+        return self.filter(self._outstanding(on_date or timezone.now().date()))
+
+    def paid(self, on_date=None):
+        return self.filter(self._paid(on_date or timezone.now().date()))
+
+    def due_within(self, days, on_date=None):
+        """
+            Непогашенные долги, которые заканчиваются в ближайшие days дней.
+        """
+        return self.filter(self._due_within(days, on_date or timezone.now().date()))
+
+    def status_counts(self, due_days, on_date=None):
+        """
+            Число непогашенных, погашенных и заканчивающихся в ближайшие due_days дней долгов одним запросом.
+        """
+        on_date = on_date or timezone.now().date()
+        return self.aggregate(
+            outstanding=models.Count('id', filter=self._outstanding(on_date)),
+            paid=models.Count('id', filter=self._paid(on_date)),
+            due=models.Count('id', filter=self._due_within(due_days, on_date)),
+        )
+
+    def with_status(self, on_date=None):
+        """
+            Добавляет paid_off - признак погашенного долга, чтобы фильтровать и сортировать по статусу в базе.
+        """
+        on_date = on_date or timezone.now().date()
+        return self.annotate(paid_off=models.Case(models.When(self._paid(on_date), then=models.Value(True)),
+                                                  default=models.Value(False), output_field=models.BooleanField()))
+
+    def obligations(self, on_date=None):
+        """
+            Итоги непогашенных долгов одним запросом, по валютам: число долгов, остаток основного долга
+            (сумма будущих платежей по основному долгу) и ежемесячная нагрузка (платежи в ближайший месяц).
+            Возвращает список словарей {'currency', 'count', 'principal', 'monthly'}.
+        """
+        from .amortization import add_months
+        on_date = on_date or timezone.now().date()
+        upcoming = models.Q(payments__due_date__gte=on_date)
+        next_month = upcoming & models.Q(payments__due_date__lt=add_months(on_date, 1))
+        rows = self.outstanding(on_date).values('currency').annotate(
+            count=models.Count('id', distinct=True),
+            principal=Coalesce(models.Sum('payments__principal', filter=upcoming), Decimal(0)),
+            monthly=Coalesce(models.Sum('payments__payment', filter=next_month), Decimal(0)),
+        ).order_by('currency')
+        return list(rows)
+
+    def with_schedule(self, on_date=None):
+        """
+            Добавляет из графика платежей (индекс debt, due_date): next_due_date и next_payment - ближайший
+            платеж не раньше on_date, remaining_balance - остаток долга после платежей до on_date.
+        """
+        on_date = on_date or timezone.now().date()
+        upcoming = DebtPayment.objects.filter(debt=models.OuterRef('pk'), due_date__gte=on_date).order_by('due_date')
+        made = DebtPayment.objects.filter(debt=models.OuterRef('pk'), due_date__lt=on_date).order_by('-due_date')
+        return self.annotate(
+            next_due_date=models.Subquery(upcoming.values('due_date')[:1]),
+            next_payment=models.Subquery(upcoming.values('payment')[:1]),
+            remaining_balance=Coalesce(models.Subquery(made.values('balance')[:1]), models.F('amount')),
+        )
+
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = SoftDeleteManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Категории'
@@ -20,6 +176,10 @@ class Category(models.Model):
 class Subcategory(models.Model):
     name = models.CharField(max_length=255)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='subcategories')
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = SoftDeleteManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Подкатегории'
@@ -32,6 +192,10 @@ class Subcategory(models.Model):
 class IncomeCategory(models.Model):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = SoftDeleteManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Источник дохода'
@@ -47,10 +211,17 @@ class Income(models.Model):
     description = models.CharField(max_length=255)
     date = models.DateField()
     income_category = models.ForeignKey(IncomeCategory, on_delete=models.CASCADE)
+    currency = models.CharField(max_length=3, default=default_currency)
+
+    objects = IncomeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Доходы'
         verbose_name_plural = 'Доходы'
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='income_user_date_id_idx'),
+            models.Index(fields=['user', 'income_category', 'date'], name='income_user_category_date_idx'),
+        ]
 
     def __str__(self):
         return self.income_category.name
@@ -62,10 +233,17 @@ class Expense(models.Model):
     subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
+    currency = models.CharField(max_length=3, default=default_currency)
+
+    objects = ExpenseQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Расходы'
         verbose_name_plural = 'Расходы'
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='expense_user_date_id_idx'),
+            models.Index(fields=['user', 'category', 'date'], name='expense_user_category_date_idx'),
+        ]
 
     def __str__(self):
         return self.category.name
@@ -79,15 +257,25 @@ class Debts(models.Model):
     repayment_period_months = models.IntegerField()
     end_date = models.DateField()
     interest_rate = models.DecimalField(max_digits=5, decimal_places=2, null=True, default=0.0)
+    currency = models.CharField(max_length=3, default=default_currency)
+    payment_method = models.CharField(max_length=14, choices=METHOD_CHOICES, default=ANNUITY)
+
+    objects = DebtsQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Долги'
         verbose_name_plural = 'Долги'
+        indexes = [
+            models.Index(fields=['user', 'start_date', 'id'], name='debts_user_start_date_id_idx'),
+            models.Index(fields=['user', 'end_date'], name='debts_user_end_date_idx'),
+        ]
 
     def calculate_monthly_payment(self):
-        total_amount = self.amount + (self.amount * (self.interest_rate / 100))
-        monthly_payment = total_amount / self.repayment_period_months
-        return monthly_payment
+        """
+            Первый платеж по графику (для аннуитета - ежемесячный платеж).
+        """
+        from .amortization import build_payments
+        return build_payments([self])[0].payment
 
     def is_paid(self):
         return self.end_date <= timezone.now().date() if self.end_date else False
@@ -96,6 +284,29 @@ class Debts(models.Model):
         return f"{self.user.username} - {self.amount} Статус: {'Оплачено' if self.is_paid() else 'Не оплачено'}"
 
 
+class DebtPayment(models.Model):
+    debt = models.ForeignKey(Debts, on_delete=models.CASCADE, related_name='payments')
+    number = models.PositiveSmallIntegerField()
+    due_date = models.DateField()
+    payment = models.DecimalField(max_digits=12, decimal_places=2)
+    principal = models.DecimalField(max_digits=12, decimal_places=2)
+    interest = models.DecimalField(max_digits=12, decimal_places=2)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = 'Платеж по долгу'
+        verbose_name_plural = 'График платежей'
+        indexes = [
+            models.Index(fields=['debt', 'due_date'], name='debtpayment_debt_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['debt', 'number'], name='debtpayment_unique_number'),
+        ]
+
+    def __str__(self):
+        return f'{self.debt_id} #{self.number} {self.due_date}: {self.payment}'
+
+
 class Family(models.Model):
     name = models.CharField(max_length=255)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_families')
@@ -115,3 +326,74 @@ class FamilyToken(models.Model):
         self.token = uuid.uuid4()
         self.is_used = False
         self.save()
+
+
+class MonthlyLedgerRollup(models.Model):
+    EXPENSE = 'expense'
+    INCOME = 'income'
+    KIND_CHOICES = [
+        (EXPENSE, 'Расход'),
+        (INCOME, 'Доход'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE, null=True, blank=True)
+    income_category = models.ForeignKey(IncomeCategory, on_delete=models.CASCADE, null=True, blank=True)
+    currency = models.CharField(max_length=3, default=default_currency)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Месячные итоги'
+        verbose_name_plural = 'Месячные итоги'
+        indexes = [
+            models.Index(fields=['user', 'year', 'month', 'kind'], name='rollup_user_period_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month', 'category', 'subcategory', 'currency'],
+                                    condition=models.Q(kind='expense'), name='rollup_unique_expense_key'),
+            models.UniqueConstraint(fields=['user', 'year', 'month', 'income_category', 'currency'],
+                                    condition=models.Q(kind='income'), name='rollup_unique_income_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.month:02d}.{self.year} {self.kind}: {self.total}"
+
+
+class CurrencyRate(models.Model):
+    code = models.CharField(max_length=3, unique=True)
+    name = models.CharField(max_length=255)
+    scale = models.PositiveIntegerField(default=1)
+    rate = models.DecimalField(max_digits=14, decimal_places=4)
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Курс валюты'
+        verbose_name_plural = 'Курсы валют'
+
+    def __str__(self):
+        return f"{self.scale} {self.code} = {self.rate} BYN"
+
+    @property
+    def unit_rate(self):
+        return self.rate / self.scale
+
+
+class ExchangeRate(models.Model):
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=16, decimal_places=8)
+
+    class Meta:
+        verbose_name = 'Исторический курс'
+        verbose_name_plural = 'Исторические курсы'
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchange_rate_currency_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} 1 {self.currency} = {self.rate} BYN"
@@ -0,0 +1,106 @@
+"""
+    Постраничный вывод по ключу (keyset pagination).
+
+    Страница выбирается условием по паре (дата, id) после или до курсора, а не OFFSET,
+    поэтому любая страница стоит как первая: база идет по составному индексу (user, date, id)
+    от курсора и читает только per_page + 1 строк. Общее число строк не считается.
+"""
+import base64
+from datetime import date
+
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, value, pk):
+    raw = f'{direction}:{value.isoformat()}:{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+        Возвращает (направление, дата, id) или None, если курсор отсутствует или поврежден.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, value, pk = raw.split(':')
+        if direction not in (NEXT, PREVIOUS):
+            return None
+        return direction, date.fromisoformat(value), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, field, has_next, has_previous):
+        self.object_list = object_list
+        self.field = field
+        # У пустой страницы (устаревший курсор за последней или перед первой строкой) нет строк,
+        # от которых строятся курсоры соседних страниц.
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(NEXT, getattr(last, self.field), last.pk)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        first = self.object_list[0]
+        return encode_cursor(PREVIOUS, getattr(first, self.field), first.pk)
+
+
+class KeysetPaginator:
+    """
+        Делит queryset на страницы по возрастанию (field, id).
+    """
+
+    def __init__(self, queryset, per_page, field='date'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            rows = list(self.queryset.order_by(self.field, 'id')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self.field, len(rows) > self.per_page, False)
+
+        direction, value, pk = decoded
+        if direction == NEXT:
+            after = Q(**{f'{self.field}__gt': value}) | Q(**{self.field: value, 'id__gt': pk})
+            rows = list(self.queryset.filter(after).order_by(self.field, 'id')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], self.field, len(rows) > self.per_page, True)
+
+        before = Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'id__lt': pk})
+        rows = list(self.queryset.filter(before).order_by(f'-{self.field}', '-id')[:self.per_page + 1])
+        page_rows = rows[:self.per_page]
+        page_rows.reverse()
+        return KeysetPage(page_rows, self.field, True, len(rows) > self.per_page)
@@ -0,0 +1,223 @@
+"""
+    Секционирование таблиц расходов и доходов по дате (только PostgreSQL).
+
+    При LEDGER_PARTITIONING = 'month' или 'year' таблицы budget_expense и budget_income
+    становятся секционированными по диапазону date: запрос за месяц читает одну секцию,
+    а старые секции можно отсоединить без переписывания таблицы. Строки вне созданных
+    секций попадают в секцию DEFAULT. Первичный ключ секционированной таблицы - (id, date),
+    так как PostgreSQL требует, чтобы он включал ключ секционирования.
+    На SQLite и при выключенной настройке таблицы остаются обычными.
+"""
+import re
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .utils import month_range, year_range
+
+MONTH = 'month'
+YEAR = 'year'
+PARTITION_KEY = 'date'
+
+_PARTITION_SUFFIX = re.compile(r'_y(?P<year>\d{4})(?:m(?P<month>\d{2}))?$')
+
+
+def partitioning_interval():
+    interval = getattr(settings, 'LEDGER_PARTITIONING', None) or None
+    if interval not in (None, MONTH, YEAR):
+        raise ImproperlyConfigured("LEDGER_PARTITIONING должен быть 'month', 'year' или пустым.")
+    return interval
+
+
+def is_supported(connection):
+    return connection.vendor == 'postgresql'
+
+
+def partitioned_models():
+    from .models import Expense, Income
+    return [Expense, Income]
+
+
+def partition_bounds(day, interval):
+    """
+        Полуоткрытый интервал секции, содержащей дату day.
+    """
+    if interval == MONTH:
+        return month_range(day.year, day.month)
+    return year_range(day.year)
+
+
+def partition_starts(first_day, last_day, interval):
+    """
+        Начала секций, покрывающих даты с first_day по last_day включительно.
+    """
+    start, end = partition_bounds(first_day, interval)
+    starts = []
+    while start <= last_day:
+        starts.append(start)
+        start, end = partition_bounds(end, interval)
+    return starts
+
+
+def partition_name(table, start, interval):
+    if interval == MONTH:
+        return f'{table}_y{start.year}m{start.month:02d}'
+    return f'{table}_y{start.year}'
+
+
+def partition_end(name):
+    """
+        Конец диапазона секции по ее имени или None, если это не секция по дате (например, DEFAULT).
+    """
+    match = _PARTITION_SUFFIX.search(name)
+    if not match:
+        return None
+    year, month = int(match['year']), match['month']
+    return month_range(year, int(month))[1] if month else year_range(year)[1]
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid))', [table])
+        return cursor.fetchone()[0]
+
+
+def existing_partitions(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s AND pg_table_is_visible(p.oid) '
+            'ORDER BY c.relname', [table])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _literal(day):
+    return f"'{day.isoformat()}'"
+
+
+def create_partition(connection, table, start, interval):
+    """
+        Создает секцию, начинающуюся с start. Строки этого диапазона из секции DEFAULT
+        переносятся в новую секцию. Возвращает False, если секция уже есть.
+    """
+    qn = connection.ops.quote_name
+    name = partition_name(table, start, interval)
+    if name in existing_partitions(connection, table):
+        return False
+    start, end = partition_bounds(start, interval)
+    default = f'{table}_default'
+    in_range = f'{qn(PARTITION_KEY)} >= {_literal(start)} AND {qn(PARTITION_KEY)} < {_literal(end)}'
+    values = f'FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})'
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {qn(default)} WHERE {in_range})')
+        if not cursor.fetchone()[0]:
+            cursor.execute(f'CREATE TABLE {qn(name)} PARTITION OF {qn(table)} {values}')
+            return True
+        # Секция DEFAULT не должна содержать строк нового диапазона: переносим их.
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(default)}')
+        cursor.execute(f'CREATE TABLE {qn(name)} PARTITION OF {qn(table)} {values}')
+        cursor.execute(f'INSERT INTO {qn(name)} SELECT * FROM {qn(default)} WHERE {in_range}')
+        cursor.execute(f'DELETE FROM {qn(default)} WHERE {in_range}')
+        cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(default)} DEFAULT')
+    return True
+
+
+def detach_partitions(connection, table, before):
+    """
+        Отсоединяет секции, целиком лежащие до даты before. Таблицы секций остаются в базе.
+    """
+    qn = connection.ops.quote_name
+    detached = []
+    with connection.cursor() as cursor:
+        for name in existing_partitions(connection, table):
+            end = partition_end(name)
+            if end is not None and end <= before:
+                cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+                detached.append(name)
+    return detached
+
+
+def _table_definition(cursor, table):
+    # Индексы (кроме первичного ключа) и внешние ключи, которые нужно пересоздать на новой таблице.
+    cursor.execute('SELECT pg_get_indexdef(indexrelid) FROM pg_index '
+                   'WHERE indrelid = %s::regclass AND NOT indisprimary', [table])
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+    foreign_keys = cursor.fetchall()
+    return indexes, foreign_keys
+
+
+def _rebuild_table(connection, table, partition_by=None, create_partitions=None):
+    # Пересоздает таблицу с тем же набором столбцов (обычную или секционированную) и переносит данные.
+    # Свойство IDENTITY столбца id не копируется: PostgreSQL до 17 не поддерживает его у секционированных
+    # таблиц. Вместо него id получает значение по умолчанию из собственной последовательности таблицы.
+    qn = connection.ops.quote_name
+    old = f'{table}_rebuild'
+    sequence = f'{table}_id_seq'
+    pk = qn('id')
+    with connection.cursor() as cursor:
+        indexes, foreign_keys = _table_definition(cursor, table)
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        cursor.execute(f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                       + (f' PARTITION BY RANGE ({qn(partition_by)})' if partition_by else ''))
+        # Значение по умолчанию id ссылается на последовательность старой таблицы, она удаляется вместе с ней.
+        cursor.execute(f'ALTER TABLE {qn(table)} ALTER COLUMN {pk} DROP DEFAULT')
+        if create_partitions:
+            create_partitions(cursor)
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f'DROP TABLE {qn(old)} CASCADE')
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {qn(sequence)}')
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence)} AS bigint OWNED BY {qn(table)}.{pk}')
+        cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN {pk} SET DEFAULT nextval('{sequence}'::regclass)")
+        cursor.execute(f'SELECT setval(%s::regclass, COALESCE(MAX({pk}), 0) + 1, false) FROM {qn(table)}',
+                       [sequence])
+        primary_key = ['id', partition_by] if partition_by else ['id']
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY ({", ".join(map(qn, primary_key))})')
+        for definition in indexes:
+            cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+
+
+def last_day_ahead(day, interval, periods):
+    """
+        Последний день периода, отстоящего от периода даты day на periods периодов вперед.
+    """
+    start = partition_bounds(day, interval)[0]
+    for _ in range(periods):
+        start = partition_bounds(start, interval)[1]
+    return partition_bounds(start, interval)[1] - timedelta(days=1)
+
+
+def partition_table(connection, table, interval, ahead=3):
+    """
+        Превращает обычную таблицу в секционированную по date: создает секции от самой ранней
+        операции до ahead периодов вперед и секцию DEFAULT, затем копирует данные.
+    """
+    qn = connection.ops.quote_name
+
+    def create_partitions(cursor):
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+        for start in partition_starts(first_day, last_day_ahead(date.today(), interval, ahead), interval):
+            start, end = partition_bounds(start, interval)
+            cursor.execute(f'CREATE TABLE {qn(partition_name(table, start, interval))} PARTITION OF {qn(table)} '
+                           f'FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})')
+
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT MIN({qn(PARTITION_KEY)}) FROM {qn(table)}')
+            first_day = cursor.fetchone()[0] or date.today()
+        _rebuild_table(connection, table, PARTITION_KEY, create_partitions)
+
+
+def unpartition_table(connection, table):
+    """
+        Возвращает секционированную таблицу к обычной (данные всех присоединенных секций сохраняются).
+    """
+    with transaction.atomic(using=connection.alias):
+        _rebuild_table(connection, table)
@@ -0,0 +1,206 @@
+"""
+    Данные для отчетов о доходах и расходах в базовой валюте.
+
+    Суммы в базовой валюте берутся из месячных итогов. Суммы в других валютах
+    пересчитываются по курсу на день операции одним агрегирующим запросом к исходным
+    операциям за период (только по операциям не в базовой валюте).
+    Динамика за несколько месяцев строится одним GROUP BY по месячным итогам
+    и разворачивается в помесячные ряды через pandas.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from .fx import base_amount
+from .models import Expense, Income, MonthlyLedgerRollup
+from .utils import filter_by_period, month_range
+
+TREND_MONTHS = (12, 24, 60)
+
+
+def _rollups(user_ids, year, month=None):
+    rollups = MonthlyLedgerRollup.objects.filter(user_id__in=user_ids, year=year, count__gt=0)
+    if month:
+        rollups = rollups.filter(month=month)
+    return rollups
+
+
+def _converted(queryset, group_by, user_ids, year, month):
+    """
+        Пересчитывает операции не в базовой валюте за период и группирует их по group_by.
+        Возвращает ({ключ: сумма}, число операций без курса).
+    """
+    return _grouped_in_base_currency(filter_by_period(queryset.filter(user_id__in=user_ids), year, month), group_by)
+
+
+def _grouped_in_base_currency(queryset, group_by):
+    rows = queryset.exclude(currency=settings.BASE_CURRENCY).annotate(base_amount=base_amount()) \
+        .values(*group_by).annotate(total=Sum('base_amount'), unconverted=Count('id', filter=Q(base_amount=None))) \
+        .order_by()
+    totals = {}
+    unconverted = 0
+    for row in rows:
+        totals[tuple(row[field] for field in group_by)] = row['total'] or Decimal(0)
+        unconverted += row['unconverted']
+    return totals, unconverted
+
+
+def month_summary(user_ids, year, month):
+    """
+        Итоги месяца в базовой валюте: доходы, расходы, остаток и расходы по категориям.
+        Возвращает None, если за месяц нет операций.
+    """
+    rows = list(_rollups(user_ids, year, month).values('kind', 'category__name', 'currency')
+                .annotate(total=Sum('total')).order_by())
+    if not rows:
+        return None
+
+    base_currency = settings.BASE_CURRENCY
+    totals = {MonthlyLedgerRollup.INCOME: Decimal(0), MonthlyLedgerRollup.EXPENSE: Decimal(0)}
+    categories = defaultdict(Decimal)
+    foreign_kinds = set()
+    for row in rows:
+        if row['currency'] != base_currency:
+            foreign_kinds.add(row['kind'])
+            continue
+        totals[row['kind']] += row['total']
+        if row['kind'] == MonthlyLedgerRollup.EXPENSE:
+            categories[row['category__name']] += row['total']
+
+    unconverted = 0
+    if MonthlyLedgerRollup.EXPENSE in foreign_kinds:
+        converted, missing = _converted(Expense.objects.alive(), ['category__name'], user_ids, year, month)
+        for (category_name,), total in converted.items():
+            categories[category_name] += total
+            totals[MonthlyLedgerRollup.EXPENSE] += total
+        unconverted += missing
+    if MonthlyLedgerRollup.INCOME in foreign_kinds:
+        converted, missing = _converted(Income.objects.alive(), ['currency'], user_ids, year, month)
+        totals[MonthlyLedgerRollup.INCOME] += sum(converted.values(), Decimal(0))
+        unconverted += missing
+
+    total_income = totals[MonthlyLedgerRollup.INCOME]
+    total_expense = totals[MonthlyLedgerRollup.EXPENSE]
+    top_expenses = [{'category__name': name, 'total_amount': total}
+                    for name, total in sorted(categories.items(), key=lambda item: item[1], reverse=True)]
+    return {
+        'total_income': total_income,
+        'total_expense': total_expense,
+        'income_balance': total_income - total_expense,
+        'top_expenses': top_expenses,
+        'unconverted': unconverted,
+    }
+
+
+def category_summary(user_ids, category, year, month=None):
+    """
+        Расходы категории по подкатегориям в базовой валюте за месяц или год.
+        Возвращает (список {'name', 'total_expense'}, число операций без курса) или None, если данных нет.
+    """
+    rows = list(_rollups(user_ids, year, month).filter(kind=MonthlyLedgerRollup.EXPENSE, category=category)
+                .values('subcategory__name', 'currency').annotate(total=Sum('total')).order_by())
+    if not rows:
+        return None
+
+    base_currency = settings.BASE_CURRENCY
+    subcategories = defaultdict(Decimal)
+    for row in rows:
+        if row['currency'] == base_currency:
+            subcategories[row['subcategory__name']] += row['total']
+
+    unconverted = 0
+    if any(row['currency'] != base_currency for row in rows):
+        converted, unconverted = _converted(Expense.objects.alive().filter(category=category), ['subcategory__name'],
+                                            user_ids, year, month)
+        for (subcategory_name,), total in converted.items():
+            subcategories[subcategory_name] += total
+
+    data = [{'name': name, 'total_expense': total} for name, total in subcategories.items()]
+    return data, unconverted
+
+
+def trend_periods(months, today=None):
+    """
+        Список (год, месяц) за последние months месяцев, включая текущий.
+    """
+    today = today or date.today()
+    last = today.year * 12 + today.month - 1
+    return [(index // 12, index % 12 + 1) for index in range(last - months + 1, last + 1)]
+
+
+def trend_records(user_ids, periods):
+    """
+        Месячные итоги по видам и категориям за периоды periods (список (год, месяц)) в базовой валюте.
+        Итоги в базовой валюте - одним GROUP BY по месячным итогам, остальные валюты - одним запросом
+        к операциям с группировкой по TruncMonth. Возвращает ([(год, месяц, вид, категория, сумма)], без курса),
+        категория - категория расхода или категория дохода.
+    """
+    (first_year, first_month), (last_year, last_month) = periods[0], periods[-1]
+    rows = MonthlyLedgerRollup.objects.filter(user_id__in=user_ids, year__gte=first_year, year__lte=last_year,
+                                              count__gt=0) \
+        .annotate(period=F('year') * 12 + F('month')) \
+        .filter(period__gte=first_year * 12 + first_month, period__lte=last_year * 12 + last_month) \
+        .values_list('year', 'month', 'kind', 'category__name', 'income_category__name', 'currency') \
+        .annotate(total=Sum('total')).order_by()
+
+    base_currency = settings.BASE_CURRENCY
+    records = []
+    foreign_kinds = set()
+    for year, month, kind, category_name, income_category_name, currency, total in rows:
+        if currency != base_currency:
+            foreign_kinds.add(kind)
+            continue
+        records.append((year, month, kind, category_name or income_category_name, total))
+
+    unconverted = 0
+    start, end = month_range(first_year, first_month)[0], month_range(last_year, last_month)[1]
+    for kind, model, group_by in [(MonthlyLedgerRollup.EXPENSE, Expense, ['period', 'category__name']),
+                                  (MonthlyLedgerRollup.INCOME, Income, ['period', 'income_category__name'])]:
+        if kind not in foreign_kinds:
+            continue
+        queryset = model.objects.alive().filter(user_id__in=user_ids, date__gte=start, date__lt=end) \
+            .annotate(period=TruncMonth('date'))
+        converted, missing = _grouped_in_base_currency(queryset, group_by)
+        for (period, category_name), total in converted.items():
+            records.append((period.year, period.month, kind, category_name, total))
+        unconverted += missing
+    return records, unconverted
+
+
+def trend_summary(user_ids, months=TREND_MONTHS[0], today=None):
+    """
+        Помесячная динамика в базовой валюте за months месяцев: доходы, расходы, остаток
+        и расходы по категориям. Месяцы без операций заполняются нулями.
+    """
+    import pandas as pd
+
+    periods = trend_periods(months, today)
+    labels = [f'{year}-{month:02d}' for year, month in periods]
+    records, unconverted = trend_records(user_ids, periods)
+
+    frame = pd.DataFrame.from_records(records, columns=['year', 'month', 'kind', 'category', 'total'])
+    frame['period'] = [f'{year}-{month:02d}' for year, month in zip(frame['year'], frame['month'])]
+    zero = Decimal(0)
+    kinds = frame.groupby(['kind', 'period'])['total'].sum().unstack('period') \
+        .reindex(index=[MonthlyLedgerRollup.INCOME, MonthlyLedgerRollup.EXPENSE], columns=labels).fillna(zero)
+    expenses = frame[frame['kind'] == MonthlyLedgerRollup.EXPENSE]
+    categories = expenses.groupby(['category', 'period'])['total'].sum().unstack('period') \
+        .reindex(columns=labels).fillna(zero)
+    order = sorted(categories.index, key=lambda name: sum(categories.loc[name], zero), reverse=True)
+
+    income = list(kinds.loc[MonthlyLedgerRollup.INCOME])
+    expense = list(kinds.loc[MonthlyLedgerRollup.EXPENSE])
+    return {
+        'months': labels,
+        'income': income,
+        'expense': expense,
+        'balance': [month_income - month_expense for month_income, month_expense in zip(income, expense)],
+        'categories': [{'name': name, 'totals': list(categories.loc[name])} for name in order],
+        'total_income': sum(income, zero),
+        'total_expense': sum(expense, zero),
+        'unconverted': unconverted,
+    }
@@ -0,0 +1,150 @@
+"""
+    Поддержка таблицы месячных итогов (MonthlyLedgerRollup).
+
+    Каждое создание, изменение и удаление расхода или дохода применяет к итогам
+    дельту в той же транзакции, поэтому отчеты читают O(категорий) строк вместо
+    всех операций за месяц. rebuild_rollups пересчитывает итоги с нуля.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .cache import bump_ledger_version
+from .models import Expense, Income, MonthlyLedgerRollup
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+
+def _apply(kind, user_id, on_date, amount, count, **keys):
+    on_date = _as_date(on_date)
+    lookup = dict(user_id=user_id, year=on_date.year, month=on_date.month, kind=kind, **keys)
+    rollups = MonthlyLedgerRollup.objects.filter(**lookup)
+    if not rollups.update(total=F('total') + amount, count=F('count') + count):
+        try:
+            with transaction.atomic():
+                MonthlyLedgerRollup.objects.create(total=amount, count=count, **lookup)
+        except IntegrityError:
+            rollups.update(total=F('total') + amount, count=F('count') + count)
+    if count < 0:
+        rollups.filter(count__lte=0).delete()
+    # Версия увеличивается после фиксации: иначе параллельный запрос закэширует старые данные под новой версией.
+    transaction.on_commit(partial(bump_ledger_version, user_id))
+
+
+def apply_expense(expense, sign=1):
+    """
+        Добавляет расход в месячные итоги (sign=-1 - вычитает).
+    """
+    _apply(MonthlyLedgerRollup.EXPENSE, expense.user_id, expense.date, sign * Decimal(str(expense.amount)), sign,
+           category_id=expense.category_id, subcategory_id=expense.subcategory_id, currency=expense.currency)
+
+
+def apply_expenses(expenses, sign=1):
+    """
+        Применяет к итогам пачку расходов, группируя их по ключу итогов,
+        чтобы на каждую группу приходилось одно обновление.
+    """
+    groups = defaultdict(lambda: [Decimal(0), 0])
+    for expense in expenses:
+        on_date = _as_date(expense.date)
+        group = groups[(expense.user_id, on_date.replace(day=1), expense.category_id, expense.subcategory_id,
+                        expense.currency)]
+        group[0] += Decimal(str(expense.amount))
+        group[1] += 1
+    for (user_id, month, category_id, subcategory_id, currency), (amount, count) in groups.items():
+        _apply(MonthlyLedgerRollup.EXPENSE, user_id, month, sign * amount, sign * count,
+               category_id=category_id, subcategory_id=subcategory_id, currency=currency)
+
+
+def apply_income(income, sign=1):
+    """
+        Добавляет доход в месячные итоги (sign=-1 - вычитает).
+    """
+    _apply(MonthlyLedgerRollup.INCOME, income.user_id, income.date, sign * Decimal(str(income.amount)), sign,
+           income_category_id=income.income_category_id, currency=income.currency)
+
+
+ROLLUP_KEYS = {
+    Expense: (MonthlyLedgerRollup.EXPENSE, ('category_id', 'subcategory_id')),
+    Income: (MonthlyLedgerRollup.INCOME, ('income_category_id',)),
+}
+
+
+def rollup_groups(queryset):
+    """
+        Суммы операций queryset (расходов или доходов) по ключу месячных итогов одним агрегирующим запросом.
+        Возвращает список {'user_id', 'year', 'month', <ключи категории>, 'currency', 'total', 'count'}.
+    """
+    _, keys = ROLLUP_KEYS[queryset.model]
+    return list(queryset.annotate(year=ExtractYear('date'), month=ExtractMonth('date'))
+                .values('user_id', 'year', 'month', *keys, 'currency')
+                .annotate(total=Sum('amount'), count=Count('id')).order_by())
+
+
+def apply_groups(model, groups, sign=1):
+    """
+        Применяет к итогам суммы, полученные rollup_groups (sign=-1 - вычитает).
+        Группы с одинаковым ключом объединяются, чтобы на каждый ключ приходилось одно обновление.
+    """
+    kind, keys = ROLLUP_KEYS[model]
+    merged = defaultdict(lambda: [Decimal(0), 0])
+    for group in groups:
+        merged_group = merged[(group['user_id'], group['year'], group['month'], group['currency'],
+                               *(group[key] for key in keys))]
+        merged_group[0] += Decimal(str(group['total']))
+        merged_group[1] += group['count']
+    for (user_id, year, month, currency, *values), (amount, count) in merged.items():
+        _apply(kind, user_id, date(year, month, 1), sign * amount, sign * count, currency=currency,
+               **dict(zip(keys, values)))
+
+
+@transaction.atomic
+def rebuild_rollups(user_ids=None):
+    """
+        Пересчитывает месячные итоги по исходным расходам и доходам.
+        Если передан user_ids, пересчитываются только итоги этих пользователей.
+        Возвращает количество созданных строк итогов.
+    """
+    expenses = Expense.objects.alive()
+    incomes = Income.objects.alive()
+    rollups = MonthlyLedgerRollup.objects.all()
+    if user_ids is not None:
+        expenses = expenses.filter(user_id__in=user_ids)
+        incomes = incomes.filter(user_id__in=user_ids)
+        rollups = rollups.filter(user_id__in=user_ids)
+
+    period = {'year': ExtractYear('date'), 'month': ExtractMonth('date')}
+    new_rollups = [
+        MonthlyLedgerRollup(kind=MonthlyLedgerRollup.EXPENSE, total=row['total'], count=row['count'],
+                            user_id=row['user_id'], year=row['year'], month=row['month'],
+                            category_id=row['category_id'], subcategory_id=row['subcategory_id'],
+                            currency=row['currency'])
+        for row in expenses.annotate(**period)
+        .values('user_id', 'year', 'month', 'category_id', 'subcategory_id', 'currency')
+        .annotate(total=Sum('amount'), count=Count('id')).order_by()
+    ]
+    new_rollups += [
+        MonthlyLedgerRollup(kind=MonthlyLedgerRollup.INCOME, total=row['total'], count=row['count'],
+                            user_id=row['user_id'], year=row['year'], month=row['month'],
+                            income_category_id=row['income_category_id'], currency=row['currency'])
+        for row in incomes.annotate(**period).values('user_id', 'year', 'month', 'income_category_id', 'currency')
+        .annotate(total=Sum('amount'), count=Count('id')).order_by()
+    ]
+
+    rollups.delete()
+    MonthlyLedgerRollup.objects.bulk_create(new_rollups, batch_size=1000)
+    if user_ids is None:
+        transaction.on_commit(bump_ledger_version)
+    else:
+        for user_id in user_ids:
+            transaction.on_commit(partial(bump_ledger_version, user_id))
+    return len(new_rollups)
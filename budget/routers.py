@@ -0,0 +1,117 @@
+"""
+    Чтение отчетов, экспорта и списков с реплики базы данных.
+
+    Реплика задается алиасом REPORTS_DB_ALIAS в DATABASES. Представления, помеченные
+    декоратором replica_view, читают с нее, все записи идут в default. Пользователь, только
+    что изменивший данные, на REPLICA_PIN_SECONDS секунд закрепляется за основной базой,
+    чтобы сразу видеть свои изменения (read-your-writes), пока реплика догоняет основную базу.
+    Если алиас реплики не настроен, все запросы идут в default.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import StreamingHttpResponse
+
+PIN_CACHE_KEY = 'db-pin:user:{}'
+DEFAULT_PIN_SECONDS = 5
+
+_read_alias = ContextVar('budget_read_alias', default=None)
+
+
+def replica_alias():
+    alias = getattr(settings, 'REPORTS_DB_ALIAS', None)
+    return alias if alias and alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def pin_to_primary(user_id):
+    """
+        Закрепляет пользователя за основной базой после записи.
+    """
+    cache.set(PIN_CACHE_KEY.format(user_id), 1, timeout=getattr(settings, 'REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS))
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_CACHE_KEY.format(user_id)) is not None
+
+
+def read_alias(user):
+    """
+        Алиас базы для чтения данных пользователя: реплика, если она настроена и пользователь не закреплен.
+    """
+    alias = replica_alias()
+    if alias == DEFAULT_DB_ALIAS or (user.is_authenticated and is_pinned(user.id)):
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+def reads_from_primary():
+    """
+        True, если текущие запросы на чтение идут в основную базу. Данные, прочитанные с реплики,
+        могут отставать от версии данных и не должны попадать в долгоживущие кэши.
+    """
+    return (_read_alias.get() or DEFAULT_DB_ALIAS) == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def _stream_from(alias, content):
+    # Потоковый ответ читает строки уже после выхода из представления.
+    with reading_from(alias):
+        yield from content
+
+
+def replica_view(view):
+    """
+        Декоратор представления только для чтения: его запросы идут на реплику.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = read_alias(request.user)
+        with reading_from(alias):
+            response = view(request, *args, **kwargs)
+        if isinstance(response, StreamingHttpResponse):
+            response.streaming_content = _stream_from(alias, response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+        Чтение - из базы, выбранной replica_view (иначе default), запись - всегда в default.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class PrimaryPinMiddleware:
+    """
+        Закрепляет пользователя за основной базой после любого изменяющего запроса (POST и т.п.).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and request.user.is_authenticated \
+                and replica_alias() != DEFAULT_DB_ALIAS:
+            pin_to_primary(request.user.id)
+        return response
@@ -0,0 +1,85 @@
+"""
+    Область данных (ledger scope) пользователя: его собственные операции или операции всей семьи.
+
+    Область вычисляется один раз на запрос (get_scope) и кэшируется между запросами.
+    Кэш сбрасывается при создании семьи, вступлении в семью и выходе из нее.
+    Области хранятся в двухуровневом кэше 'tiered', поэтому сброс доходит до всех процессов.
+    Состав семьи всегда читается из основной базы: отстающая реплика после сброса кэша
+    вернула бы старый состав, и он закэшировался бы на SCOPE_TIMEOUT.
+"""
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import FamilyMember
+
+SCOPE_CACHE_KEY = 'ledger-scope:user:{}'
+SCOPE_TIMEOUT = 60 * 60
+
+cache = caches['tiered']
+
+
+class LedgerScope:
+    def __init__(self, user_id, family_id=None, user_ids=None):
+        self.user_id = user_id
+        self.family_id = family_id
+        self.user_ids = tuple(sorted(user_ids or [user_id]))
+
+    @property
+    def is_family(self):
+        return self.family_id is not None
+
+    @property
+    def key(self):
+        """
+            Ключ области для кэшей: 'family:<id>' или 'user:<id>'.
+        """
+        return f'family:{self.family_id}' if self.is_family else f'user:{self.user_id}'
+
+    def __repr__(self):
+        return f'<LedgerScope {self.key} users={list(self.user_ids)}>'
+
+
+def _load_scope(user_id):
+    # Один запрос к основной базе: все участники семьи пользователя (если он состоит в семье).
+    members = list(FamilyMember.objects.using(DEFAULT_DB_ALIAS).filter(family__familymember__user_id=user_id)
+                   .values_list('family_id', 'user_id'))
+    if not members:
+        return LedgerScope(user_id)
+    return LedgerScope(user_id, members[0][0], [member_user_id for _, member_user_id in members])
+
+
+def resolve_scope(user):
+    """
+        Возвращает область данных пользователя из кэша или из базы.
+    """
+    key = SCOPE_CACHE_KEY.format(user.id)
+    scope = cache.get(key)
+    if scope is None:
+        scope = _load_scope(user.id)
+        cache.set(key, scope, timeout=SCOPE_TIMEOUT)
+    return scope
+
+
+def invalidate_scope(*user_ids):
+    """
+        Сбрасывает закэшированные области данных пользователей.
+    """
+    cache.delete_many([SCOPE_CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def invalidate_family_scope(family_id, *extra_user_ids):
+    """
+        Сбрасывает области данных всех участников семьи и дополнительных пользователей.
+    """
+    user_ids = set(FamilyMember.objects.filter(family_id=family_id).values_list('user_id', flat=True))
+    invalidate_scope(*(user_ids | set(extra_user_ids)))
+
+
+def get_scope(request):
+    """
+        Возвращает область данных текущего запроса (один раз за запрос).
+    """
+    scope = getattr(request, '_ledger_scope', None)
+    if scope is None:
+        scope = request._ledger_scope = resolve_scope(request.user)
+    return scope
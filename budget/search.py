@@ -0,0 +1,163 @@
+"""
+    Полнотекстовый поиск по описаниям доходов и долгов и по названиям категорий.
+
+    На PostgreSQL поиск идет по GIN-индексам to_tsvector('simple', ...) и pg_trgm
+    (опечатки и части слов), на SQLite - по таблицам FTS5 с внешним содержимым,
+    которые поддерживаются триггерами. Индексы создает миграция 0008_search_index.
+    Результаты упорядочены по релевантности и выдаются страницами по ключу
+    (релевантность, тип, id) без OFFSET. Условие курсора и LIMIT применяются в запросе
+    каждого источника, поэтому объединяются не больше limit + 1 строк от источника.
+    Релевантность считается только для SEARCH_CANDIDATES самых новых совпадений источника:
+    для частого слова это ограничивает работу на страницу, а не весь набор совпадений.
+"""
+import base64
+import json
+import re
+
+from django.db import connections, router
+
+from .models import Category, Debts, Income, IncomeCategory, Subcategory
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_CANDIDATES = 1000
+TS_CONFIG = 'simple'
+
+# (тип, таблица, текстовое поле, условие на владельца, join для условий, условие на удаленные категории)
+SOURCES = [
+    ('income', 'budget_income', 'description', 't.user_id',
+     'JOIN budget_incomecategory c ON c.id = t.income_category_id', 'c.deleted_at IS NULL'),
+    ('debt', 'budget_debts', 'description', 't.user_id', '', ''),
+    ('category', 'budget_category', 'name', 't.user_id', '', 't.deleted_at IS NULL'),
+    ('income_category', 'budget_incomecategory', 'name', 't.user_id', '', 't.deleted_at IS NULL'),
+    ('subcategory', 'budget_subcategory', 'name', 'c.user_id', 'JOIN budget_category c ON c.id = t.category_id',
+     't.deleted_at IS NULL AND c.deleted_at IS NULL'),
+]
+
+KIND_LABELS = {
+    'income': 'Доход',
+    'debt': 'Долг',
+    'category': 'Категория расходов',
+    'income_category': 'Источник дохода',
+    'subcategory': 'Подкатегория',
+}
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def encode_cursor(score, kind, pk):
+    return base64.urlsafe_b64encode(json.dumps([score, kind, pk]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        score, kind, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(score), str(kind), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def _sqlite_sources(terms, owners):
+    # Подзапрос с LIMIT не встраивается во внешний запрос, поэтому bm25 вычисляется только в нем.
+    match = ' '.join(f'"{term}"*' for term in terms)
+    queries, params = [], []
+    for kind, table, _, owner, join, alive in SOURCES:
+        fts = fts_table(table)
+        queries.append(f"SELECT '{kind}' AS kind, t.id AS id, bm25({fts}) AS score "
+                       f'FROM {fts} JOIN {table} t ON t.id = {fts}.rowid {join} '
+                       f'WHERE {fts} MATCH %s AND {owner} IN ({owners})' + (f' AND {alive}' if alive else '')
+                       + f' ORDER BY {fts}.rowid DESC LIMIT %s')
+        params.append([match, SEARCH_CANDIDATES])
+    return queries, params
+
+
+def _postgres_sources(terms, owners):
+    tsquery = ' & '.join(f"'{term}':*" for term in terms)
+    text = ' '.join(terms)
+    ts_query = f"to_tsquery('{TS_CONFIG}', %s)"
+    queries, params = [], []
+    for kind, table, field, owner, join, alive in SOURCES:
+        vector = f"to_tsvector('{TS_CONFIG}', {{}}.{field})"
+        candidates = (f'SELECT t.id, t.{field} FROM {table} t {join} '
+                      f"WHERE ({vector.format('t')} @@ {ts_query} OR t.{field} %% %s) AND {owner} IN ({owners})"
+                      + (f' AND {alive}' if alive else '') + ' ORDER BY t.id DESC LIMIT %s')
+        queries.append(f"SELECT '{kind}' AS kind, c.id AS id, "
+                       f"-GREATEST(ts_rank({vector.format('c')}, {ts_query}), similarity(c.{field}, %s))::float8 "
+                       f'AS score FROM ({candidates}) c')
+        params.append([tsquery, text, tsquery, text, SEARCH_CANDIDATES])
+    return queries, params
+
+
+class SearchPage:
+    def __init__(self, results, next_cursor):
+        self.results = results
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _load_objects(rows):
+    ids = {}
+    for kind, pk, _ in rows:
+        ids.setdefault(kind, []).append(pk)
+    loaders = {
+        'income': lambda pks: Income.objects.filter(id__in=pks).select_related('income_category'),
+        'debt': lambda pks: Debts.objects.filter(id__in=pks),
+        'category': lambda pks: Category.objects.filter(id__in=pks),
+        'income_category': lambda pks: IncomeCategory.objects.filter(id__in=pks),
+        'subcategory': lambda pks: Subcategory.objects.filter(id__in=pks).select_related('category'),
+    }
+    return {(kind, obj.pk): obj for kind, pks in ids.items() for obj in loaders[kind](pks)}
+
+
+def search_ledger(user_ids, query, cursor=None, limit=SEARCH_PAGE_SIZE):
+    """
+        Ищет query среди записей пользователей user_ids.
+        Возвращает SearchPage со списком {'kind', 'label', 'object', 'score'} и курсором следующей страницы.
+    """
+    terms = search_terms(query)
+    user_ids = [int(user_id) for user_id in user_ids]
+    if not terms or not user_ids:
+        return SearchPage([], None)
+
+    connection = connections[router.db_for_read(Income)]
+    owners = ', '.join(str(user_id) for user_id in user_ids)
+    build = _postgres_sources if connection.vendor == 'postgresql' else _sqlite_sources
+    queries, source_params = build(terms, owners)
+    # Каждый источник отдает не больше limit + 1 строк после курсора, внешний запрос только сливает их.
+    after = decode_cursor(cursor)
+    condition = ' WHERE (score, kind, id) > (%s, %s, %s)' if after else ''
+    pages, params = [], []
+    for query, query_params in zip(queries, source_params):
+        pages.append(f'SELECT * FROM (SELECT kind, id, score FROM ({query}) source{condition} '
+                     f'ORDER BY score, kind, id LIMIT %s) page')
+        params.extend(query_params + list(after or ()) + [limit + 1])
+    sql = f'SELECT kind, id, score FROM ({" UNION ALL ".join(pages)}) results ORDER BY score, kind, id LIMIT %s'
+    params.append(limit + 1)
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        kind, pk, score = rows[limit - 1]
+        next_cursor = encode_cursor(score, kind, pk)
+    rows = rows[:limit]
+    objects = _load_objects(rows)
+    results = [{'kind': kind, 'label': KIND_LABELS[kind], 'object': objects[kind, pk], 'score': score}
+               for kind, pk, score in rows if (kind, pk) in objects]
+    return SearchPage(results, next_cursor)
@@ -4,10 +4,45 @@
     Тесты представления и функционала, предоставляемого приложением бюджета,
     включая управление расходами, управление доходами, управление долгами, отчеты и управление семьей.
 """
+import csv
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from budget.views import *
+from budget import amortization, charts, currency, forecast, partitioning, reports
+from budget.cache import chart_cache_stats, get_or_render_chart, ledger_stamp
+from budget.cache_backends import TwoTierCache
+from budget.categories import category_tree
+from budget.fx import store_rates
+from budget.importers import ExpenseImporter
+from budget.models import CurrencyRate, DebtPayment, ExchangeRate, MonthlyLedgerRollup
+from budget.management.commands.startup_profile import profile_imports
+from budget.pagination import NEXT, PREVIOUS, KeysetPaginator, encode_cursor
+from budget.rollups import rebuild_rollups
+from budget.routers import ReplicaRouter, read_alias, reading_from, replica_alias, replica_view
+from budget.scope import resolve_scope
+from budget.search import search_ledger
+from budget.tombstones import purge_deleted
+from budget.utils import month_range, filter_by_period
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
 
 
 class ExpenseViewsTestCase(TestCase):
@@ -187,6 +222,463 @@ class DebtsViewsTestCase(TestCase):
         self.assertFalse(Debts.objects.filter(id=self.debt.id).exists())
 
 
+class AmortizationTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+
+    def make_debt(self, **fields):
+        values = dict(user=self.user, amount=Decimal('1000.00'), description='Loan', start_date=date(2024, 1, 31),
+                      repayment_period_months=12, end_date=date(2025, 1, 31), interest_rate=12.0)
+        values.update(fields)
+        return Debts.objects.create(**values)
+
+    def test_add_months_clamps_to_month_end(self):
+        self.assertEqual(amortization.add_months(date(2024, 1, 31), 1), date(2024, 2, 29))
+        self.assertEqual(amortization.add_months(date(2023, 1, 31), 1), date(2023, 2, 28))
+        self.assertEqual(amortization.add_months(date(2024, 11, 30), 3), date(2025, 2, 28))
+
+    def test_annuity_schedule(self):
+        payments = amortization.build_payments([self.make_debt()])
+        self.assertEqual(len(payments), 12)
+        self.assertEqual(sum(payment.principal for payment in payments), Decimal('1000.00'))
+        self.assertEqual(payments[0].payment, Decimal('88.85'))
+        self.assertEqual(payments[0].interest, Decimal('10.00'))
+        self.assertEqual({payment.payment for payment in payments[:-1]}, {Decimal('88.85')})
+        self.assertLessEqual(abs(payments[-1].payment - Decimal('88.85')), Decimal('0.05'))
+        self.assertEqual(payments[-1].balance, Decimal('0.00'))
+        self.assertEqual([payment.due_date for payment in payments[:2]], [date(2024, 2, 29), date(2024, 3, 31)])
+
+    def test_differentiated_schedule(self):
+        debt = self.make_debt(payment_method=amortization.DIFFERENTIATED, amount=Decimal('1200.00'))
+        payments = amortization.build_payments([debt])
+        self.assertEqual({payment.principal for payment in payments}, {Decimal('100.00')})
+        self.assertEqual(payments[0].interest, Decimal('12.00'))
+        self.assertEqual(payments[-1].interest, Decimal('1.00'))
+        self.assertEqual(payments[5].balance, Decimal('600.00'))
+
+    def test_schedules_of_different_terms_in_one_pass(self):
+        debts = [self.make_debt(repayment_period_months=3, interest_rate=0), self.make_debt(repayment_period_months=24)]
+        payments = amortization.build_payments(debts)
+        self.assertEqual(len(payments), 27)
+        self.assertEqual([payment.payment for payment in payments[:3]],
+                         [Decimal('333.33'), Decimal('333.33'), Decimal('333.34')])
+
+    def test_monthly_payment_matches_schedule(self):
+        self.assertEqual(self.make_debt().calculate_monthly_payment(), Decimal('88.85'))
+
+    def test_add_debts_materializes_schedule(self):
+        self.client.post(reverse('add_debts'), {
+            'amount': 600,
+            'description': 'New debt',
+            'start_date': '2024-01-31',
+            'repayment_period_months': 6,
+            'interest_rate': 0,
+            'payment_method': amortization.DIFFERENTIATED,
+        })
+        debt = Debts.objects.get(description='New debt')
+        self.assertEqual(debt.end_date, date(2024, 7, 31))
+        self.assertEqual(debt.payment_method, amortization.DIFFERENTIATED)
+        self.assertEqual(list(debt.payments.values_list('payment', flat=True)), [Decimal('100.00')] * 6)
+
+    def test_debts_list_shows_next_payment_and_balance(self):
+        debt = self.make_debt(start_date=date(2024, 1, 10), end_date=date(2025, 1, 10))
+        amortization.materialize_schedules([debt])
+        annotated = Debts.objects.filter(pk=debt.pk).with_schedule(on_date=date(2024, 3, 15)).get()
+        self.assertEqual(annotated.next_due_date, date(2024, 4, 10))
+        self.assertEqual(annotated.remaining_balance, DebtPayment.objects.get(debt=debt, number=2).balance)
+        response = self.client.get(reverse('debts_list'))
+        self.assertContains(response, 'Аннуитетный')
+        self.assertEqual(DebtPayment.objects.filter(debt=debt).count(), 12)
+
+    def test_admin_change_rematerializes_schedule(self):
+        debt = self.make_debt()
+        amortization.materialize_schedules([debt])
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass1234')
+        self.client.login(username='admin', password='adminpass1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:budget_debts_change', args=[debt.pk]), {
+                'user': self.user.pk, 'amount': '600.00', 'description': 'Loan', 'start_date': '2024-01-31',
+                'repayment_period_months': 6, 'interest_rate': 0, 'currency': debt.currency,
+                'payment_method': amortization.DIFFERENTIATED,
+            })
+        self.assertEqual(response.status_code, 302)
+        debt.refresh_from_db()
+        self.assertEqual(debt.end_date, date(2024, 7, 31))
+        self.assertEqual(list(debt.payments.values_list('payment', flat=True)), [Decimal('100.00')] * 6)
+        payment = debt.payments.first()
+        response = self.client.post(reverse('admin:budget_debtpayment_change', args=[payment.pk]),
+                                    {'payment': '1.00'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(DebtPayment.objects.get(pk=payment.pk).payment, Decimal('100.00'))
+
+
+class DebtStatusTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.today = timezone.now().date()
+        months = [amortization.add_months(self.today, number) for number in range(-1, 10)]
+        self.make_debt('Running', months[-1], months, 120)
+        self.make_debt('Ending', self.today + timedelta(days=10), [self.today + timedelta(days=10)], 300)
+        self.make_debt('Closed', self.today, [self.today - timedelta(days=30)], 100)
+        self.make_debt('Foreign', months[3], months[1:4], 200, currency='USD')
+
+    def make_debt(self, description, end_date, due_dates, payment, **fields):
+        debt = Debts.objects.create(user=self.user, amount=payment * len(due_dates), description=description,
+                                    start_date=date(2020, 1, 1), repayment_period_months=len(due_dates),
+                                    end_date=end_date, interest_rate=0, **fields)
+        DebtPayment.objects.bulk_create(
+            DebtPayment(debt=debt, number=number, due_date=due_date, payment=payment, principal=payment, interest=0,
+                        balance=payment * (len(due_dates) - number))
+            for number, due_date in enumerate(due_dates, 1)
+        )
+        return debt
+
+    def descriptions(self, queryset):
+        return set(queryset.values_list('description', flat=True))
+
+    def test_status_filters(self):
+        debts = Debts.objects.filter(user=self.user)
+        self.assertEqual(self.descriptions(debts.outstanding()), {'Running', 'Ending', 'Foreign'})
+        self.assertEqual(self.descriptions(debts.paid()), {'Closed'})
+        self.assertEqual(self.descriptions(debts.due_within(30)), {'Ending'})
+        self.assertEqual(self.descriptions(debts.with_status().filter(paid_off=True)), {'Closed'})
+        with self.assertNumQueries(1):
+            self.assertEqual(debts.status_counts(30), {'outstanding': 3, 'paid': 1, 'due': 1})
+
+    def test_obligations_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = Debts.objects.filter(user=self.user).obligations()
+        by_currency = {row['currency']: row for row in rows}
+        self.assertEqual(by_currency['USD']['count'], 1)
+        self.assertEqual(by_currency['USD']['principal'], Decimal('600'))
+        self.assertEqual(by_currency['USD']['monthly'], Decimal('200'))
+        self.assertEqual(by_currency['BYN']['count'], 2)
+        self.assertEqual(by_currency['BYN']['principal'], Decimal('1500'))
+        self.assertEqual(by_currency['BYN']['monthly'], Decimal('420'))
+
+    def test_debts_list_status_and_summary(self):
+        response = self.client.get(reverse('debts_list'), {'status': 'paid'})
+        self.assertEqual([debt.description for debt in response.context['debts']], ['Closed'])
+        self.assertEqual(response.context['status_counts'], {'outstanding': 3, 'paid': 1, 'due': 1})
+        self.assertEqual(len(response.context['obligations']), 2)
+
+    def test_debts_list_queries_do_not_grow_with_debts(self):
+        self.client.get(reverse('debts_list'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('debts_list'), HTTP_CACHE_CONTROL='no-cache')
+        for number in range(5):
+            self.make_debt(f'More {number}', self.today + timedelta(days=40), [self.today + timedelta(days=40)], 50)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('debts_list'), HTTP_CACHE_CONTROL='no-cache')
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+
+class ForecastTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.today = date(2024, 6, 15)
+        self.housing = Category.objects.create(name='Housing', user=self.user)
+        self.rent = Subcategory.objects.create(name='Rent', category=self.housing)
+        self.food = Category.objects.create(name='Food', user=self.user)
+        self.bread = Subcategory.objects.create(name='Bread', category=self.food)
+        self.salary = IncomeCategory.objects.create(name='Salary', user=self.user)
+        months = [amortization.add_months(date(2023, 6, 1), number) for number in range(12)]
+        expenses = [Expense(user=self.user, category=self.housing, subcategory=self.rent, amount=500,
+                            date=month.replace(day=5)) for month in months]
+        expenses += [Expense(user=self.user, category=self.food, subcategory=self.bread, amount=120,
+                             date=month.replace(day=20)) for month in months[:3]]
+        Expense.objects.bulk_create(expenses)
+        # Премия в одном месяце не меняет медиану регулярного дохода.
+        Income.objects.bulk_create(Income(user=self.user, amount=5000 if number == 11 else 2000, description='Pay',
+                                          income_category=self.salary, date=month.replace(day=10))
+                                   for number, month in enumerate(months))
+        rebuild_rollups([self.user.id])
+        debt = Debts.objects.create(user=self.user, amount=1200, description='Loan', start_date=date(2024, 6, 20),
+                                    repayment_period_months=12, end_date=date(2025, 6, 20), interest_rate=0)
+        amortization.materialize_schedules([debt])
+
+    def test_monthly_forecast(self):
+        projection = forecast.cash_flow_forecast([self.user.id], 12, today=self.today)
+        self.assertEqual(projection['periods'][:2], ['2024-07', '2024-08'])
+        self.assertEqual(len(projection['periods']), 12)
+        self.assertEqual(projection['income'][0], 2000)
+        self.assertEqual(projection['expense'][0], 530)
+        self.assertEqual(projection['debt'][:2], [100, 100])
+        self.assertEqual(projection['net'][0], 1370)
+        self.assertEqual(projection['balance'][1], 2740)
+        self.assertEqual(projection['total_debt'], 1200)
+        self.assertEqual([(item['name'], item['monthly'], item['recurring']) for item in projection['categories']],
+                         [('Housing', 500, True), ('Food', 30, False), ('Salary', 2000, True)])
+
+    def test_daily_forecast_places_recurring_items_on_their_day(self):
+        projection = forecast.cash_flow_forecast([self.user.id], 3, forecast.DAILY, today=self.today)
+        self.assertEqual(projection['periods'][0], '2024-07-01')
+        self.assertEqual(projection['periods'][-1], '2024-09-30')
+        income = dict(zip(projection['periods'], projection['income']))
+        self.assertEqual({day for day, amount in income.items() if amount}, {'2024-07-10', '2024-08-10', '2024-09-10'})
+        expense = dict(zip(projection['periods'], projection['expense']))
+        self.assertAlmostEqual(expense['2024-07-05'], 500 + 30 / 31, places=2)
+        self.assertAlmostEqual(expense['2024-07-06'], 30 / 31, places=2)
+        self.assertEqual(dict(zip(projection['periods'], projection['debt']))['2024-07-20'], 100)
+        self.assertAlmostEqual(projection['total_expense'], 3 * 530, places=1)
+
+    def test_forecast_is_cached_per_ledger_version(self):
+        with mock.patch('budget.forecast.cash_flow_forecast', wraps=forecast.cash_flow_forecast) as compute:
+            first = self.client.get(reverse('forecast_data'), {'months': 3}).json()
+            self.client.get(reverse('forecast_data'), {'months': 3}, HTTP_CACHE_CONTROL='no-cache')
+            self.client.get(reverse('forecast_report'), {'months': 3})
+            self.assertEqual(compute.call_count, 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('add_expense'), {'amount': 100, 'category': self.food.id,
+                                                          'subcategory': self.bread.id, 'date': '2024-05-01'})
+            self.client.get(reverse('forecast_data'), {'months': 3})
+            self.assertEqual(compute.call_count, 2)
+        self.assertEqual(first['currency'], 'BYN')
+        self.assertEqual(len(first['periods']), 3)
+
+    def test_five_year_daily_forecast_for_family(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass1234')
+        start = date(2019, 6, 1)
+        Expense.objects.bulk_create(
+            Expense(user=(self.user, other)[number % 2], category=self.food, subcategory=self.bread,
+                    amount=number % 97 + 1, date=start + timedelta(days=number % 1800))
+            for number in range(5000)
+        )
+        rebuild_rollups([self.user.id, other.id])
+        debts = [Debts.objects.create(user=other, amount=10000, description=f'Loan {number}', start_date=self.today,
+                                      repayment_period_months=60, end_date=date(2029, 6, 15), interest_rate=10)
+                 for number in range(5)]
+        amortization.materialize_schedules(debts)
+        forecast.cash_flow_forecast([self.user.id], 1, forecast.DAILY, today=self.today)
+
+        started = time.perf_counter()
+        projection = forecast.cash_flow_forecast([self.user.id, other.id], 60, forecast.DAILY, today=self.today)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(len(projection['periods']), 1826)
+        self.assertGreater(projection['total_debt'], 50000)
+
+
+class CategoryTreeTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.food = Category.objects.create(name='Food', user=self.user)
+        self.bread = Subcategory.objects.create(name='Bread', category=self.food)
+        self.milk = Subcategory.objects.create(name='Milk', category=self.food)
+        self.empty = Category.objects.create(name='Empty', user=self.user)
+        self.foreign = Category.objects.create(name='Foreign', user=self.other)
+        self.foreign_sub = Subcategory.objects.create(name='Foreign sub', category=self.foreign)
+
+    def test_tree_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            tree = category_tree(self.user.id)
+        self.assertEqual(tree, [
+            {'id': self.empty.id, 'name': 'Empty', 'subcategories': []},
+            {'id': self.food.id, 'name': 'Food', 'subcategories': [{'id': self.bread.id, 'name': 'Bread'},
+                                                                   {'id': self.milk.id, 'name': 'Milk'}]},
+        ])
+        with self.assertNumQueries(0):
+            category_tree(self.user.id)
+        response = self.client.get(reverse('category_tree'))
+        self.assertEqual(response.json()['categories'], tree)
+        self.assertEqual(self.client.get(reverse('category_tree'), HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+
+    def test_new_category_bumps_version(self):
+        category_tree(self.user.id)
+        self.client.post(reverse('add_category'), {'name': 'Travel'})
+        self.assertIn('Travel', [category['name'] for category in category_tree(self.user.id)])
+
+    def test_add_expense_validates_against_cached_tree(self):
+        category_tree(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_expense'), {'amount': 10, 'category': self.food.id,
+                                                      'subcategory': self.milk.id, 'date': '2024-04-17'})
+        self.assertFalse([query for query in queries if 'FROM "budget_category"' in query['sql']
+                          or 'FROM "budget_subcategory"' in query['sql']])
+        self.assertTrue(Expense.objects.filter(user=self.user, subcategory=self.milk).exists())
+
+        self.client.post(reverse('add_expense'), {'amount': 10, 'category': self.foreign.id,
+                                                  'subcategory': self.foreign_sub.id, 'date': '2024-04-17'})
+        self.client.post(reverse('add_expense'), {'amount': 10, 'category': self.empty.id,
+                                                  'subcategory': self.bread.id, 'date': '2024-04-17'})
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_form_lists_subcategories_of_selected_category(self):
+        response = self.client.get(reverse('add_expense'), {'category': self.food.id})
+        self.assertEqual([item['name'] for item in response.context['subcategories']], ['Bread', 'Milk'])
+        self.assertContains(response, 'id="category-tree"')
+
+
+class BulkOperationsTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.food = Category.objects.create(name='Food', user=self.user)
+        self.bread = Subcategory.objects.create(name='Bread', category=self.food)
+        self.travel = Category.objects.create(name='Travel', user=self.user)
+        self.hotel = Subcategory.objects.create(name='Hotel', category=self.travel)
+        self.salary = IncomeCategory.objects.create(name='Salary', user=self.user)
+        self.bonus = IncomeCategory.objects.create(name='Bonus', user=self.user)
+        self.expenses = [Expense.objects.create(user=self.user, amount=amount, category=self.food,
+                                                subcategory=self.bread, date=on_date)
+                         for amount, on_date in [(10, '2024-03-05'), (20, '2024-04-05'), (30, '2024-04-20')]]
+        other_category = Category.objects.create(name='Food', user=self.other)
+        self.foreign = Expense.objects.create(user=self.other, amount=5, category=other_category, date='2024-04-05',
+                                              subcategory=Subcategory.objects.create(name='Bread',
+                                                                                     category=other_category))
+        self.income = Income.objects.create(user=self.user, amount=100, description='April', date='2024-04-02',
+                                            income_category=self.salary)
+        rebuild_rollups()
+
+    def rollups(self):
+        return sorted(MonthlyLedgerRollup.objects.values_list('user_id', 'year', 'month', 'kind', 'category_id',
+                                                              'subcategory_id', 'income_category_id', 'currency',
+                                                              'total', 'count'))
+
+    def assertRollupsConsistent(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def bulk(self, url_name, **data):
+        return self.client.post(reverse(url_name), data)
+
+    def test_bulk_delete_by_period(self):
+        response = self.bulk('bulk_expenses', action='delete', start_date='2024-04-01', end_date='2024-04-30')
+        self.assertEqual(response.json(), {'action': 'delete', 'affected': 2})
+        self.assertEqual(list(Expense.objects.filter(user=self.user).values_list('amount', flat=True)), [10])
+        self.assertTrue(Expense.objects.filter(id=self.foreign.id).exists())
+        self.assertRollupsConsistent()
+
+    def test_bulk_set_date_and_recategorize_by_ids(self):
+        ids = [self.expenses[0].id, self.expenses[1].id, self.foreign.id]
+        response = self.bulk('bulk_expenses', action='set_date', ids=ids, new_date='2024-05-01')
+        self.assertEqual(response.json()['affected'], 2)
+        self.assertRollupsConsistent()
+        response = self.bulk('bulk_expenses', action='recategorize', category=self.food.id,
+                             new_category=self.travel.id, new_subcategory=self.hotel.id)
+        self.assertEqual(response.json()['affected'], 3)
+        self.assertEqual(Expense.objects.filter(subcategory=self.hotel).count(), 3)
+        self.assertRollupsConsistent()
+
+    def test_bulk_scale(self):
+        response = self.bulk('bulk_expenses', action='scale', ids=[self.expenses[1].id, self.expenses[2].id],
+                             factor='0.333')
+        self.assertEqual(response.json()['affected'], 2)
+        self.assertEqual(sorted(Expense.objects.filter(user=self.user).values_list('amount', flat=True)),
+                         [Decimal('6.66'), Decimal('9.99'), Decimal('10')])
+        self.assertRollupsConsistent()
+
+    def test_bulk_scale_rejects_overflowing_factor(self):
+        for factor in ('10000000', '1e30'):
+            response = self.bulk('bulk_expenses', action='scale', ids=[self.expenses[2].id], factor=factor)
+            self.assertEqual(response.status_code, 400, factor)
+        self.assertEqual(Expense.objects.get(id=self.expenses[2].id).amount, 30)
+        response = self.bulk('bulk_expenses', action='scale', ids=[self.expenses[2].id], factor='3000000')
+        self.assertEqual(Expense.objects.get(id=self.expenses[2].id).amount, Decimal('90000000'))
+
+    def test_locked_rows_are_changed_in_batches(self):
+        with mock.patch('budget.bulk.LOCK_BATCH_SIZE', 2):
+            response = self.bulk('bulk_expenses', action='set_date', category=self.food.id, new_date='2024-06-01')
+            self.assertEqual(response.json()['affected'], 3)
+            self.assertRollupsConsistent()
+            response = self.bulk('bulk_expenses', action='delete', category=self.food.id)
+            self.assertEqual(response.json()['affected'], 3)
+        self.assertRollupsConsistent()
+
+    def test_bulk_incomes(self):
+        response = self.bulk('bulk_incomes', action='recategorize', ids=[self.income.id],
+                             new_income_category=self.bonus.id)
+        self.assertEqual(response.json()['affected'], 1)
+        self.assertRollupsConsistent()
+        response = self.bulk('bulk_incomes', action='delete', income_category=self.bonus.id)
+        self.assertEqual(response.json()['affected'], 1)
+        self.assertFalse(Income.objects.exists())
+        self.assertRollupsConsistent()
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self.bulk('bulk_expenses', action='delete').status_code, 400)
+        self.assertEqual(self.bulk('bulk_expenses', action='scale', ids=[self.expenses[0].id],
+                                   factor='-1').status_code, 400)
+        other_category = Category.objects.get(user=self.other)
+        self.assertEqual(self.bulk('bulk_expenses', action='recategorize', ids=[self.expenses[0].id],
+                                   new_category=other_category.id,
+                                   new_subcategory=other_category.subcategories.get().id).status_code, 400)
+        self.assertEqual(self.client.get(reverse('bulk_expenses')).status_code, 405)
+        self.assertEqual(Expense.objects.count(), 4)
+
+
+class CategorySoftDeleteTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.food = Category.objects.create(name='Food', user=self.user)
+        self.bread = Subcategory.objects.create(name='Bread', category=self.food)
+        self.travel = Category.objects.create(name='Travel', user=self.user)
+        self.hotel = Subcategory.objects.create(name='Hotel', category=self.travel)
+        self.salary = IncomeCategory.objects.create(name='Salary', user=self.user)
+        for amount in range(1, 6):
+            Expense.objects.create(user=self.user, amount=amount, category=self.food, subcategory=self.bread,
+                                   date=date.today())
+        Expense.objects.create(user=self.user, amount=100, category=self.travel, subcategory=self.hotel,
+                               date=date.today())
+        Income.objects.create(user=self.user, amount=50, description='Salary', income_category=self.salary,
+                              date=date.today())
+        rebuild_rollups()
+
+    def test_deleted_category_is_hidden_at_once(self):
+        self.client.post(reverse('delete_category', kwargs={'category_id': self.food.id}))
+        self.assertFalse(Category.objects.filter(id=self.food.id).exists())
+        self.assertTrue(Category.all_objects.filter(id=self.food.id).exists())
+        self.assertEqual(Expense.objects.filter(category=self.food).count(), 5)
+        self.assertEqual([expense.amount for expense in Expense.objects.for_scope(self.user)], [100])
+        self.assertEqual(reports.month_summary([self.user.id], date.today().year, date.today().month)['total_expense'],
+                         100)
+        self.assertEqual([category['name'] for category in category_tree(self.user.id)], ['Travel'])
+        rebuild_rollups()
+        self.assertFalse(MonthlyLedgerRollup.objects.filter(category=self.food).exists())
+
+    def test_deleted_subcategory_and_income_category_are_hidden(self):
+        self.client.post(reverse('delete_subcategory', kwargs={'subcategory_id': self.hotel.id}))
+        self.client.post(reverse('delete_income_category', kwargs={'category_id': self.salary.id}))
+        self.assertEqual(Expense.objects.for_scope(self.user).count(), 5)
+        self.assertFalse(Income.objects.for_scope(self.user).exists())
+        self.assertEqual(category_tree(self.user.id)[1], {'id': self.travel.id, 'name': 'Travel',
+                                                          'subcategories': []})
+        self.assertEqual(len(search_ledger([self.user.id], 'salary')), 0)
+
+    def test_purge_removes_rows_in_batches(self):
+        self.client.post(reverse('delete_category', kwargs={'category_id': self.food.id}))
+        self.client.post(reverse('delete_income_category', kwargs={'category_id': self.salary.id}))
+        self.assertEqual(purge_deleted(batch_size=2, max_batches=2), {'budget_expense': 4})
+        self.assertEqual(Expense.objects.filter(category=self.food).count(), 1)
+        self.assertTrue(Category.all_objects.filter(id=self.food.id).exists())
+
+        call_command('purge_deleted_categories', batch_size=2, pause=0, stdout=StringIO())
+        self.assertFalse(Expense.objects.filter(category_id=self.food.id).exists())
+        self.assertFalse(Income.objects.exists())
+        self.assertFalse(Category.all_objects.filter(id=self.food.id).exists())
+        self.assertFalse(Subcategory.all_objects.filter(id=self.bread.id).exists())
+        self.assertFalse(IncomeCategory.all_objects.exists())
+        self.assertEqual(Expense.objects.count(), 1)
+
+
 class ReportTestCase(TestCase):
     def setUp(self):
         self.client = Client()
@@ -194,16 +686,76 @@ class ReportTestCase(TestCase):
         self.client.login(username='testuser', password='testpass1234')
         self.category = Category.objects.create(user=self.user, name='TestCategory')
         self.subcategory = Subcategory.objects.create(name='TestSubcategory', category=self.category)
-        self.expense = Expense.objects.create(user=self.user, amount=100, category=self.category,
-                                              subcategory=self.subcategory, date=date.today())
+        self.client.post(reverse('add_expense'), {
+            'amount': 100, 'category': self.category.id, 'subcategory': self.subcategory.id,
+            'date': date.today().isoformat(),
+        })
         self.income_category = IncomeCategory.objects.create(user=self.user, name='TestIncomeCategory')
-        self.income = Income.objects.create(user=self.user, amount=200, description='Test Income', date=date.today(),
-                                            income_category=self.income_category)
+        self.client.post(reverse('add_income'), {
+            'amount': 200, 'description': 'Test Income', 'income_category': self.income_category.id,
+            'date': date.today().isoformat(),
+        })
 
     def test_income_expense_report(self):
         response = self.client.get(reverse('income_expense_report'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'budget/income_expense_report.html')
+        self.assertEqual(response.context['chart_url'], reverse('income_expense_chart', args=['svg'])
+                         + f'?month={date.today().month}&year={date.today().year}')
+
+    def test_invalid_period_is_bad_request(self):
+        for params in ({'month': 'abc'}, {'month': 13}, {'month': 0}, {'year': 'x'}):
+            response = self.client.get(reverse('income_expense_data'), params)
+            self.assertEqual(response.status_code, 400, params)
+        url = reverse('category_expense_data', kwargs={'category_id': self.category.id, 'month': 13, 'year': 2024})
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_category_of_another_user_is_not_found(self):
+        stranger = User.objects.create_user(username='stranger', email='s@example.com', password='testpass1234')
+        secret = Category.objects.create(user=stranger, name='SecretB')
+        kwargs = {'category_id': secret.id, 'month': 10, 'year': 2026}
+        for name, extra in [('category_expense_report', {}), ('category_expense_data', {}),
+                            ('category_expense_chart', {'fmt': 'svg'})]:
+            response = self.client.get(reverse(name, kwargs={**kwargs, **extra}))
+            self.assertEqual(response.status_code, 404, name)
+            self.assertNotContains(response, 'SecretB', status_code=404)
+
+    def test_income_expense_data(self):
+        response = self.client.get(reverse('income_expense_data'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['period'], date.today().strftime('%Y-%m'))
+        self.assertEqual(Decimal(data['total_income']), 200)
+        self.assertEqual(Decimal(data['total_expense']), 100)
+        self.assertEqual([(item['name'], Decimal(item['total'])) for item in data['categories']],
+                         [('TestCategory', 100)])
+
+    def test_income_expense_chart_is_svg(self):
+        response = self.client.get(reverse('income_expense_chart', args=['svg']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+        self.assertEqual(self.client.get(reverse('income_expense_chart', args=['gif'])).status_code, 404)
+
+    def test_category_expense_data_and_chart(self):
+        kwargs = {'category_id': self.category.id, 'month': date.today().month, 'year': date.today().year}
+        data = self.client.get(reverse('category_expense_data', kwargs=kwargs)).json()
+        self.assertEqual([(item['name'], Decimal(item['total'])) for item in data['subcategories']],
+                         [('TestSubcategory', 100)])
+        response = self.client.get(reverse('category_expense_chart', kwargs={**kwargs, 'fmt': 'png'}))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+    def test_trend_report(self):
+        response = self.client.get(reverse('trend_report'), {'months': 24})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['months'], 24)
+        self.assertEqual(len(response.context['trend']['months']), 24)
+        data = self.client.get(reverse('trend_data'), {'months': 7}).json()
+        self.assertEqual(len(data['months']), 12)
+        self.assertEqual(Decimal(data['balance'][-1]), 100)
+        response = self.client.get(reverse('trend_chart', args=['svg']))
+        self.assertIn(b'<svg', response.content)
 
     def test_select_category_report(self):
         response = self.client.get(reverse('select_category_report'))
@@ -224,6 +776,9 @@ class FamilyManagementTestCase(TestCase):
         self.user2 = User.objects.create_user(username='testuser2', email='test@example.com', password='testpass1234')
         self.client.login(username='testuser1', password='testpass1234')
 
+    def tearDown(self):
+        clear_caches()
+
     def test_create_family(self):
         response = self.client.post(reverse('create_family'), {
             'family_name': 'Test Family'
@@ -265,3 +820,815 @@ class FamilyManagementTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertFalse(FamilyMember.objects.filter(user=self.user1, family=family).exists())
         self.assertFalse(FamilyMember.objects.filter(user=self.user2, family=family).exists())
+
+
+class LedgerScopeTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.relative = User.objects.create_user(username='relative', email='test@example.com',
+                                                 password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family)
+        FamilyMember.objects.create(user=self.relative, family=self.family)
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_scope_is_resolved_in_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            scope = resolve_scope(self.user)
+        self.assertTrue(scope.is_family)
+        self.assertEqual(scope.key, f'family:{self.family.id}')
+        self.assertEqual(scope.user_ids, tuple(sorted([self.user.id, self.relative.id])))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_scope(self.user).user_ids, scope.user_ids)
+
+    def test_user_without_family(self):
+        FamilyMember.objects.all().delete()
+        scope = resolve_scope(self.user)
+        self.assertFalse(scope.is_family)
+        self.assertEqual(scope.key, f'user:{self.user.id}')
+        self.assertEqual(scope.user_ids, (self.user.id,))
+
+    def test_family_expenses_are_listed(self):
+        category = Category.objects.create(name='Food', user=self.relative)
+        subcategory = Subcategory.objects.create(name='Bread', category=category)
+        Expense.objects.create(user=self.relative, amount=10, category=category, subcategory=subcategory,
+                               date=date.today())
+        response = self.client.get(reverse('expense_list'))
+        self.assertEqual(len(response.context['expenses']), 1)
+
+    def test_leave_family_invalidates_scope(self):
+        resolve_scope(self.user)
+        resolve_scope(self.relative)
+        self.client.post(reverse('leave_family'))
+        self.assertFalse(resolve_scope(self.user).is_family)
+        self.assertEqual(resolve_scope(self.relative).user_ids, (self.relative.id,))
+
+    def test_join_family_invalidates_scope(self):
+        newcomer = User.objects.create_user(username='newcomer', email='test@example.com', password='testpass1234')
+        resolve_scope(self.user)
+        resolve_scope(newcomer)
+        family_token = FamilyToken.objects.create(family=self.family)
+        self.client.login(username='newcomer', password='testpass1234')
+        self.client.post(reverse('join_family'), {'family_token': family_token.token})
+        self.assertIn(newcomer.id, resolve_scope(self.user).user_ids)
+        self.assertEqual(resolve_scope(newcomer).key, f'family:{self.family.id}')
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        category = Category.objects.create(name='Food', user=self.user)
+        subcategory = Subcategory.objects.create(name='Bread', category=category)
+        # По две операции на дату, чтобы проверить порядок по id внутри одного дня.
+        for day in range(1, 13):
+            for amount in (day, day + 100):
+                Expense.objects.create(user=self.user, amount=amount, category=category, subcategory=subcategory,
+                                       date=date(2024, 3, day))
+        self.expenses = Expense.objects.filter(user=self.user)
+        self.ordered_ids = list(self.expenses.order_by('date', 'id').values_list('id', flat=True))
+
+    def test_walks_forward_and_back_without_gaps(self):
+        paginator = KeysetPaginator(self.expenses, 5)
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        seen = [expense.id for expense in page]
+        pages = [page]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(page)
+            seen.extend(expense.id for expense in page)
+        self.assertEqual(seen, self.ordered_ids)
+        self.assertEqual(len(pages), 5)
+
+        previous = paginator.page(pages[-1].previous_cursor)
+        self.assertEqual([expense.id for expense in previous], [expense.id for expense in pages[-2]])
+        self.assertTrue(previous.has_next())
+        self.assertTrue(previous.has_previous())
+
+    def test_deep_page_costs_one_query(self):
+        paginator = KeysetPaginator(self.expenses, 5)
+        cursor = paginator.page(paginator.page(paginator.page().next_cursor).next_cursor).next_cursor
+        with self.assertNumQueries(1):
+            page = paginator.page(cursor)
+            list(page)
+        self.assertEqual(page[0].id, self.ordered_ids[15])
+
+    def test_invalid_cursor_returns_first_page(self):
+        page = KeysetPaginator(self.expenses, 5).page('not-a-cursor')
+        self.assertEqual([expense.id for expense in page], self.ordered_ids[:5])
+
+    def test_expense_list_uses_cursor(self):
+        self.client.login(username='testuser', password='testpass1234')
+        response = self.client.get(reverse('expense_list'))
+        next_cursor = response.context['expenses'].next_cursor
+        self.assertContains(response, f'?cursor={next_cursor}')
+        response = self.client.get(reverse('expense_list'), {'cursor': next_cursor})
+        self.assertEqual(response.context['expenses'][0].id, self.ordered_ids[11])
+
+    def test_cursor_beyond_rows_gives_empty_page(self):
+        paginator = KeysetPaginator(self.expenses, 5)
+        for cursor in (encode_cursor(NEXT, date(2030, 1, 1), 999999), encode_cursor(PREVIOUS, date(2000, 1, 1), 0)):
+            page = paginator.page(cursor)
+            self.assertEqual(len(page), 0)
+            self.assertFalse(page.has_other_pages())
+            self.assertIsNone(page.next_cursor)
+            self.assertIsNone(page.previous_cursor)
+        self.client.login(username='testuser', password='testpass1234')
+        response = self.client.get(reverse('expense_list'), {'cursor': encode_cursor(NEXT, date(2030, 1, 1), 999999)})
+        self.assertEqual(response.status_code, 200)
+
+
+class LedgerQuerySetTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.relative = User.objects.create_user(username='relative', email='test@example.com',
+                                                 password='testpass1234')
+        self.stranger = User.objects.create_user(username='stranger', email='test@example.com',
+                                                 password='testpass1234')
+        family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=family)
+        FamilyMember.objects.create(user=self.relative, family=family)
+        self.client.login(username='testuser', password='testpass1234')
+
+    def tearDown(self):
+        clear_caches()
+
+    def add_rows(self, count):
+        today = date.today()
+        for user in (self.user, self.relative, self.stranger):
+            category = Category.objects.create(name=f'Food {user.username}', user=user)
+            subcategory = Subcategory.objects.create(name='Bread', category=category)
+            income_category = IncomeCategory.objects.create(name='Salary', user=user)
+            for _ in range(count):
+                Expense.objects.create(user=user, amount=10, category=category, subcategory=subcategory, date=today)
+                Income.objects.create(user=user, amount=10, description='Salary', income_category=income_category,
+                                      date=today)
+                Debts.objects.create(user=user, amount=100, description='Loan', start_date=today,
+                                     repayment_period_months=10, end_date=today + timedelta(days=300))
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_for_scope_limits_rows_to_family(self):
+        self.add_rows(1)
+        users = set(Expense.objects.for_scope(self.user).values_list('user__username', flat=True))
+        self.assertEqual(users, {'testuser', 'relative'})
+
+    def test_list_views_have_fixed_query_count(self):
+        self.add_rows(1)
+        resolve_scope(self.user)
+        small = {name: self.count_queries(name) for name in ('expense_list', 'income_list', 'debts_list')}
+        self.add_rows(4)
+        large = {name: self.count_queries(name) for name in ('expense_list', 'income_list', 'debts_list')}
+        self.assertEqual(small, large)
+
+
+class ReplicaRouterTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.router = ReplicaRouter()
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_without_replica_everything_goes_to_default(self):
+        self.assertEqual(replica_alias(), 'default')
+        self.assertEqual(read_alias(self.user), 'default')
+
+    def test_router_follows_replica_view_alias(self):
+        self.assertIsNone(self.router.db_for_read(Expense))
+        with reading_from('reports'):
+            self.assertEqual(self.router.db_for_read(Expense), 'reports')
+            self.assertEqual(self.router.db_for_write(Expense), 'default')
+        self.assertIsNone(self.router.db_for_read(Expense))
+
+    @mock.patch('budget.routers.replica_alias', return_value='reports')
+    def test_streamed_rows_are_read_from_replica(self, _):
+        view = replica_view(lambda request: StreamingHttpResponse(
+            self.router.db_for_read(Expense) for _ in range(2)))
+        request = RequestFactory().get('/')
+        request.user = self.user
+        response = view(request)
+        self.assertIsNone(self.router.db_for_read(Expense))
+        self.assertEqual(b''.join(response.streaming_content), b'reportsreports')
+
+    @mock.patch('budget.routers.replica_alias', return_value='reports')
+    def test_user_is_pinned_to_primary_after_write(self, _):
+        self.assertEqual(read_alias(self.user), 'reports')
+        self.client.post(reverse('add_category'), {'name': 'Food'})
+        self.assertEqual(read_alias(self.user), 'default')
+
+    def test_replica_reads_do_not_fill_shared_caches(self):
+        family = Family.objects.create(name='Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=family)
+        render = mock.Mock(return_value=b'chart')
+        with reading_from('reports'), \
+                mock.patch('budget.forecast.cash_flow_forecast', return_value={'periods': []}) as compute:
+            # Алиаса 'reports' нет в DATABASES: чтение состава семьи с реплики завершилось бы ошибкой.
+            scope = resolve_scope(self.user)
+            for _ in range(2):
+                get_or_render_chart(scope.key, '2024-01', 'trend.svg', scope.user_ids, render)
+                forecast.cached_forecast(scope, 3)
+        self.assertEqual(scope.family_id, family.id)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(compute.call_count, 2)
+        for _ in range(2):
+            get_or_render_chart(scope.key, '2024-01', 'trend.svg', scope.user_ids, render)
+        self.assertEqual(render.call_count, 3)
+
+
+class LedgerPartitioningTestCase(TestCase):
+    def test_partitions_cover_range_with_lookahead(self):
+        last_day = partitioning.last_day_ahead(date(2024, 1, 20), partitioning.MONTH, 2)
+        self.assertEqual(last_day, date(2024, 3, 31))
+        starts = partitioning.partition_starts(date(2023, 11, 5), last_day, partitioning.MONTH)
+        self.assertEqual(starts, [date(2023, 11, 1), date(2023, 12, 1), date(2024, 1, 1), date(2024, 2, 1),
+                                  date(2024, 3, 1)])
+        self.assertEqual(partitioning.partition_starts(date(2023, 6, 1), date(2024, 2, 1), partitioning.YEAR),
+                         [date(2023, 1, 1), date(2024, 1, 1)])
+
+    def test_partition_names_round_trip(self):
+        name = partitioning.partition_name('budget_expense', date(2024, 12, 1), partitioning.MONTH)
+        self.assertEqual(name, 'budget_expense_y2024m12')
+        self.assertEqual(partitioning.partition_end(name), date(2025, 1, 1))
+        self.assertEqual(partitioning.partition_end('budget_income_y2023'), date(2024, 1, 1))
+        self.assertIsNone(partitioning.partition_end('budget_income_default'))
+
+    @override_settings(LEDGER_PARTITIONING='week')
+    def test_invalid_interval(self):
+        with self.assertRaises(ImproperlyConfigured):
+            partitioning.partitioning_interval()
+
+    @override_settings(LEDGER_PARTITIONING='month')
+    def test_command_keeps_plain_tables_on_sqlite(self):
+        out = StringIO()
+        call_command('create_ledger_partitions', stdout=out)
+        self.assertIn('только на PostgreSQL', out.getvalue())
+
+
+class LedgerSearchTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.stranger = User.objects.create_user(username='stranger', email='test@example.com',
+                                                 password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        salary = IncomeCategory.objects.create(name='Зарплата', user=self.user)
+        self.bonus = Income.objects.create(user=self.user, amount=300, description='Премия за квартал',
+                                           income_category=salary, date=date(2024, 3, 1))
+        Income.objects.create(user=self.user, amount=100, description='Продажа велосипеда', income_category=salary,
+                              date=date(2024, 3, 2))
+        Debts.objects.create(user=self.user, amount=1000, description='Кредит на велосипед',
+                             start_date=date(2024, 1, 1), repayment_period_months=10, end_date=date(2024, 11, 1))
+        category = Category.objects.create(name='Транспорт', user=self.user)
+        Subcategory.objects.create(name='Велосипед', category=category)
+        other_category = IncomeCategory.objects.create(name='Разное', user=self.stranger)
+        Income.objects.create(user=self.stranger, amount=50, description='Велосипед соседа',
+                              income_category=other_category, date=date(2024, 3, 3))
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_prefix_search_across_sources_and_owner(self):
+        page = search_ledger([self.user.id], 'велосипед')
+        self.assertEqual(sorted(result['kind'] for result in page), ['debt', 'income', 'subcategory'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bonus.description = 'Годовая премия'
+        self.bonus.save()
+        self.assertEqual([result['object'] for result in search_ledger([self.user.id], 'годовая')], [self.bonus])
+        self.assertEqual(len(search_ledger([self.user.id], 'квартал')), 0)
+        self.bonus.delete()
+        self.assertEqual(len(search_ledger([self.user.id], 'годовая')), 0)
+
+    def test_results_are_paginated_by_cursor(self):
+        first = search_ledger([self.user.id], 'велосипед', limit=2)
+        self.assertTrue(first.has_next())
+        second = search_ledger([self.user.id], 'велосипед', cursor=first.next_cursor, limit=2)
+        self.assertFalse(second.has_next())
+        keys = [(result['kind'], result['object'].pk) for result in list(first) + list(second)]
+        self.assertEqual(len(set(keys)), 3)
+
+    def test_candidates_are_capped_per_source(self):
+        salary = IncomeCategory.objects.get(name='Зарплата')
+        for number in range(5):
+            Income.objects.create(user=self.user, amount=1, description=f'Премия {number}', income_category=salary,
+                                  date=date(2024, 4, 1))
+        self.assertEqual(len(search_ledger([self.user.id], 'премия', limit=50)), 6)
+        with mock.patch('budget.search.SEARCH_CANDIDATES', 2):
+            results = list(search_ledger([self.user.id], 'премия', limit=50))
+        # Берутся самые новые совпадения источника.
+        self.assertEqual(len(results), 2)
+        self.assertNotIn(self.bonus.pk, [result['object'].pk for result in results])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'премия'})
+        self.assertContains(response, 'Премия за квартал')
+        self.assertNotContains(response, 'Велосипед соседа')
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        # Два экземпляра с общим L2 ведут себя как два процесса.
+        self.first = TwoTierCache('default', {'OPTIONS': {'SYNC_INTERVAL': 0, 'MAX_ENTRIES': 3}})
+        self.second = TwoTierCache('default', {'OPTIONS': {'SYNC_INTERVAL': 0, 'MAX_ENTRIES': 3}})
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_reads_are_served_from_l1(self):
+        self.first.set('rates', 1)
+        self.assertEqual(self.second.get('rates'), 1)
+        caches['default'].set('rates', 2)
+        self.assertEqual(self.second.get('rates'), 1)
+
+    def test_write_in_one_process_evicts_l1_in_others(self):
+        self.first.set('scope', 'old')
+        self.assertEqual(self.second.get('scope'), 'old')
+        self.first.set('scope', 'new')
+        self.assertEqual(self.second.get('scope'), 'new')
+        self.first.delete('scope')
+        self.assertIsNone(self.second.get('scope'))
+
+    def test_lost_messages_clear_l1(self):
+        self.first.set('scope', 'old')
+        self.assertEqual(self.second.get('scope'), 'old')
+        caches['default'].set('scope', 'new')
+        self.first.delete_many(['other'])
+        caches['default'].delete('tiered-cache:message:2')
+        self.assertEqual(self.second.get('scope'), 'new')
+
+    def test_l1_is_bounded_lru(self):
+        for key in ('a', 'b', 'c'):
+            self.first.set(key, key)
+        self.first.get('a')
+        self.first.set('d', 'd')
+        caches['default'].set('b', 'changed')
+        caches['default'].set('a', 'changed')
+        self.assertEqual(self.first.get('a'), 'a')
+        self.assertEqual(self.first.get('b'), 'changed')
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.category = Category.objects.create(name='Food', user=self.user)
+        self.subcategory = Subcategory.objects.create(name='Bread', category=self.category)
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_unchanged_pages_return_not_modified(self):
+        for name in ('expense_list', 'income_list', 'debts_list', 'income_expense_report'):
+            # Первый ответ выдает CSRF-cookie, которая входит в ETag следующих.
+            self.client.get(reverse(name))
+            etag = self.client.get(reverse(name))['ETag']
+            # Остаются только запросы сессии и пользователя.
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_write_changes_etag(self):
+        etag = self.client.get(reverse('expense_list'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_expense'), {'amount': 100, 'category': self.category.id,
+                                                      'subcategory': self.subcategory.id, 'date': '2024-04-17'})
+        # Первый ответ показывает сообщение об успехе и не кэшируется.
+        self.assertNotIn('ETag', self.client.get(reverse('expense_list')))
+        response = self.client.get(reverse('expense_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_new_login_changes_etag(self):
+        self.client.get(reverse('expense_list'))
+        etag = self.client.get(reverse('expense_list'))['ETag']
+        self.client.logout()
+        self.client.login(username='testuser', password='testpass1234')
+        response = self.client.get(reverse('expense_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_query_string_is_part_of_etag(self):
+        etag = self.client.get(reverse('income_list'))['ETag']
+        response = self.client.get(reverse('income_list'), {'month': 1, 'year': 2024}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class PeriodFilterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.category = Category.objects.create(name='Test Category', user=self.user)
+        self.subcategory = Subcategory.objects.create(name='Test Subcategory', category=self.category)
+        for expense_date in [date(2023, 11, 30), date(2023, 12, 1), date(2023, 12, 31), date(2024, 1, 1)]:
+            Expense.objects.create(user=self.user, amount=10, category=self.category,
+                                   subcategory=self.subcategory, date=expense_date)
+
+    def test_month_range_wraps_year(self):
+        self.assertEqual(month_range(2023, 12), (date(2023, 12, 1), date(2024, 1, 1)))
+
+    def test_filter_by_month(self):
+        expenses = filter_by_period(Expense.objects.filter(user=self.user), 2023, 12)
+        self.assertEqual(sorted(expenses.values_list('date', flat=True)), [date(2023, 12, 1), date(2023, 12, 31)])
+
+    def test_filter_by_year(self):
+        expenses = filter_by_period(Expense.objects.filter(user=self.user), '2023')
+        self.assertEqual(expenses.count(), 3)
+
+
+class MonthlyLedgerRollupTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.category = Category.objects.create(name='Test Category', user=self.user)
+        self.subcategory = Subcategory.objects.create(name='Test Subcategory', category=self.category)
+        self.income_category = IncomeCategory.objects.create(name='Test Income Category', user=self.user)
+
+    def rollup_totals(self):
+        return {(r.kind, r.year, r.month): (r.total, r.count) for r in MonthlyLedgerRollup.objects.all()}
+
+    def test_expense_views_maintain_rollup(self):
+        for amount in (100, 50):
+            self.client.post(reverse('add_expense'), {
+                'amount': amount, 'category': self.category.id, 'subcategory': self.subcategory.id,
+                'date': '2024-04-17',
+            })
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (150, 2)})
+
+        expense = Expense.objects.get(amount=100)
+        self.client.post(reverse('edit_expense', kwargs={'expense_id': expense.id}), {
+            'category': self.category.id, 'subcategory': self.subcategory.id, 'amount': 70, 'date': '2024-05-01',
+        })
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (50, 1), ('expense', 2024, 5): (70, 1)})
+
+        self.client.post(reverse('delete_expense', kwargs={'expense_id': expense.id}))
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (50, 1)})
+
+    def test_income_views_maintain_rollup(self):
+        self.client.post(reverse('add_income'), {
+            'amount': 300, 'description': 'Salary', 'income_category': self.income_category.id, 'date': '2024-04-17'
+        })
+        income = Income.objects.get()
+        self.client.post(reverse('edit_income', kwargs={'income_id': income.id}), {
+            'amount': 250, 'description': 'Salary', 'income_category': self.income_category.id, 'date': '2024-04-18'
+        })
+        self.assertEqual(self.rollup_totals(), {('income', 2024, 4): (250, 1)})
+        self.client.post(reverse('delete_income', kwargs={'income_id': income.id}))
+        self.assertFalse(MonthlyLedgerRollup.objects.exists())
+
+    def test_admin_maintains_rollup(self):
+        User.objects.create_superuser(username='admin', email='admin@example.com', password='adminpass1234')
+        self.client.login(username='admin', password='adminpass1234')
+        fields = {'user': self.user.id, 'category': self.category.id, 'subcategory': self.subcategory.id,
+                  'currency': 'BYN'}
+        self.client.post(reverse('admin:budget_expense_add'), {**fields, 'amount': 100, 'date': '2024-04-17'})
+        self.client.post(reverse('admin:budget_expense_add'), {**fields, 'amount': 20, 'date': '2024-04-30'})
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (120, 2)})
+
+        expense = Expense.objects.get(amount=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:budget_expense_change', args=[expense.id]),
+                             {**fields, 'amount': 70, 'date': '2024-05-01'})
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (20, 1), ('expense', 2024, 5): (70, 1)})
+
+        self.client.post(reverse('admin:budget_expense_delete', args=[expense.id]), {'post': 'yes'})
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (20, 1)})
+        self.client.post(reverse('admin:budget_expense_changelist'), {
+            'action': 'delete_selected', '_selected_action': list(Expense.objects.values_list('id', flat=True)),
+            'post': 'yes',
+        })
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(MonthlyLedgerRollup.objects.exists())
+
+    def test_rebuild_rollups_command(self):
+        Expense.objects.create(user=self.user, amount=100, category=self.category, subcategory=self.subcategory,
+                               date='2024-04-17')
+        Expense.objects.create(user=self.user, amount=20, category=self.category, subcategory=self.subcategory,
+                               date='2024-04-30')
+        Income.objects.create(user=self.user, amount=300, description='Salary', income_category=self.income_category,
+                              date='2024-03-01')
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup_totals(), {('expense', 2024, 4): (120, 2), ('income', 2024, 3): (300, 1)})
+
+    def test_category_report_reads_rollup(self):
+        Expense.objects.create(user=self.user, amount=100, category=self.category, subcategory=self.subcategory,
+                               date='2024-04-17')
+        rebuild_rollups([self.user.id])
+        response = self.client.get(reverse('category_expense_report',
+                                           kwargs={'category_id': self.category.id, 'month': 4, 'year': 2024}))
+        self.assertEqual(response.context['subcategories_data'],
+                         [{'name': 'Test Subcategory', 'total_expense': 100}])
+
+
+class ChartCacheTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.category = Category.objects.create(user=self.user, name='TestCategory')
+        self.subcategory = Subcategory.objects.create(name='TestSubcategory', category=self.category)
+        self.client.post(reverse('add_expense'), {
+            'amount': 100, 'category': self.category.id, 'subcategory': self.subcategory.id,
+            'date': date.today().isoformat(),
+        })
+
+    def test_unchanged_report_is_served_from_cache(self):
+        first = self.client.get(reverse('income_expense_chart', args=['svg']))
+        second = self.client.get(reverse('income_expense_chart', args=['svg']))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(chart_cache_stats()['hits'], 1)
+        self.assertEqual(chart_cache_stats()['misses'], 1)
+
+    def test_version_is_bumped_only_after_commit(self):
+        stamp = ledger_stamp([self.user.id])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('add_expense'), {
+                'amount': 50, 'category': self.category.id, 'subcategory': self.subcategory.id,
+                'date': date.today().isoformat(),
+            })
+            self.assertEqual(ledger_stamp([self.user.id]), stamp)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(ledger_stamp([self.user.id]), stamp)
+
+    def test_ledger_write_invalidates_chart(self):
+        self.client.get(reverse('income_expense_chart', args=['svg']))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_expense'), {
+                'amount': 50, 'category': self.category.id, 'subcategory': self.subcategory.id,
+                'date': date.today().isoformat(),
+            })
+        self.client.get(reverse('income_expense_chart', args=['svg']))
+        self.assertEqual(chart_cache_stats()['hits'], 0)
+        self.assertEqual(chart_cache_stats()['misses'], 2)
+
+    def test_full_render_queue_returns_service_unavailable(self):
+        with mock.patch('budget.charts.render_chart', side_effect=charts.ChartQueueFull):
+            response = self.client.get(reverse('income_expense_chart', args=['svg']))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(self.client.get(reverse('income_expense_chart', args=['svg'])).status_code, 200)
+
+
+class ChartRendererTestCase(SimpleTestCase):
+    def test_concurrent_renders_produce_png(self):
+        specs = [charts.category_expense_spec(f'Category {i}', [{'name': 'A', 'total_expense': Decimal('10.50')},
+                                                                 {'name': 'B', 'total_expense': i + 1}])
+                 for i in range(6)]
+        futures = [charts.submit_chart(spec, charts.PNG) for spec in specs]
+        for future in futures:
+            self.assertTrue(future.result(timeout=30).startswith(b'\x89PNG'))
+
+    def test_income_expense_chart(self):
+        spec = charts.income_expense_spec(Decimal('200'), Decimal('100'), Decimal('100'),
+                                          [{'category__name': 'Food', 'total_amount': Decimal('100')}])
+        self.assertTrue(charts.render_chart(spec, charts.PNG).startswith(b'\x89PNG'))
+
+    @override_settings(CHART_RENDER_QUEUE_TIMEOUT=0.01)
+    def test_full_queue_fails_fast(self):
+        charts._get_executor()
+        spec = charts.trend_spec({'months': [], 'income': [], 'expense': [], 'balance': []})
+        with mock.patch.object(charts, '_slots', threading.Semaphore(0)):
+            started = time.monotonic()
+            with self.assertRaises(charts.ChartQueueFull):
+                charts.submit_chart(spec, charts.SVG)
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class StartupImportsTestCase(SimpleTestCase):
+    def test_url_resolution_does_not_import_plotting_or_http_stacks(self):
+        imported = {name for name, *_ in profile_imports(['mysite.urls'])}
+        self.assertIn('budget.views', imported)
+        self.assertNotIn('matplotlib', imported)
+        self.assertNotIn('requests', imported)
+
+
+class StreamingExportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', first_name='Ivan', password='testpass1234')
+        self.relative = User.objects.create_user(username='relative', first_name='Anna', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=family)
+        FamilyMember.objects.create(user=self.relative, family=family)
+        for user in (self.user, self.relative):
+            category = Category.objects.create(name=f'Food {user.username}', user=user)
+            subcategory = Subcategory.objects.create(name='Bread', category=category)
+            for day in (1, 15, 28):
+                Expense.objects.create(user=user, amount=day, category=category, subcategory=subcategory,
+                                       date=date(2024, 2, day))
+        income_category = IncomeCategory.objects.create(name='Salary', user=self.user)
+        Income.objects.create(user=self.user, amount=500, description='February', income_category=income_category,
+                              date=date(2024, 2, 5))
+
+    def tearDown(self):
+        clear_caches()
+
+    def read_csv(self, response):
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(StringIO(content)))
+
+    def test_expenses_are_streamed_in_one_query(self):
+        response = self.client.get(reverse('export_expenses'))
+        rows = self.read_csv(response)
+        self.assertEqual(rows[0], ['Date', 'First name', 'Category', 'Subcategory', 'Amount', 'Currency'])
+        self.assertEqual(rows[1], ['2024-02-01', 'Ivan', 'Food testuser', 'Bread', '1.00', 'BYN'])
+        self.assertEqual(len(rows), 4)
+
+    def test_family_scope_and_date_range(self):
+        response = self.client.get(reverse('export_expenses'),
+                                   {'scope': 'family', 'start_date': '2024-02-10', 'end_date': '2024-02-28'})
+        rows = self.read_csv(response)
+        self.assertEqual(sorted(row[1] for row in rows[1:]), ['Anna', 'Anna', 'Ivan', 'Ivan'])
+
+    def test_income_export(self):
+        rows = self.read_csv(self.client.get(reverse('export_incomes')))
+        self.assertEqual(rows[1], ['2024-02-05', 'Ivan', 'Salary', 'February', '500.00', 'BYN'])
+
+
+class ExpenseImportTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.category = Category.objects.create(name='Food', user=self.user)
+        self.subcategory = Subcategory.objects.create(name='Bread', category=self.category)
+
+    def upload(self, content):
+        return SimpleUploadedFile('expenses.csv', content.encode(), content_type='text/csv')
+
+    def test_import_view_creates_rows_and_reports_errors(self):
+        content = ('Date,First name,Category,Subcategory,Amount\n'
+                   '2024-03-01,Ivan,Food,Bread,10.50\n'
+                   '02.03.2024,Ivan,Transport,Bus,"2,5"\n'
+                   'not a date,Ivan,Food,Bread,1\n'
+                   '2024-03-04,Ivan,Food,Milk,abc\n')
+        response = self.client.post(reverse('import_expenses'), {'csv_file': self.upload(content)})
+        self.assertRedirects(response, reverse('expense_list'), status_code=302, target_status_code=200)
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+        self.assertTrue(Subcategory.objects.filter(category__name='Transport', name='Bus').exists())
+        self.assertFalse(Subcategory.objects.filter(name='Milk').exists())
+        warnings = [str(message) for message in response.wsgi_request._messages]
+        self.assertIn('Строка 4: неверная дата "not a date"', warnings)
+        self.assertIn('Строка 5: неверная сумма "abc"', warnings)
+
+    def test_batches_reuse_categories_and_update_rollups(self):
+        rows = ''.join(f'2024-03-{day:02d},Food,{"Bread" if day % 2 else "Tea"},1\n' for day in range(1, 8))
+        result = ExpenseImporter(self.user, batch_size=2).run(StringIO('Date,Category,Subcategory,Amount\n' + rows))
+        self.assertEqual((result.created, result.errors), (7, []))
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Subcategory.objects.filter(category=self.category, name='Tea').count(), 1)
+        totals = dict(MonthlyLedgerRollup.objects.values_list('subcategory__name', 'total'))
+        self.assertEqual(totals, {'Bread': 4, 'Tea': 3})
+
+    def test_missing_column(self):
+        result = ExpenseImporter(self.user).run(StringIO('Date,Amount\n2024-03-01,1\n'))
+        self.assertEqual(result.created, 0)
+        self.assertEqual(result.errors, [(1, 'в файле нет столбца "Category"')])
+
+
+FAKE_RATES = {'calls': 0, 'rates': [], 'fail': False}
+
+
+def fake_rates_fetcher(on_date=None):
+    FAKE_RATES['calls'] += 1
+    if FAKE_RATES['fail']:
+        raise ConnectionError('upstream is down')
+    return FAKE_RATES['rates']
+
+
+@override_settings(CURRENCY_RATES_FETCHER='budget.tests.fake_rates_fetcher', CURRENCY_RATES_ASYNC_REFRESH=False)
+class CurrencyRateStoreTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        FAKE_RATES.update(calls=0, fail=False, rates=[
+            {'code': 'USD', 'name': 'Доллар США', 'scale': 1, 'rate': Decimal('3.2500')},
+            {'code': 'RUB', 'name': 'Российских рублей', 'scale': 100, 'rate': Decimal('3.5000')},
+        ])
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+
+    def test_rates_are_fetched_once_while_fresh(self):
+        self.assertEqual(currency.get_rates(), {'Доллар США': Decimal('3.25'), 'Российских рублей': Decimal('0.035')})
+        currency.get_rates()
+        self.assertEqual(FAKE_RATES['calls'], 1)
+        self.assertEqual(CurrencyRate.objects.count(), 2)
+
+    def test_stale_rates_are_served_when_upstream_fails(self):
+        currency.get_rates()
+        FAKE_RATES['fail'] = True
+        with override_settings(CURRENCY_RATES_TTL=-1), self.assertLogs('budget.currency', 'ERROR') as logs:
+            self.assertEqual(currency.get_rates()['Доллар США'], Decimal('3.25'))
+            currency.get_rates()
+        self.assertEqual(FAKE_RATES['calls'], 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Не удалось получить курсы валют', logs.output[0])
+
+    def test_stale_rates_are_refreshed(self):
+        currency.get_rates()
+        FAKE_RATES['rates'] = [{'code': 'USD', 'name': 'Доллар США', 'scale': 1, 'rate': Decimal('3.3000')}]
+        with override_settings(CURRENCY_RATES_TTL=-1):
+            currency.get_rates()
+        self.assertEqual(currency.get_rates()['Доллар США'], Decimal('3.3'))
+
+    def test_currency_converter(self):
+        response = self.client.get(reverse('currency_converter'))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('currency_converter'),
+                                    {'from_currency': 'Российских рублей', 'amount': '1000'})
+        self.assertEqual(response.context['result'], '35.00 Белорусских рублей.')
+
+
+class MultiCurrencyReportTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass1234')
+        self.client.login(username='testuser', password='testpass1234')
+        self.food = Category.objects.create(name='Food', user=self.user)
+        self.bread = Subcategory.objects.create(name='Bread', category=self.food)
+        self.travel = Category.objects.create(name='Travel', user=self.user)
+        self.hotel = Subcategory.objects.create(name='Hotel', category=self.travel)
+        self.salary = IncomeCategory.objects.create(name='Salary', user=self.user)
+        ExchangeRate.objects.create(currency='USD', date=date(2024, 4, 1), rate=Decimal('3.2'))
+        ExchangeRate.objects.create(currency='USD', date=date(2024, 4, 10), rate=Decimal('3.3'))
+
+    def add_expense(self, amount, category, subcategory, on_date, currency_code):
+        self.client.post(reverse('add_expense'), {
+            'amount': amount, 'category': category.id, 'subcategory': subcategory.id, 'date': on_date,
+            'currency': currency_code,
+        })
+
+    def test_month_summary_converts_with_rate_of_the_day(self):
+        self.add_expense(100, self.food, self.bread, '2024-04-05', 'BYN')
+        self.add_expense(10, self.food, self.bread, '2024-04-05', 'USD')
+        self.add_expense(100, self.travel, self.hotel, '2024-04-12', 'USD')
+        Income.objects.create(user=self.user, amount=1000, description='April', income_category=self.salary,
+                              date=date(2024, 4, 2), currency='USD')
+        rebuild_rollups([self.user.id])
+
+        summary = reports.month_summary([self.user.id], 2024, 4)
+        self.assertEqual(summary['total_expense'], Decimal('462'))
+        self.assertEqual(summary['total_income'], Decimal('3200'))
+        self.assertEqual(summary['top_expenses'], [{'category__name': 'Travel', 'total_amount': Decimal('330')},
+                                                   {'category__name': 'Food', 'total_amount': Decimal('132')}])
+        self.assertEqual(summary['unconverted'], 0)
+
+    def test_transactions_without_rate_are_reported(self):
+        self.add_expense(10, self.food, self.bread, '2024-04-05', 'EUR')
+        self.add_expense(10, self.food, self.bread, '2024-03-05', 'USD')
+        self.assertEqual(reports.month_summary([self.user.id], 2024, 4)['unconverted'], 1)
+        self.assertEqual(reports.category_summary([self.user.id], self.food, 2024, 3),
+                         ([{'name': 'Bread', 'total_expense': Decimal(0)}], 1))
+
+    def test_trend_summary_pivots_months_and_converts(self):
+        self.add_expense(100, self.food, self.bread, '2024-03-05', 'BYN')
+        self.add_expense(10, self.food, self.bread, '2024-04-05', 'USD')
+        self.add_expense(100, self.travel, self.hotel, '2024-04-12', 'BYN')
+        Income.objects.create(user=self.user, amount=1000, description='April', income_category=self.salary,
+                              date=date(2024, 4, 2), currency='USD')
+        rebuild_rollups([self.user.id])
+
+        trend = reports.trend_summary([self.user.id], 12, today=date(2024, 5, 20))
+        self.assertEqual(len(trend['months']), 12)
+        self.assertEqual(trend['months'][-3:], ['2024-03', '2024-04', '2024-05'])
+        self.assertEqual(trend['income'][-3:], [0, Decimal('3200'), 0])
+        self.assertEqual(trend['expense'][-3:], [Decimal('100'), Decimal('132'), 0])
+        self.assertEqual(trend['balance'][-3:], [Decimal('-100'), Decimal('3068'), 0])
+        self.assertEqual([(item['name'], item['totals'][-3:]) for item in trend['categories']],
+                         [('Food', [Decimal('100'), Decimal('32'), 0]), ('Travel', [0, Decimal('100'), 0])])
+        self.assertEqual(trend['unconverted'], 0)
+
+    def test_rollups_are_kept_per_currency(self):
+        self.add_expense(10, self.food, self.bread, '2024-04-05', 'USD')
+        self.add_expense(20, self.food, self.bread, '2024-04-06', 'BYN')
+        self.assertEqual(dict(MonthlyLedgerRollup.objects.values_list('currency', 'total')),
+                         {'USD': Decimal(10), 'BYN': Decimal(20)})
+
+    def test_new_rates_invalidate_cached_charts(self):
+        stamp = ledger_stamp([self.user.id])
+        store_rates({'USD': Decimal('3.3')}, date(2024, 4, 10))
+        self.assertEqual(ledger_stamp([self.user.id]), stamp)
+        store_rates({'USD': Decimal('3.4')}, date(2024, 4, 11))
+        self.assertNotEqual(ledger_stamp([self.user.id]), stamp)
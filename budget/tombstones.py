@@ -0,0 +1,92 @@
+"""
+    Мягкое удаление категорий и фоновая очистка их операций.
+
+    Удаление категории, подкатегории или категории дохода только ставит отметку deleted_at
+    и удаляет ее месячные итоги (их немного), поэтому запрос завершается сразу, а операции
+    категории перестают быть видны: менеджеры категорий и alive() у операций их исключают.
+    Сами операции удаляет команда purge_deleted_categories пачками ограниченного размера
+    (DELETE ... WHERE id IN (SELECT id ... LIMIT n)), каждая пачка - в своей короткой транзакции,
+    после чего удаляются и сами категории.
+"""
+import time
+from functools import partial
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_ledger_version
+from .categories import bump_category_version
+from .models import Category, Expense, Income, IncomeCategory, MonthlyLedgerRollup, Subcategory
+
+PURGE_BATCH_SIZE = 5000
+
+# (модель операций, столбец категории, модель категорий)
+PURGE_TARGETS = [
+    (Expense, 'category_id', Category),
+    (Expense, 'subcategory_id', Subcategory),
+    (Income, 'income_category_id', IncomeCategory),
+]
+
+
+@transaction.atomic
+def _soft_delete(model, pk, owner_id, **rollup_filter):
+    model.all_objects.filter(pk=pk).update(deleted_at=timezone.now())
+    rollups = MonthlyLedgerRollup.objects.filter(**rollup_filter)
+    user_ids = set(rollups.values_list('user_id', flat=True).distinct()) | {owner_id}
+    rollups.delete()
+    for user_id in user_ids:
+        transaction.on_commit(partial(bump_ledger_version, user_id))
+    transaction.on_commit(partial(bump_category_version, owner_id))
+
+
+def soft_delete_category(category):
+    _soft_delete(Category, category.pk, category.user_id, category_id=category.pk)
+
+
+def soft_delete_subcategory(subcategory):
+    _soft_delete(Subcategory, subcategory.pk, subcategory.category.user_id, subcategory_id=subcategory.pk)
+
+
+def soft_delete_income_category(category):
+    _soft_delete(IncomeCategory, category.pk, category.user_id, income_category_id=category.pk)
+
+
+def _purge_batch(model, column, category_model, batch_size):
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    categories = qn(category_model._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ('
+                       f'SELECT id FROM {table} WHERE {qn(column)} IN '
+                       f'(SELECT id FROM {categories} WHERE deleted_at IS NOT NULL) LIMIT %s)', [batch_size])
+        return cursor.rowcount
+
+
+def purge_deleted(batch_size=PURGE_BATCH_SIZE, pause=0.0, max_batches=None):
+    """
+        Удаляет операции категорий, помеченных удаленными, пачками по batch_size строк
+        с паузой pause секунд между пачками, а затем сами категории.
+        Если задан max_batches и он исчерпан, категории остаются до следующего запуска.
+        Возвращает словарь {таблица: число удаленных строк}.
+    """
+    purged = {}
+    batches = 0
+    for model, column, category_model in PURGE_TARGETS:
+        table = model._meta.db_table
+        while True:
+            if max_batches is not None and batches >= max_batches:
+                return purged
+            deleted = _purge_batch(model, column, category_model, batch_size)
+            batches += 1
+            purged[table] = purged.get(table, 0) + deleted
+            if deleted < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+
+    # Операций больше нет, поэтому каскадное удаление категорий проверяет только пустые связи.
+    with transaction.atomic():
+        for model in (Subcategory, Category, IncomeCategory):
+            deleted, _ = model.all_objects.deleted().delete()
+            purged[model._meta.db_table] = deleted
+    return purged
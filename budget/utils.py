@@ -0,0 +1,38 @@
+from datetime import date
+
+
+def month_range(year, month):
+    """
+        Возвращает полуоткрытый интервал [первый день месяца, первый день следующего месяца).
+    """
+    first_day = date(year, month, 1)
+    if month == 12:
+        next_month = date(year + 1, 1, 1)
+    else:
+        next_month = date(year, month + 1, 1)
+    return first_day, next_month
+
+
+def year_range(year):
+    """
+        Возвращает полуоткрытый интервал [1 января, 1 января следующего года).
+    """
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def period_range(year, month=None):
+    """
+        Возвращает интервал за месяц, если он указан, иначе за весь год.
+    """
+    if month:
+        return month_range(int(year), int(month))
+    return year_range(int(year))
+
+
+def filter_by_period(queryset, year, month=None, field='date'):
+    """
+        Фильтрует queryset по месяцу или году условием field >= начало AND field < конец.
+        В отличие от date__month/date__year такое условие использует индекс по дате.
+    """
+    start, end = period_range(year, month)
+    return queryset.filter(**{f'{field}__gte': start, f'{field}__lt': end})
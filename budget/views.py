@@ -1,24 +1,55 @@
-import csv
-from datetime import date, timedelta
+from datetime import date
+from decimal import Decimal, InvalidOperation
 
-import requests
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Q
-from django.http import HttpResponse
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.urls import reverse
 from django.utils import timezone
-from matplotlib import pyplot as plt
-from io import BytesIO
-import base64
-from .forms import CategoryForm, SubcategoryForm, IncomeCategoryForm
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition, require_POST
+from .forms import CategoryForm, SubcategoryForm, IncomeCategoryForm, CSVUploadForm
+from . import amortization, bulk, charts, currency, exports, forecast, reports, rollups, tombstones
+from .cache import bump_ledger_version, get_or_render_chart, ledger_etag
+from .categories import (bump_category_version, category_tree, category_tree_etag, is_valid_choice,
+                         subcategories_of)
+from .importers import import_expenses
+from .pagination import KeysetPaginator
+from .routers import replica_view
+from .search import search_ledger
+from .scope import get_scope, invalidate_family_scope, invalidate_scope
 from .models import Income, Expense, Category, Debts, Family, FamilyMember, Subcategory, IncomeCategory, FamilyToken
+from .utils import filter_by_period
+
+IMPORT_ERRORS_SHOWN = 10
+DEBTS_DUE_SOON_DAYS = 30
+DEBT_STATUSES = {
+    'outstanding': 'Не оплачено',
+    'paid': 'Оплачено',
+    'due': f'Заканчиваются в ближайшие {DEBTS_DUE_SOON_DAYS} дней',
+}
+
+
+def _posted_currency(request, default=None):
+    """
+        Возвращает код валюты из формы, а если валюта не выбрана или неизвестна - default или базовую валюту.
+    """
+    currency_code = request.POST.get('currency')
+    if currency_code in settings.LEDGER_CURRENCIES:
+        return currency_code
+    return default or settings.BASE_CURRENCY
 
 
 # -----------------Расходы----------------
 
 @login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
 def expense_list(request):
     """
     Функция представления для отображения списка расходов текущего пользователя или члена семьи.
@@ -26,38 +57,23 @@ def expense_list(request):
     В противном случае отображаются все расходы пользователя.
     """
 
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
-    if not family_member:
-        expenses = Expense.objects.filter(user=current_user).order_by('date')
-    else:
+    scope = get_scope(request)
+    expenses = Expense.objects.for_scope(scope).order_by('date')
+    if scope.is_family:
         today = date.today()
-        current_month = today.month
-        current_year = today.year
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        expenses = Expense.objects.filter(user__familymember__in=family_members, date__month=current_month,
-                                          date__year=current_year).order_by('date')
-    paginator = Paginator(expenses, 11)
-    page_number = request.GET.get('page')
-    try:
-        paginated_expenses = paginator.page(page_number)
-    except PageNotAnInteger:
-        paginated_expenses = paginator.page(1)
-    except EmptyPage:
-        paginated_expenses = paginator.page(paginator.num_pages)
-
-    categories = Category.objects.all()
+        expenses = filter_by_period(expenses, today.year, today.month)
+    paginated_expenses = KeysetPaginator(expenses, 11).page(request.GET.get('cursor'))
     total_amount = expenses.aggregate(total_amount=Sum('amount'))['total_amount'] or 0
 
     return render(request, 'budget/expense_list.html',
-                  {'expenses': paginated_expenses, 'categories': categories, 'total_amount': total_amount})
+                  {'expenses': paginated_expenses, 'total_amount': total_amount})
 
 
 @login_required()
 def add_expense(request):
     """
         Функция представления для добавления нового расхода.
-        Если выбрана категория, динамически загружаются подкатегории на основе выбранной категории.
+        Подкатегории выбранной категории фильтруются на клиенте по дереву категорий из кэша.
     """
     current_user = request.user
     if request.method == 'POST':
@@ -70,26 +86,34 @@ def add_expense(request):
             messages.warning(request, 'Пожалуйста, заполните все поля.')
             return redirect('add_expense')
 
-        category = Category.objects.get(id=category_id)
-        subcategory = Subcategory.objects.get(id=subcategory_id)
-        user = request.user
+        if not is_valid_choice(current_user.id, category_id, subcategory_id):
+            messages.warning(request, 'Выберите категорию и подкатегорию из списка.')
+            return redirect('add_expense')
 
-        Expense.objects.create(user=user, amount=amount, category=category, subcategory=subcategory, date=select_date)
+        with transaction.atomic():
+            expense = Expense.objects.create(user=current_user, amount=amount, category_id=category_id,
+                                             subcategory_id=subcategory_id, date=select_date,
+                                             currency=_posted_currency(request))
+            rollups.apply_expense(expense)
         messages.success(request, 'Расход успешно добавлен!')
 
         return redirect('expense_list')
 
-    categories = Category.objects.filter(user=current_user)
-    subcategories = Subcategory.objects.none()
-
-    selected_category_id = request.GET.get('category')
-    if selected_category_id:
-        selected_category = Category.objects.get(id=selected_category_id)
-        subcategories = selected_category.subcategories.all()
+    tree = category_tree(current_user.id)
+    selected_category_id = request.GET.get('category') or (tree[0]['id'] if tree else '')
 
     return render(request, 'budget/add_expense.html',
-                  {'categories': categories, 'subcategories': subcategories,
-                   'selected_category_id': selected_category_id})
+                  {'categories': tree, 'subcategories': subcategories_of(tree, selected_category_id),
+                   'selected_category_id': str(selected_category_id), 'currencies': settings.LEDGER_CURRENCIES})
+
+
+@login_required()
+@condition(etag_func=category_tree_etag)
+def category_tree_data(request):
+    """
+        Дерево категорий и подкатегорий текущего пользователя в JSON.
+    """
+    return JsonResponse({'categories': category_tree(request.user.id)})
 
 
 @login_required()
@@ -112,6 +136,7 @@ def add_category(request):
             category = form.save(commit=False)
             category.user = request.user
             category.save()
+            bump_category_version(request.user.id)
             messages.success(request, 'Категория успешно добавлена!')
             return redirect('add_expense')
         else:
@@ -128,7 +153,7 @@ def delete_category(request, category_id):
     """
     category = get_object_or_404(Category, id=category_id)
     if category.user == request.user:
-        category.delete()
+        tombstones.soft_delete_category(category)
         messages.success(request, 'Категория удалена!')
         return redirect('category_list')
 
@@ -154,6 +179,7 @@ def add_subcategory(request):
             subcategory = form.save(commit=False)
             subcategory.user = request.user
             subcategory.save()
+            bump_category_version(request.user.id)
             messages.success(request, 'Подкатегория успешно добавлена!')
             return redirect('add_expense')
         else:
@@ -170,29 +196,23 @@ def delete_subcategory(request, subcategory_id):
     """
     subcategory = get_object_or_404(Subcategory, pk=subcategory_id)
     if subcategory.category.user == request.user:
-        subcategory.delete()
+        tombstones.soft_delete_subcategory(subcategory)
         messages.success(request, 'Подкатегория удалена!')
     return redirect('subcategory_list')
 
 
 @login_required()
+@replica_view
 def filter_expenses(request):
     """
         Функция представления для фильтрации расходов по начальной и конечной датам.
     """
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
-    if not family_member:
-        expenses = Expense.objects.filter(user=current_user)
-        total_amount = expenses.aggregate(total_amount=Sum('amount'))['total_amount'] or 0
-    else:
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        expenses = Expense.objects.filter(user__familymember__in=family_members)
-        if start_date and end_date:
-            expenses = expenses.filter(date__range=[start_date, end_date])
-        total_amount = expenses.aggregate(total_amount=Sum('amount'))['total_amount'] or 0
+    expenses = Expense.objects.for_scope(get_scope(request)).order_by('date')
+    if start_date and end_date:
+        expenses = expenses.filter(date__range=[start_date, end_date])
+    total_amount = expenses.aggregate(total_amount=Sum('amount'))['total_amount'] or 0
 
     return render(request, 'budget/expense_list.html',
                   {'expenses': expenses, 'total_amount': total_amount})
@@ -202,11 +222,9 @@ def filter_expenses(request):
 def edit_expense(request, expense_id):
     """
         Функция представления для редактирования существующего расхода.
-        Если выбрана категория, динамически загружаются подкатегории на основе выбранной категории.
+        Подкатегории выбранной категории фильтруются на клиенте по дереву категорий из кэша.
     """
     expense = get_object_or_404(Expense, pk=expense_id)
-    categories = Category.objects.all()
-    subcategories = Subcategory.objects.none()
 
     if request.method == 'POST':
         category_id = request.POST['category']
@@ -214,26 +232,31 @@ def edit_expense(request, expense_id):
         amount = request.POST['amount']
         select_date = request.POST['date']
 
-        category = Category.objects.get(id=category_id)
-        subcategory = Subcategory.objects.get(id=subcategory_id)
+        if not is_valid_choice(expense.user_id, category_id, subcategory_id):
+            messages.warning(request, 'Выберите категорию и подкатегорию из списка.')
+            return redirect('edit_expense', expense_id=expense.id)
 
-        expense.category = category
-        expense.subcategory = subcategory
-        expense.amount = amount
-        expense.date = select_date
-        expense.save()
+        with transaction.atomic():
+            rollups.apply_expense(expense, sign=-1)
+            expense.category_id = int(category_id)
+            expense.subcategory_id = int(subcategory_id)
+            expense.amount = amount
+            expense.date = select_date
+            expense.currency = _posted_currency(request, expense.currency)
+            expense.save()
+            rollups.apply_expense(expense)
 
         messages.success(request, 'Расход успешно изменен!')
         return redirect('expense_list')
 
-    selected_category_id = request.GET.get('category')
-    if selected_category_id:
-        selected_category = Category.objects.get(id=selected_category_id)
-        subcategories = selected_category.subcategories.all()
+    tree = category_tree(expense.user_id)
+    selected_category_id = request.GET.get('category') or expense.category_id
 
     return render(request, 'budget/edit_expense.html', {'expense': expense,
-                                                        'categories': categories, 'subcategories': subcategories,
-                                                        'selected_category_id': expense.category_id})
+                                                        'categories': tree,
+                                                        'subcategories': subcategories_of(tree, selected_category_id),
+                                                        'selected_category_id': str(selected_category_id),
+                                                        'currencies': settings.LEDGER_CURRENCIES})
 
 
 @login_required()
@@ -243,34 +266,87 @@ def delete_expense(request, expense_id):
     """
     expense = get_object_or_404(Expense, pk=expense_id)
     if request.method == 'POST':
-        expense.delete()
+        with transaction.atomic():
+            rollups.apply_expense(expense, sign=-1)
+            expense.delete()
         messages.success(request, 'Расход успешно удален!')
 
     return redirect('expense_list')
 
 
+def _export_params(request):
+    """
+        Возвращает пользователей и период для экспорта: ?scope=family - вся семья,
+        ?start_date=&end_date= - границы периода (включительно).
+    """
+    user_ids = [request.user.id]
+    if request.GET.get('scope') == 'family':
+        user_ids = get_scope(request).user_ids
+    try:
+        start_date = parse_date(request.GET.get('start_date') or '')
+        end_date = parse_date(request.GET.get('end_date') or '')
+    except ValueError:
+        start_date = end_date = None
+    return user_ids, start_date, end_date
+
+
 @login_required()
+@replica_view
 def export_expenses_csv(request):
     """
-        Функция представления для экспорта расходов в CSV файл.
+        Функция представления для потокового экспорта расходов в CSV файл.
     """
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="expenses.csv"'
+    rows = exports.expense_rows(*_export_params(request))
+    return exports.csv_response('expenses.csv', exports.EXPENSE_HEADER, rows)
 
-    writer = csv.writer(response)
-    writer.writerow(['Date', 'First name', 'Category', 'Subcategory', 'Amount'])
 
-    expenses = Expense.objects.filter(user=request.user)
-    for expense in expenses:
-        writer.writerow([expense.date, expense.user.first_name,
-                         expense.category.name, expense.subcategory, expense.amount])
+@login_required()
+@replica_view
+def export_incomes_csv(request):
+    """
+        Функция представления для потокового экспорта доходов в CSV файл.
+    """
+    rows = exports.income_rows(*_export_params(request))
+    return exports.csv_response('incomes.csv', exports.INCOME_HEADER, rows)
 
-    return response
+
+@login_required()
+@replica_view
+def export_debts_csv(request):
+    """
+        Функция представления для потокового экспорта долгов в CSV файл.
+    """
+    rows = exports.debts_rows(*_export_params(request))
+    return exports.csv_response('debts.csv', exports.DEBTS_HEADER, rows)
+
+
+@login_required()
+def import_expenses_csv(request):
+    """
+        Функция представления для пакетного импорта расходов из CSV файла.
+    """
+    if request.method == 'POST':
+        form = CSVUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            result = import_expenses(request.user, form.cleaned_data['csv_file'])
+            if result.created:
+                messages.success(request, f'Импортировано расходов: {result.created}.')
+            for line, error in result.errors[:IMPORT_ERRORS_SHOWN]:
+                messages.warning(request, f'Строка {line}: {error}')
+            if len(result.errors) > IMPORT_ERRORS_SHOWN:
+                messages.warning(request, f'И еще ошибок: {len(result.errors) - IMPORT_ERRORS_SHOWN}.')
+            return redirect('expense_list') if result.created else redirect('import_expenses')
+        messages.warning(request, 'Пожалуйста, выберите файл.')
+    else:
+        form = CSVUploadForm()
+    return render(request, 'budget/import_expenses.html', {'form': form})
 
 
 # -----------------Доходы----------------
 
 @login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
 def income_list(request):
     """
         Функция представления для отображения списка доходов текущего пользователя или члена семьи.
@@ -281,23 +357,12 @@ def income_list(request):
     current_month = today.month if not selected_month else int(selected_month)
     current_year = today.year if not selected_year else int(selected_year)
     years_list = [str(year) for year in range(2020, 2031)]
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
-    if not family_member:
-        incomes = Income.objects.filter(user=current_user).order_by('date')
-    else:
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        incomes = Income.objects.filter(user__familymember__in=family_members, date__month=current_month,
-                                        date__year=current_year).order_by('date')
+    scope = get_scope(request)
+    incomes = Income.objects.for_scope(scope).order_by('date')
+    if scope.is_family:
+        incomes = filter_by_period(incomes, current_year, current_month)
     total_income = incomes.aggregate(total_income=Sum('amount'))['total_income'] or 0
-    paginator = Paginator(incomes, 10)
-    page_number = request.GET.get('page')
-    try:
-        paginated_incomes = paginator.page(page_number)
-    except PageNotAnInteger:
-        paginated_incomes = paginator.page(1)
-    except EmptyPage:
-        paginated_incomes = paginator.page(paginator.num_pages)
+    paginated_incomes = KeysetPaginator(incomes, 10).page(request.GET.get('cursor'))
 
     return render(request, 'budget/income_list.html',
                   {'incomes': paginated_incomes, 'years_list': years_list, 'selected_month': current_month,
@@ -316,12 +381,16 @@ def add_income(request):
         select_date = request.POST['date']
         income_category = IncomeCategory.objects.get(id=income_category_id)
         user = request.user
-        Income.objects.create(user=user, amount=amount, description=description, income_category=income_category,
-                              date=select_date)
+        with transaction.atomic():
+            income = Income.objects.create(user=user, amount=amount, description=description,
+                                           income_category=income_category, date=select_date,
+                                           currency=_posted_currency(request))
+            rollups.apply_income(income)
         messages.success(request, 'Доход успешно добавлен.')
         return redirect('income_list')
     income_category = IncomeCategory.objects.filter(user=request.user)
-    return render(request, 'budget/add_income.html', {'income_category': income_category})
+    return render(request, 'budget/add_income.html',
+                  {'income_category': income_category, 'currencies': settings.LEDGER_CURRENCIES})
 
 
 @login_required()
@@ -360,7 +429,7 @@ def delete_income_category(request, category_id):
     """
     category = get_object_or_404(IncomeCategory, pk=category_id)
     if request.method == 'POST':
-        category.delete()
+        tombstones.soft_delete_income_category(category)
         messages.success(request, 'Категория дохода успешно удалена.')
         return redirect('income_category_list')
 
@@ -373,16 +442,20 @@ def edit_income(request, income_id):
     income = get_object_or_404(Income, pk=income_id)
     income_category = IncomeCategory.objects.filter(user=request.user)
     if request.method == 'POST':
-        income.amount = request.POST['amount']
-        income.description = request.POST['description']
-        income.income_category_id = request.POST['income_category']
-        income.date = request.POST['date']
-        income.save()
+        with transaction.atomic():
+            rollups.apply_income(income, sign=-1)
+            income.amount = request.POST['amount']
+            income.description = request.POST['description']
+            income.income_category_id = request.POST['income_category']
+            income.date = request.POST['date']
+            income.currency = _posted_currency(request, income.currency)
+            income.save()
+            rollups.apply_income(income)
         messages.success(request, 'Доход изменен успешно!')
         return redirect('income_list')
 
     return render(request, 'budget/edit_income.html',
-                  {'income': income, 'income_category': income_category})
+                  {'income': income, 'income_category': income_category, 'currencies': settings.LEDGER_CURRENCIES})
 
 
 @login_required()
@@ -392,35 +465,109 @@ def delete_income(request, income_id):
     """
     income = get_object_or_404(Income, pk=income_id)
     if request.method == 'POST':
-        income.delete()
+        with transaction.atomic():
+            rollups.apply_income(income, sign=-1)
+            income.delete()
         messages.success(request, 'Доход успешно удален!')
     return redirect('income_list')
 
 
+# ---------------------Массовые операции-----------------------------
+
+def _bulk_action(request, model, categories, new_categories):
+    """
+        Выполняет массовую операцию над расходами или доходами области пользователя.
+        Выборка: ids (несколько значений), start_date, end_date и категория; действие - параметр action.
+        Возвращает JSON {'action', 'affected'} или {'error'} с кодом 400.
+    """
+    action = request.POST.get('action')
+    try:
+        queryset = bulk.select_rows(model, get_scope(request).user_ids, ids=request.POST.getlist('ids'),
+                                    start_date=request.POST.get('start_date'),
+                                    end_date=request.POST.get('end_date'), **categories)
+        if action == bulk.DELETE:
+            affected = bulk.bulk_delete(queryset)
+        elif action == bulk.SET_DATE:
+            affected = bulk.bulk_set_date(queryset, request.POST.get('new_date'))
+        elif action == bulk.RECATEGORIZE:
+            if not new_categories:
+                raise ValueError('категория не найдена')
+            affected = bulk.bulk_recategorize(queryset, **new_categories)
+        elif action == bulk.SCALE:
+            affected = bulk.bulk_scale(queryset, request.POST.get('factor'))
+        else:
+            raise ValueError(f'неизвестное действие "{action}"')
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'action': action, 'affected': affected})
+
+
+@login_required()
+@require_POST
+def bulk_expenses(request):
+    """
+        Массовое удаление, перенос на дату, смена категории/подкатегории и изменение сумм расходов.
+        Новая категория и подкатегория (new_category, new_subcategory) должны принадлежать пользователю.
+    """
+    new_category_id = request.POST.get('new_category')
+    new_subcategory_id = request.POST.get('new_subcategory')
+    new_categories = None
+    if new_category_id and new_subcategory_id and is_valid_choice(request.user.id, new_category_id,
+                                                                  new_subcategory_id):
+        new_categories = {'category_id': int(new_category_id), 'subcategory_id': int(new_subcategory_id)}
+    return _bulk_action(request, Expense, {'category_id': request.POST.get('category')}, new_categories)
+
+
+@login_required()
+@require_POST
+def bulk_incomes(request):
+    """
+        Массовое удаление, перенос на дату, смена категории и изменение сумм доходов.
+        Новая категория дохода (new_income_category) должна принадлежать пользователю.
+    """
+    new_category_id = request.POST.get('new_income_category')
+    new_categories = None
+    if new_category_id and new_category_id.isdigit() \
+            and IncomeCategory.objects.filter(id=new_category_id, user=request.user).exists():
+        new_categories = {'income_category_id': int(new_category_id)}
+    return _bulk_action(request, Income, {'income_category_id': request.POST.get('income_category')},
+                        new_categories)
+
+
 # ---------------------Долги-----------------------------
 
 @login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
 def debts_list(request):
     """
         Функция представления для отображения списка долгов текущего пользователя или члена семьи.
     """
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
-    if not family_member:
-        debts = Debts.objects.filter(user=current_user)
+    scope = get_scope(request)
+    today = timezone.now().date()
+    debts = Debts.objects.for_scope(scope).with_schedule(today).with_status(today)
+    status = request.GET.get('status')
+    if status == 'outstanding':
+        debts = debts.outstanding(today)
+    elif status == 'paid':
+        debts = debts.paid(today)
+    elif status == 'due':
+        debts = debts.due_within(DEBTS_DUE_SOON_DAYS, today)
     else:
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        debts = Debts.objects.filter(user__familymember__in=family_members)
-    paginator = Paginator(debts, 10)
-    page_number = request.GET.get('page')
-    try:
-        paginated_debts = paginator.page(page_number)
-    except PageNotAnInteger:
-        paginated_debts = paginator.page(1)
-    except EmptyPage:
-        paginated_debts = paginator.page(paginator.num_pages)
-
-    return render(request, 'budget/debts_list.html', {'debts': paginated_debts})
+        status = None
+    paginated_debts = KeysetPaginator(debts, 10, field='start_date').page(request.GET.get('cursor'))
+
+    # Итоги по всей области (семье), а не по странице: число долгов по статусам и нагрузка по валютам.
+    scope_debts = Debts.objects.filter(user_id__in=scope.user_ids)
+
+    return render(request, 'budget/debts_list.html', {
+        'debts': paginated_debts,
+        'status': status,
+        'statuses': DEBT_STATUSES,
+        'status_counts': scope_debts.status_counts(DEBTS_DUE_SOON_DAYS, today),
+        'due_days': DEBTS_DUE_SOON_DAYS,
+        'obligations': scope_debts.obligations(today),
+    })
 
 
 @login_required()
@@ -435,21 +582,30 @@ def add_debts(request):
         start_date = request.POST.get('start_date')
         repayment_period_months = int(request.POST.get('repayment_period_months'))
         interest_rate = float(request.POST.get('interest_rate'))
+        payment_method = request.POST.get('payment_method')
+        if payment_method not in dict(amortization.METHOD_CHOICES):
+            payment_method = amortization.ANNUITY
         start_date = date.fromisoformat(start_date)
-        end_date = start_date + timedelta(days=repayment_period_months * 30)
-        Debts.objects.create(
-            user=user,
-            amount=amount,
-            description=description,
-            start_date=start_date,
-            repayment_period_months=repayment_period_months,
-            end_date=end_date,
-            interest_rate=interest_rate
-        )
+        end_date = amortization.add_months(start_date, repayment_period_months)
+        with transaction.atomic():
+            debt = Debts.objects.create(
+                user=user,
+                amount=amount,
+                description=description,
+                start_date=start_date,
+                repayment_period_months=repayment_period_months,
+                end_date=end_date,
+                interest_rate=interest_rate,
+                currency=_posted_currency(request),
+                payment_method=payment_method,
+            )
+            amortization.materialize_schedules([debt])
+        bump_ledger_version(user.id)
         messages.success(request, 'Долг успешно добавлен!')
         return redirect('debts_list')
 
-    return render(request, 'budget/add_debts.html')
+    return render(request, 'budget/add_debts.html', {'currencies': settings.LEDGER_CURRENCIES,
+                                                     'payment_methods': amortization.METHOD_CHOICES})
 
 
 @login_required()
@@ -460,6 +616,7 @@ def delete_debts(request, debts_id):
     debts = get_object_or_404(Debts, pk=debts_id)
     if request.method == 'POST':
         debts.delete()
+        bump_ledger_version(debts.user_id)
         messages.success(request, 'Долг успешно удален!')
 
     return redirect('debts_list')
@@ -467,84 +624,215 @@ def delete_debts(request, debts_id):
 
 # ------------------Отчеты------------------------
 
-@login_required()
-def income_expense_report(request):
+def _selected_period(request):
     """
-    Функция отчета о доходах и расходах.
+        Месяц и год отчета из параметров запроса (по умолчанию текущие).
     """
-    selected_month = request.GET.get('month')
-    selected_year = request.GET.get('year')
+    today = date.today()
+    try:
+        selected_month = int(request.GET.get('month') or today.month)
+        selected_year = int(request.GET.get('year') or today.year)
+    except ValueError:
+        raise BadRequest('Неверный месяц или год')
+    return _checked_period(selected_month, selected_year)
 
-    if selected_month:
-        selected_month = int(selected_month)
-    else:
-        selected_month = date.today().month
 
-    if not selected_year:
-        selected_year = date.today().year
+def _checked_period(month, year):
+    if not 1 <= month <= 12 or not 1 <= year <= 9999:
+        raise BadRequest('Неверный месяц или год')
+    return month, year
 
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
 
-    if family_member:
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        family_users = [family_member.user for family_member in family_members]
+def _scope_category(scope, category_id):
+    # Категория должна принадлежать пользователю или его семье, иначе - как будто ее нет.
+    return get_object_or_404(Category, id=category_id, user_id__in=scope.user_ids)
+
+
+def _chart_response(scope, period, chart_type, fmt, spec):
+    if fmt not in charts.CONTENT_TYPES:
+        raise Http404('Неизвестный формат графика')
+    try:
+        content = get_or_render_chart(scope.key, period, f'{chart_type}.{fmt}', scope.user_ids,
+                                      lambda: charts.render_chart(spec, fmt))
+    except charts.ChartQueueFull:
+        response = HttpResponse('Сервер занят отрисовкой графиков, повторите запрос позже', status=503,
+                                content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = '5'
+        return response
+    return HttpResponse(content, content_type=charts.CONTENT_TYPES[fmt])
 
-        incomes = Income.objects.filter(Q(user=current_user) | Q(user__in=family_users),
-                                        date__month=selected_month, date__year=selected_year)
-        expenses = Expense.objects.filter(Q(user=current_user) | Q(user__in=family_users),
-                                          date__month=selected_month, date__year=selected_year)
-    else:
-        incomes = Income.objects.filter(user=current_user, date__month=selected_month, date__year=selected_year)
-        expenses = Expense.objects.filter(user=current_user, date__month=selected_month, date__year=selected_year)
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def income_expense_report(request):
+    """
+    Функция отчета о доходах и расходах.
+    График загружается отдельным запросом (SVG), поэтому сама страница небольшая и кэшируется браузером.
+    """
+    selected_month, selected_year = _selected_period(request)
+    scope = get_scope(request)
+    summary = reports.month_summary(scope.user_ids, selected_year, selected_month)
 
     years_list = [year for year in range(2020, timezone.now().year + 1)]
 
-    if not incomes.exists() and not expenses.exists():
+    if summary is None:
         no_data_message = f"Нет данных о расходах и доходах за выбранный месяц {selected_month} и год {selected_year}."
         return render(request, 'budget/income_expense_report.html', {'no_data_message': no_data_message,
                                                                      'years_list': years_list,
                                                                      'selected_month': selected_month,
                                                                      'selected_year': selected_year})
 
-    total_income = incomes.aggregate(total_income=Sum('amount'))['total_income'] or 0
-    total_expense = expenses.aggregate(total_expense=Sum('amount'))['total_expense'] or 0
-    income_balance = total_income - total_expense
-    top_expenses = expenses.values('category__name').annotate(total_amount=Sum('amount')).order_by('-total_amount')
-
-    fig, axes = plt.subplots(1, 2, figsize=(15, 8))
-    labels = ['Расходы', 'Доходы']
-    amounts = [total_expense, total_income]
-    colors = ['lightblue', 'lightcoral']
-    explode = (0.1, 0)
-    axes[0].pie(amounts, labels=labels, autopct='%1.1f%%', colors=colors, explode=explode, shadow=True, startangle=140)
-    axes[0].set_title('Доходы и расходы')
-
-    axes[0].text(-1.5, 1.5, f'Общий доход: {total_income}', horizontalalignment='center',
-                 verticalalignment='center', fontsize=12)
-    axes[0].text(-1.5, 1.3, f'Расходы: {total_expense}', horizontalalignment='center',
-                 verticalalignment='center', fontsize=12)
-    axes[0].text(-1.5, 1.1, f'Остаток: {income_balance}', horizontalalignment='center',
-                 verticalalignment='center', fontsize=12)
-
-    categories = [expense['category__name'] for expense in top_expenses]
-    top_amounts = [expense['total_amount'] for expense in top_expenses]
-    axes[1].pie(top_amounts, labels=categories, autopct='%1.1f%%', shadow=True, startangle=140)
-    axes[1].set_title('Общий расход по категориям')
-
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    graphic = base64.b64encode(image_png).decode()
-
-    plt.close()
-
-    return render(request, 'budget/income_expense_report.html', {'graphic': graphic,
-                                                                 'years_list': years_list,
-                                                                 'selected_month': selected_month,
-                                                                 'selected_year': selected_year})
+    query = f'?month={selected_month}&year={selected_year}'
+    return render(request, 'budget/income_expense_report.html', {
+        'chart_url': reverse('income_expense_chart', args=[charts.SVG]) + query,
+        'data_url': reverse('income_expense_data') + query,
+        'unconverted': summary['unconverted'],
+        'years_list': years_list,
+        'selected_month': selected_month,
+        'selected_year': selected_year,
+    })
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def income_expense_data(request):
+    """
+        Итоги месяца для отчета о доходах и расходах в JSON.
+    """
+    selected_month, selected_year = _selected_period(request)
+    summary = reports.month_summary(get_scope(request).user_ids, selected_year, selected_month)
+    summary = summary or {'total_income': 0, 'total_expense': 0, 'income_balance': 0, 'top_expenses': [],
+                          'unconverted': 0}
+    return JsonResponse({
+        'period': f'{selected_year}-{selected_month:02d}',
+        'currency': settings.BASE_CURRENCY,
+        'total_income': summary['total_income'],
+        'total_expense': summary['total_expense'],
+        'income_balance': summary['income_balance'],
+        'categories': [{'name': expense['category__name'], 'total': expense['total_amount']}
+                       for expense in summary['top_expenses']],
+        'unconverted': summary['unconverted'],
+    })
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def income_expense_chart(request, fmt):
+    """
+        График отчета о доходах и расходах в формате SVG или PNG.
+    """
+    selected_month, selected_year = _selected_period(request)
+    scope = get_scope(request)
+    summary = reports.month_summary(scope.user_ids, selected_year, selected_month)
+    if summary is None:
+        raise Http404('Нет данных за выбранный месяц')
+    spec = charts.income_expense_spec(summary['total_income'], summary['total_expense'], summary['income_balance'],
+                                      summary['top_expenses'])
+    return _chart_response(scope, f'{selected_year}-{selected_month:02d}', 'income-expense', fmt, spec)
+
+
+def _trend_months(request):
+    try:
+        months = int(request.GET.get('months') or reports.TREND_MONTHS[0])
+    except ValueError:
+        months = reports.TREND_MONTHS[0]
+    return months if months in reports.TREND_MONTHS else reports.TREND_MONTHS[0]
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def trend_report(request):
+    """
+    Функция отчета о динамике доходов и расходов за 12, 24 или 60 месяцев.
+    """
+    months = _trend_months(request)
+    trend = reports.trend_summary(get_scope(request).user_ids, months)
+    query = f'?months={months}'
+    rows = [{'period': period, 'income': income, 'expense': expense, 'balance': balance}
+            for period, income, expense, balance in zip(trend['months'], trend['income'], trend['expense'],
+                                                         trend['balance'])]
+    return render(request, 'budget/trend_report.html', {
+        'chart_url': reverse('trend_chart', args=[charts.SVG]) + query,
+        'data_url': reverse('trend_data') + query,
+        'rows': reversed(rows),
+        'trend': trend,
+        'months': months,
+        'months_choices': reports.TREND_MONTHS,
+    })
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def trend_data(request):
+    """
+        Помесячные ряды доходов, расходов, остатка и расходов по категориям в JSON.
+    """
+    trend = reports.trend_summary(get_scope(request).user_ids, _trend_months(request))
+    return JsonResponse({'currency': settings.BASE_CURRENCY, **trend})
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def trend_chart(request, fmt):
+    """
+        График динамики доходов и расходов в формате SVG или PNG.
+    """
+    months = _trend_months(request)
+    scope = get_scope(request)
+    spec = charts.trend_spec(reports.trend_summary(scope.user_ids, months))
+    return _chart_response(scope, f'{date.today():%Y-%m}-{months}', 'trend', fmt, spec)
+
+
+def _forecast_params(request):
+    try:
+        months = int(request.GET.get('months') or forecast.FORECAST_MONTHS[1])
+    except ValueError:
+        months = forecast.FORECAST_MONTHS[1]
+    if months not in forecast.FORECAST_MONTHS:
+        months = forecast.FORECAST_MONTHS[1]
+    granularity = request.GET.get('granularity')
+    return months, granularity if granularity in forecast.GRANULARITIES else forecast.MONTHLY
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def forecast_report(request):
+    """
+    Функция прогноза доходов, расходов и платежей по долгам на 3-60 месяцев вперед.
+    """
+    months, _ = _forecast_params(request)
+    projection = forecast.cached_forecast(get_scope(request), months)
+    rows = [{'period': period, 'income': income, 'expense': expense, 'debt': debt, 'balance': balance}
+            for period, income, expense, debt, balance in zip(projection['periods'], projection['income'],
+                                                              projection['expense'], projection['debt'],
+                                                              projection['balance'])]
+    return render(request, 'budget/forecast_report.html', {
+        'data_url': reverse('forecast_data') + f'?months={months}',
+        'daily_url': reverse('forecast_data') + f'?months={months}&granularity={forecast.DAILY}',
+        'rows': rows,
+        'forecast': projection,
+        'months': months,
+        'months_choices': forecast.FORECAST_MONTHS,
+    })
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def forecast_data(request):
+    """
+        Прогноз по месяцам или по дням (granularity=day) в JSON.
+    """
+    months, granularity = _forecast_params(request)
+    projection = forecast.cached_forecast(get_scope(request), months, granularity)
+    return JsonResponse({'currency': settings.BASE_CURRENCY, **projection})
 
 
 @login_required()
@@ -571,55 +859,86 @@ def select_category_report(request):
 
 
 @login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
 def category_expense_report(request, category_id, year=None, month=None):
     """
     Функция отчета о расходах по категории.
     """
-    category = get_object_or_404(Category, id=category_id)
-    current_user = request.user
-    family_member = FamilyMember.objects.filter(user=current_user).first()
-    if not family_member:
-        expenses = Expense.objects.filter(user=current_user, category=category)
-    else:
-        family_members = FamilyMember.objects.filter(family=family_member.family)
-        expenses = Expense.objects.filter(user__familymember__in=family_members, category=category)
-    if year:
-        expenses = expenses.filter(date__year=year)
-    if month:
-        expenses = expenses.filter(date__month=month)
-    if not expenses.exists():
+    scope = get_scope(request)
+    category = _scope_category(scope, category_id)
+    if month is not None:
+        _checked_period(month, year)
+    summary = reports.category_summary(scope.user_ids, category, year or date.today().year, month)
+    if summary is None:
         period = f'{date(year, month, 1).strftime("%B")} {year}' if year and month else 'current period'
         message = f"No expenses for category '{category.name}' in {period}."
         return render(request, 'budget/category_expense_report.html', {'message': message})
 
-    subcategory_expenses = expenses.values('subcategory__name').annotate(total_expense=Sum('amount'))
-    subcategories_data = [{'name': expense['subcategory__name'], 'total_expense': expense['total_expense']} for expense
-                          in subcategory_expenses]
-
-    fig, ax = plt.subplots()
-    subcategories_list = [expense['name'] for expense in subcategories_data]
-    sub_expenses_list = [expense['total_expense'] for expense in subcategories_data]
-    ax.pie(sub_expenses_list, labels=subcategories_list, autopct='%1.1f%%')
-    ax.set_title(f'Расходы по категории: {category.name}')
-
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    image_png = buffer.getvalue()
-    buffer.close()
-    graphic = base64.b64encode(image_png).decode()
-
-    plt.close()
+    subcategories_data, unconverted = summary
+    url_kwargs = {'category_id': category.id, 'month': month, 'year': year}
 
     return render(request, 'budget/category_expense_report.html', {
-        'graphic': graphic,
+        'chart_url': reverse('category_expense_chart', kwargs={**url_kwargs, 'fmt': charts.SVG}),
+        'data_url': reverse('category_expense_data', kwargs=url_kwargs),
         'category': category,
         'year': year,
         'month': month,
         'subcategories_data': subcategories_data,
+        'unconverted': unconverted,
     })
 
 
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def category_expense_data(request, category_id, year, month):
+    """
+        Расходы категории по подкатегориям в JSON.
+    """
+    scope = get_scope(request)
+    category = _scope_category(scope, category_id)
+    _checked_period(month, year)
+    subcategories_data, unconverted = reports.category_summary(scope.user_ids, category, year, month) or ([], 0)
+    return JsonResponse({
+        'period': f'{year}-{month:02d}',
+        'currency': settings.BASE_CURRENCY,
+        'category': category.name,
+        'subcategories': [{'name': item['name'], 'total': item['total_expense']} for item in subcategories_data],
+        'unconverted': unconverted,
+    })
+
+
+@login_required()
+@condition(etag_func=ledger_etag)
+@replica_view
+def category_expense_chart(request, category_id, year, month, fmt):
+    """
+        График расходов категории по подкатегориям в формате SVG или PNG.
+    """
+    scope = get_scope(request)
+    category = _scope_category(scope, category_id)
+    _checked_period(month, year)
+    summary = reports.category_summary(scope.user_ids, category, year, month)
+    if summary is None:
+        raise Http404('Нет расходов по категории за выбранный период')
+    spec = charts.category_expense_spec(category.name, summary[0])
+    return _chart_response(scope, f'{year}-{month:02d}', f'category-{category.id}', fmt, spec)
+
+
+# ------------------Поиск------------------------
+
+@login_required()
+@replica_view
+def search(request):
+    """
+        Функция представления для поиска по описаниям доходов и долгов и по названиям категорий.
+    """
+    query = request.GET.get('q', '').strip()
+    results = search_ledger(get_scope(request).user_ids, query, request.GET.get('cursor')) if query else None
+    return render(request, 'budget/search.html', {'query': query, 'results': results})
+
+
 # -----------------Семейный аккаунт----------------
 
 @login_required()
@@ -652,6 +971,7 @@ def create_family(request):
         family = Family.objects.create(name=family_name, created_by=current_user)
         FamilyToken.objects.create(family=family)
         FamilyMember.objects.create(user=request.user, family=family)
+        invalidate_scope(current_user.id)
         messages.success(request, 'Семья успешно создана!')
 
         return redirect('dashboard')
@@ -672,6 +992,7 @@ def join_family(request):
             family_token.is_used = True
             family_token.save()
             FamilyMember.objects.create(user=request.user, family=family)
+            invalidate_family_scope(family.id)
             messages.success(request, 'Вы успешно присоединились к семье!')
 
             family_token.generate_new_token()
@@ -692,7 +1013,10 @@ def leave_family(request):
         Функция представления для выхода из семьи.
     """
     if request.method == 'POST':
-        FamilyMember.objects.filter(user=request.user).delete()
+        family_member = FamilyMember.objects.filter(user=request.user).first()
+        if family_member:
+            family_member.delete()
+            invalidate_family_scope(family_member.family_id, request.user.id)
         messages.success(request, 'Вы покинули семью.')
 
         return redirect('dashboard')
@@ -702,20 +1026,11 @@ def leave_family(request):
 
 # ------------------------Курсы валют-----------------------------
 
-@login_required()
-def get_currency_rates(request):
+def get_currency_rates():
     """
-        Получает текущие курсы валют с внешнего API.
+        Возвращает текущие курсы валют из хранилища курсов (с кэшем и фоновым обновлением).
     """
-    url = 'https://www.nbrb.by/api/exrates/rates?periodicity=0'
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        data = response.json()
-        rates = {rate['Cur_Name']: rate['Cur_OfficialRate'] for rate in data}
-        return rates
-    else:
-        return {}
+    return currency.get_rates()
 
 
 @login_required()
@@ -723,7 +1038,7 @@ def currency_rates(request):
     """
         Отображает страницу с текущими курсами валют.
     """
-    rates = get_currency_rates(request)
+    rates = get_currency_rates()
     return render(request, 'budget/currency.html', {'currency_rates': rates})
 
 
@@ -732,21 +1047,18 @@ def currency_converter(request):
     """
         Отображает страницу для конвертации валюты.
     """
+    rates = get_currency_rates()
+    context = {'currency_rates': rates, 'currencies': rates.keys()}
     if request.method == 'POST':
         from_currency = request.POST.get('from_currency')
+        try:
+            amount = Decimal(request.POST.get('amount', 2))
+        except InvalidOperation:
+            amount = None
 
-        amount = float(request.POST.get('amount', 2))
-
-        rates = get_currency_rates(request)
-        if from_currency in rates:
-            from_rate = rates[from_currency]
-
-            converted_amount = amount * from_rate
-            result = f"{converted_amount:.2f} Белорусских рублей."
-
-        currencies = rates.keys()
-        return render(request, 'budget/currency.html', {'currencies': currencies, 'result': result})
-    else:
-        rates = get_currency_rates()
-        currencies = rates.keys()
-        return render(request, 'budget/currency.html', {'currencies': currencies})
+        if amount is not None and from_currency in rates:
+            converted_amount = amount * rates[from_currency]
+            context['result'] = f"{converted_amount:.2f} Белорусских рублей."
+        else:
+            context['result'] = 'Не удалось выполнить конвертацию: проверьте валюту и сумму.'
+    return render(request, 'budget/currency.html', context)
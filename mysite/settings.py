@@ -46,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'budget.routers.PrimaryPinMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -91,6 +92,24 @@ else:
         }
     }
 
+# Реплика для отчетов, экспорта и списков (только чтение). Включается переменной REPORTS_DB_NAME
+# (для SQLite - путь к копии базы) и/или REPORTS_DB_HOST (для PostgreSQL); без них все идет в default.
+# После записи пользователь REPLICA_PIN_SECONDS секунд читает из основной базы.
+REPORTS_DB_ALIAS = 'reports'
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+if os.getenv('REPORTS_DB_NAME') or os.getenv('REPORTS_DB_HOST'):
+    DATABASES[REPORTS_DB_ALIAS] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('REPORTS_DB_NAME', DATABASES['default']['NAME']),
+        'HOST': os.getenv('REPORTS_DB_HOST', DATABASES['default'].get('HOST', '')),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['budget.routers.ReplicaRouter']
+
+# Секционирование таблиц расходов и доходов по дате на PostgreSQL: 'month', 'year' или пусто (обычные таблицы).
+# Будущие секции создает команда create_ledger_partitions (запускать по расписанию).
+LEDGER_PARTITIONING = os.getenv('LEDGER_PARTITIONING', '')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -142,6 +161,14 @@ if not DEBUG:
             },
         }
     }
+elif os.getenv('SHARED_CACHE_DIR'):
+    # Локальная замена Redis, общая для нескольких процессов (например, runserver и gunicorn -w 2)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('SHARED_CACHE_DIR'),
+        }
+    }
 else:
     CACHES = {
         'default': {
@@ -149,6 +176,33 @@ else:
         }
     }
 
+# Двухуровневый кэш для часто читаемых и редко меняющихся данных (область семьи, категории, курсы валют):
+# LRU в памяти процесса перед общим кэшем 'default' с инвалидацией между процессами.
+CACHES['tiered'] = {
+    'BACKEND': 'budget.cache_backends.TwoTierCache',
+    'LOCATION': 'default',
+    'OPTIONS': {
+        'MAX_ENTRIES': 1000,
+        'SYNC_INTERVAL': 1,
+        'L1_TIMEOUT': 60,
+    },
+}
+
+# Отрисовка графиков отчетов: число потоков пула, таймаут ожидания результата
+# и места в очереди (сек.); при заполненной очереди графики отдаются с кодом 503
+CHART_RENDER_WORKERS = int(os.getenv('CHART_RENDER_WORKERS', 2))
+CHART_RENDER_TIMEOUT = 30
+CHART_RENDER_QUEUE_TIMEOUT = 2
+
+# Валюты операций: базовая валюта отчетов и список валют, доступных при вводе
+BASE_CURRENCY = 'BYN'
+LEDGER_CURRENCIES = ['BYN', 'USD', 'EUR', 'RUB']
+
+# Курсы валют: источник (путь к функции), время жизни кэша и таймаут запроса к API (сек.)
+CURRENCY_RATES_FETCHER = os.getenv('CURRENCY_RATES_FETCHER', 'budget.currency.nbrb_fetcher')
+CURRENCY_RATES_TTL = 60 * 60
+CURRENCY_RATES_TIMEOUT = 5
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]